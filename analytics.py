@@ -0,0 +1,598 @@
+"""Lease analytics from the pool event log.
+
+    python analytics.py                                # data/ logs, oldest first
+    python analytics.py data/python_pool_log.txt       # a legacy text log
+    python analytics.py --follow --interval 60         # keep tailing, one report a minute
+    python analytics.py --quantile 0.99 --headroom 0.2 --output report.json
+
+Reads the JSON-lines event log (python_pool_log.jsonl and its rotated, maybe
+gzipped, backups) and the old free-text python_pool_log.txt ("ENV CLAIMED:
+url by user_..."), in one pass and with memory bounded by the number of
+envs rather than the length of the history. It reports:
+- per-env utilization
+- the lease-duration distribution
+- how many leases expired instead of being released
+- claim wait times
+- the windows during which the pool was empty
+- the time-weighted number of envs in use
+
+The last of these gives the recommended warm pool size.
+
+Distributions are kept as counts in log-spaced bins (quantiles within
+about 5%). When NumPy is installed the bins are filled in vectorized
+batches; without it the same counts are built one value at a time.
+"""
+import argparse
+import bisect
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DATA_DIR = os.environ.get('POOL_DATA_DIR', 'data')
+LEGACY_LOG = 'python_pool_log.txt'
+EVENT_LOG = 'python_pool_log.jsonl'
+BATCH_SIZE = 65536  # Values buffered before a vectorized flush
+READ_SIZE = 1024 * 1024  # Bytes read from a tailed file at a time
+BIN_RATIO = 1.1  # Width of each histogram bin relative to the one before
+DURATION_REPORT_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400)  # Seconds
+
+LEGACY_LINE = re.compile(
+    r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] ENV (ADDED|CLAIMED|RELEASED|EXPIRED): (\S+)'
+    r'(?: by (\S+)| - Python (\S+))?'
+)
+EVENTS = {
+    'ENV_ADDED', 'ENV_CLAIMED', 'ENV_RELEASED', 'ENV_EXPIRED', 'ENV_RESERVED',
+    'RESERVATION_EXPIRED', 'ENV_QUARANTINED', 'ENV_RESTORED', 'ENV_REMOVED', 'CLAIM_REJECTED'
+}
+EVENT_MARKERS = ('"ENV_', '"RESERVATION_EXPIRED"', '"CLAIM_REJECTED"')
+
+
+class Histogram:
+    """Counts of non-negative values in log-spaced bins from low to high."""
+
+    def __init__(self, low, high):
+        self.low = low
+        self.edges = [low]
+        while self.edges[-1] < high:
+            self.edges.append(self.edges[-1] * BIN_RATIO)
+        self.counts = [0] * (len(self.edges) + 1)  # Bin i holds edges[i-1] < value <= edges[i]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.pending = []
+
+    def add(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        values = self.pending
+        self.pending = []
+        self.count += len(values)
+        if np is not None:
+            array = np.asarray(values, dtype=float)
+            self.total += float(array.sum())
+            self.max = max(self.max, float(array.max()))
+            bins = np.bincount(np.searchsorted(self.edges, array, side='left'), minlength=len(self.counts))
+            self.counts = [count + int(extra) for count, extra in zip(self.counts, bins)]
+        else:
+            self.total += sum(values)
+            self.max = max(self.max, max(values))
+            for value in values:
+                self.counts[bisect.bisect_left(self.edges, value)] += 1
+
+    def quantile(self, q):
+        self.flush()
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                if index == 0:
+                    return min(self.low, self.max)
+                if index == len(self.edges):
+                    return self.max
+                return min(math.sqrt(self.edges[index - 1] * self.edges[index]), self.max)
+        return self.max
+
+    def below(self, limit):
+        """Values up to limit, to the resolution of the bins."""
+        self.flush()
+        return sum(self.counts[:bisect.bisect_right(self.edges, limit * math.sqrt(BIN_RATIO))])
+
+    def summary(self, scale=1, digits=1):
+        self.flush()
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count * scale, digits),
+            'p50': round(self.quantile(0.5) * scale, digits),
+            'p90': round(self.quantile(0.9) * scale, digits),
+            'p99': round(self.quantile(0.99) * scale, digits),
+            'max': round(self.max * scale, digits)
+        }
+
+
+class LevelTime:
+    """Seconds spent at each integer level, e.g. number of envs in use."""
+
+    def __init__(self):
+        self.seconds = []
+        self.pending_levels = []
+        self.pending_seconds = []
+
+    def add(self, level, seconds):
+        if seconds <= 0:
+            return
+        self.pending_levels.append(level)
+        self.pending_seconds.append(seconds)
+        if len(self.pending_levels) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_levels:
+            return
+        levels, seconds = self.pending_levels, self.pending_seconds
+        self.pending_levels, self.pending_seconds = [], []
+        if np is not None:
+            sums = np.bincount(np.asarray(levels), weights=np.asarray(seconds, dtype=float))
+            if len(sums) > len(self.seconds):
+                self.seconds.extend([0.0] * (len(sums) - len(self.seconds)))
+            for level in np.flatnonzero(sums):
+                self.seconds[level] += float(sums[level])
+        else:
+            for level, spent in zip(levels, seconds):
+                if level >= len(self.seconds):
+                    self.seconds.extend([0.0] * (level + 1 - len(self.seconds)))
+                self.seconds[level] += spent
+
+    def quantile(self, q):
+        self.flush()
+        total = sum(self.seconds)
+        if not total:
+            return None
+        seen = 0.0
+        for level, spent in enumerate(self.seconds):
+            seen += spent
+            if seen >= q * total:
+                return level
+        return len(self.seconds) - 1
+
+    def mean(self):
+        self.flush()
+        total = sum(self.seconds)
+        return sum(level * spent for level, spent in enumerate(self.seconds)) / total if total else None
+
+
+class EnvStats:
+    __slots__ = ('first_seen', 'busy', 'leases', 'expiries', 'lease_start', 'quarantined')
+
+    def __init__(self, first_seen):
+        self.first_seen = first_seen
+        self.busy = 0.0
+        self.leases = 0
+        self.expiries = 0
+        self.lease_start = None
+        self.quarantined = False
+
+
+class LeaseAnalytics:
+    """Folds pool events, in log order, into lease statistics.
+
+    Leases are tracked by env url, which holds at most one at a time, so
+    reservations and legacy expiry lines (which carry no user_id) fit the
+    same model. Envs first seen in a claim count from that moment; events
+    lost from the log show up as 'inconsistent' rather than being guessed.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.envs = {}
+        self.available = 0
+        self.in_use = 0
+        self.start = None
+        self.last = None
+        self.events = 0
+        self.inconsistent = 0
+        self.counts = dict.fromkeys(('added', 'claimed', 'reserved', 'released', 'expired',
+                                     'reservations_expired', 'rejected'), 0)
+        self.durations = Histogram(1, 30 * 86400)  # Seconds
+        self.waits = Histogram(1, 3600 * 1000)  # Milliseconds
+        self.concurrency = LevelTime()
+        self.empty_since = None
+        self.empty_windows = 0
+        self.empty_seconds = 0.0
+        self.empty_rejections = 0
+        self.window_rejections = 0
+        self.longest_empty = []  # Min-heap of (seconds, start, end, rejections)
+
+    def feed(self, ts, record):
+        if self.start is None:
+            self.start = ts
+        if self.last is not None and ts > self.last:
+            self.concurrency.add(self.in_use, ts - self.last)
+        self.last = max(ts, self.last or ts)
+        self.events += 1
+
+        event = record['event']
+        url = record.get('url')
+        if event == 'CLAIM_REJECTED':
+            self.counts['rejected'] += 1
+            if self.empty_since is not None:
+                self.window_rejections += 1
+            return
+        if not url:
+            return
+        env = self.envs.get(url)
+
+        if event == 'ENV_ADDED':
+            self.counts['added'] += 1
+            if env is None:
+                self.envs[url] = EnvStats(ts)
+                self.set_available(self.available + 1, ts)
+        elif event in ('ENV_CLAIMED', 'ENV_RESERVED'):
+            self.counts['claimed' if event == 'ENV_CLAIMED' else 'reserved'] += 1
+            if event == 'ENV_CLAIMED' and record.get('waited_ms') is not None:
+                self.waits.add(float(record['waited_ms']))
+            if env is None:
+                env = self.envs[url] = EnvStats(ts)
+            elif env.lease_start is not None:
+                # The end of the previous lease never made it into the log
+                self.inconsistent += 1
+                self.end_lease(env, ts, None)
+            elif not env.quarantined:
+                self.set_available(self.available - 1, ts)
+            env.lease_start = ts
+            env.leases += 1
+            self.in_use += 1
+        elif event in ('ENV_RELEASED', 'ENV_EXPIRED', 'RESERVATION_EXPIRED'):
+            if env is None or env.lease_start is None:
+                self.inconsistent += 1
+                return
+            outcome = {'ENV_RELEASED': 'released', 'ENV_EXPIRED': 'expired',
+                       'RESERVATION_EXPIRED': 'reservations_expired'}[event]
+            self.counts[outcome] += 1
+            self.end_lease(env, ts, outcome)
+            if not env.quarantined:
+                self.set_available(self.available + 1, ts)
+        elif event == 'ENV_REMOVED' and env is not None and env.lease_start is None:
+            del self.envs[url]
+            if not env.quarantined:
+                self.set_available(self.available - 1, ts)
+        elif event == 'ENV_QUARANTINED' and env is not None and not env.quarantined:
+            env.quarantined = True
+            if env.lease_start is None:
+                self.set_available(self.available - 1, ts)
+        elif event == 'ENV_RESTORED' and env is not None and env.quarantined:
+            env.quarantined = False
+            if env.lease_start is None:
+                self.set_available(self.available + 1, ts)
+
+    def end_lease(self, env, ts, outcome):
+        held = max(0.0, ts - env.lease_start)
+        env.busy += held
+        env.lease_start = None
+        self.in_use -= 1
+        if outcome == 'expired':
+            env.expiries += 1
+        if outcome in ('released', 'expired'):
+            self.durations.add(held)
+
+    def set_available(self, count, ts):
+        was_empty = self.empty_since is not None
+        self.available = max(0, count)
+        if not was_empty and self.available == 0 and self.envs:
+            self.empty_since = ts
+            self.window_rejections = 0
+        elif was_empty and self.available > 0:
+            self.close_empty(ts)
+
+    def close_empty(self, ts):
+        seconds = max(0.0, ts - self.empty_since)
+        self.empty_windows += 1
+        self.empty_seconds += seconds
+        self.empty_rejections += self.window_rejections
+        window = (seconds, self.empty_since, ts, self.window_rejections)
+        if len(self.longest_empty) < self.top:
+            heapq.heappush(self.longest_empty, window)
+        else:
+            heapq.heappushpop(self.longest_empty, window)
+        self.empty_since = None
+
+    def utilization(self, end):
+        """(url, utilization, busy seconds, leases, expiries) per env, at time end."""
+        urls = list(self.envs)
+        busy = [env.busy + (end - env.lease_start if env.lease_start is not None else 0)
+                for env in self.envs.values()]
+        observed = [end - env.first_seen for env in self.envs.values()]
+        if np is not None:
+            ratios = np.divide(busy, observed, out=np.zeros(len(busy)),
+                               where=np.asarray(observed) > 0).clip(0, 1).tolist()
+        else:
+            ratios = [min(1.0, max(0.0, b / o)) if o > 0 else 0.0 for b, o in zip(busy, observed)]
+        return [(url, ratio, spent, env.leases, env.expiries)
+                for url, ratio, spent, env in zip(urls, ratios, busy, self.envs.values())]
+
+    def report(self, end=None, quantile=0.95, headroom=0.1):
+        end = max(end or 0, self.last or 0)
+        period = (end - self.start) if self.start is not None else 0
+        hours = period / 3600 if period else None
+
+        per_env = self.utilization(end) if self.envs else []
+        ratios = sorted(entry[1] for entry in per_env)
+        busiest = heapq.nlargest(self.top, per_env, key=lambda entry: entry[1])
+
+        empty_seconds = self.empty_seconds
+        longest = list(self.longest_empty)
+        if self.empty_since is not None:
+            # Still empty at the end of the log
+            empty_seconds += end - self.empty_since
+            longest.append((end - self.empty_since, self.empty_since, None, self.window_rejections))
+        longest = sorted(longest, reverse=True)[:self.top]
+
+        ended = self.counts['released'] + self.counts['expired']
+        level = self.concurrency.quantile(quantile)
+        mean_in_use = self.concurrency.mean()
+        return {
+            'period': {
+                'start': format_ts(self.start),
+                'end': format_ts(end),
+                'seconds': round(period, 1)
+            },
+            'events': self.events,
+            'inconsistent_events': self.inconsistent,
+            'envs': {
+                'count': len(self.envs),
+                'available': self.available,
+                'in_use': self.in_use,
+                'never_claimed': sum(1 for env in self.envs.values() if not env.leases),
+                'utilization': {
+                    'mean': round(sum(ratios) / len(ratios), 4) if ratios else None,
+                    'p50': round(ratios[len(ratios) // 2], 4) if ratios else None,
+                    'p90': round(ratios[min(len(ratios) - 1, int(len(ratios) * 0.9))], 4) if ratios else None
+                },
+                'busiest': [{
+                    'url': url,
+                    'utilization': round(ratio, 4),
+                    'busy_seconds': round(spent, 1),
+                    'leases': leases,
+                    'expiries': expiries
+                } for url, ratio, spent, leases, expiries in busiest]
+            },
+            'leases': {
+                'claimed': self.counts['claimed'],
+                'reserved': self.counts['reserved'],
+                'released': self.counts['released'],
+                'expired': self.counts['expired'],
+                'reservations_expired': self.counts['reservations_expired'],
+                'open': self.in_use,
+                'expiry_ratio': round(self.counts['expired'] / ended, 4) if ended else None,
+                'duration_seconds': self.durations.summary(),
+                'duration_buckets': [{'le': limit, 'count': self.durations.below(limit)}
+                                     for limit in DURATION_REPORT_BUCKETS]
+            },
+            'waits_ms': self.waits.summary(digits=3),
+            'empty_pool': {
+                'windows': self.empty_windows + (self.empty_since is not None),
+                'total_seconds': round(empty_seconds, 1),
+                'share': round(empty_seconds / period, 4) if period else None,
+                'rejections': self.counts['rejected'],
+                'rejections_while_empty': self.empty_rejections + (self.window_rejections if self.empty_since is not None else 0),
+                'longest': [{
+                    'start': format_ts(start),
+                    'end': format_ts(stop),
+                    'seconds': round(seconds, 1),
+                    'rejections': rejections
+                } for seconds, start, stop, rejections in longest]
+            },
+            'churn_per_hour': {
+                name: round(self.counts[name] / hours, 2) if hours else None
+                for name in ('added', 'claimed', 'released', 'expired', 'rejected')
+            },
+            'concurrency': {
+                'peak': max(len(self.concurrency.seconds) - 1, self.in_use),
+                'mean': round(mean_in_use, 2) if mean_in_use is not None else None,
+                'p50': self.concurrency.quantile(0.5),
+                'p95': self.concurrency.quantile(0.95),
+                'p99': self.concurrency.quantile(0.99)
+            },
+            'warm_pool': {
+                'quantile': quantile,
+                'in_use_at_quantile': level,
+                'headroom': headroom,
+                'recommended_envs': math.ceil(level * (1 + headroom)) if level is not None else None,
+                # While the pool was empty, in-use was capped by its size, so
+                # real demand was higher than what the log shows
+                'demand_censored': empty_seconds > 0
+            }
+        }
+
+
+def format_ts(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts is not None else None
+
+
+class TimeParser:
+    """Log timestamps to epoch seconds; consecutive events mostly share one."""
+
+    def __init__(self):
+        self.text = None
+        self.value = None
+
+    def __call__(self, text):
+        if text != self.text:
+            self.value = datetime.strptime(text, '%Y-%m-%d %H:%M:%S').timestamp()
+            self.text = text
+        return self.value
+
+
+def parse_line(line, parse_time):
+    """(epoch, record) for a JSON or legacy text log line, or None to skip it."""
+    if line.startswith('{'):
+        if not any(marker in line for marker in EVENT_MARKERS):
+            return None
+        try:
+            record = json.loads(line)
+            if record.get('event') not in EVENTS:
+                return None
+            return parse_time(record['ts']), record
+        except (ValueError, KeyError, TypeError):
+            return None
+    match = LEGACY_LINE.match(line)
+    if match is None:
+        return None
+    ts, action, url, user_id, python_version = match.groups()
+    try:
+        epoch = parse_time(ts)
+    except ValueError:
+        return None
+    return epoch, {'event': f'ENV_{action}', 'url': url, 'user_id': user_id,
+                   'python_version': python_version}
+
+
+def default_paths(data_dir):
+    """Legacy log, then rotated event logs oldest first, then the live one."""
+    paths = []
+    legacy = os.path.join(data_dir, LEGACY_LOG)
+    if os.path.exists(legacy):
+        paths.append(legacy)
+    if os.path.isdir(data_dir):
+        paths.extend(os.path.join(data_dir, name) for name in sorted(os.listdir(data_dir))
+                     if name.startswith(EVENT_LOG + '.'))
+    current = os.path.join(data_dir, EVENT_LOG)
+    if os.path.exists(current):
+        paths.append(current)
+    return paths
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+class Tail:
+    """New complete lines of a growing file, reopened when it is rotated."""
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.offset = offset
+        self.partial = ''
+
+    def lines(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if self.file is None or stat.st_ino != self.inode or stat.st_size < self.offset:
+            if self.file is not None:
+                # Rotated or truncated: whatever is new is in the fresh file
+                self.file.close()
+                self.offset = 0
+                self.partial = ''
+            self.file = open(self.path, 'r', encoding='utf-8', errors='replace')
+            self.inode = stat.st_ino
+            self.file.seek(self.offset)
+        while True:
+            data = self.file.read(READ_SIZE)
+            self.offset = self.file.tell()
+            if not data:
+                return
+            lines = (self.partial + data).split('\n')
+            self.partial = lines.pop()
+            yield from lines
+
+
+def feed_lines(analytics, lines, parse_time):
+    skipped = 0
+    for line in lines:
+        parsed = parse_line(line.rstrip('\r\n'), parse_time)
+        if parsed is None:
+            skipped += 1
+            continue
+        analytics.feed(*parsed)
+    return skipped
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help=f'Log files in order (default: the logs in {DATA_DIR}/)')
+    parser.add_argument('--follow', action='store_true', help='Keep tailing the last file and report periodically')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between reports with --follow')
+    parser.add_argument('--quantile', type=float, default=0.95,
+                        help='Share of time the warm pool should cover demand')
+    parser.add_argument('--headroom', type=float, default=0.1, help='Extra warm envs on top, as a fraction')
+    parser.add_argument('--top', type=int, default=10, help='Busiest envs and longest empty windows to list')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    return parser.parse_args()
+
+
+def write_report(report, output, indent=2):
+    text = json.dumps(report, indent=indent)
+    if output:
+        tmp = output + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, output)
+    else:
+        print(text, flush=True)
+
+
+def main():
+    args = parse_args()
+    paths = args.paths or default_paths(DATA_DIR)
+    if not paths and not args.follow:
+        sys.exit(f'No pool logs found in {DATA_DIR}/')
+
+    analytics = LeaseAnalytics(top=args.top)
+    parse_time = TimeParser()
+    skipped = 0
+    started = time.perf_counter()
+    history = paths[:-1] if args.follow and paths else paths
+    for path in history:
+        with open_log(path) as f:
+            skipped += feed_lines(analytics, f, parse_time)
+
+    if not args.follow:
+        report = analytics.report(quantile=args.quantile, headroom=args.headroom)
+        report['files'] = paths
+        report['skipped_lines'] = skipped
+        report['numpy'] = np is not None
+        report['elapsed_s'] = round(time.perf_counter() - started, 3)
+        write_report(report, args.output)
+        return
+
+    tail = Tail(paths[-1] if paths else os.path.join(DATA_DIR, EVENT_LOG))
+    try:
+        while True:
+            skipped += feed_lines(analytics, tail.lines(), parse_time)
+            report = analytics.report(end=time.time(), quantile=args.quantile, headroom=args.headroom)
+            report['skipped_lines'] = skipped
+            # One report per line on stdout, so the stream can be piped
+            write_report(report, args.output, None if args.output is None else 2)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
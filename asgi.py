@@ -0,0 +1,424 @@
+"""ASGI serving mode for the pool API.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Serves the same routes as the Flask app in main.py. Long-polling claims
+(/api/claim?wait=N) and the /api/claim/stream and /api/events SSE feeds run
+as coroutines on the event loop, so an idle waiter costs a future instead
+of a thread; the pool and wait queue calls they make still go to a thread
+pool, as those locks can be held during journal writes. The landing page
+and its assets are answered straight from main's prerendered copies. Every
+other request is handed to the Flask app through a small WSGI bridge on
+the same bounded thread pool. The pool is loaded and main's background
+workers started at lifespan startup (or by the first request if the
+server runs without lifespan events), and persistence stays on those
+threads.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import main
+
+BRIDGE_WORKERS = 32  # Threads for requests served by the Flask app
+
+executor = ThreadPoolExecutor(max_workers=BRIDGE_WORKERS, thread_name_prefix='asgi-bridge')
+
+
+async def run_pool(fn, *args):
+    """Run a pool or wait queue call on a worker thread.
+
+    Their locks are also held by the persist and cleanup threads while they
+    write the journal or run a dispatch, so even the in-memory store can
+    block for longer than the event loop should.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+class WaiterWatch:
+    """One listener on whichever waiter a request is currently holding."""
+
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.woken = asyncio.Event()
+        self.listener = lambda: loop.call_soon_threadsafe(self.woken.set)
+        self.waiter = None
+
+    def follow(self, waiter):
+        if waiter is self.waiter:
+            return
+        self.close()
+        self.waiter = waiter
+        if waiter is not None:
+            waiter.add_listener(self.listener)
+
+    def close(self):
+        if self.waiter is not None:
+            self.waiter.remove_listener(self.listener)
+            self.waiter = None
+        self.woken.clear()
+
+
+async def wait_for_waiter(woken, timeout, disconnected=None):
+    """Sleep until the watched waiter is handed an env, the timeout passes or the client leaves."""
+    tasks = [asyncio.ensure_future(woken.wait())]
+    if disconnected is not None:
+        tasks.append(asyncio.ensure_future(disconnected.wait()))
+    try:
+        await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return body
+
+
+async def watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def send_json(send, payload, status=200, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'access-control-allow-origin', b'*')
+        ] + [(key.lower().encode('latin-1'), value.encode('latin-1'))
+             for key, value in (headers or {}).items()]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def query_args(scope):
+    args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return {key: values[-1] for key, values in args.items()}
+
+
+def get_header(scope, name):
+    name = name.lower().encode('latin-1')
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def scope_tenant(scope):
+    client = (scope.get('client') or ('', 0))[0]
+    forwarded = main.peer_forwarded(client, get_header(scope, main.FORWARDED_HEADER))
+    return main.tenant_of(client, get_header(scope, 'X-API-Key'), forwarded)
+
+
+async def check_lease_limit(send, tenant):
+    """Apply main's per-tenant lease cap; False if the claim was refused."""
+    limited = await run_pool(main.lease_limited, tenant)
+    if limited:
+        await send_json(send, limited, 429)
+        return False
+    return True
+
+
+async def check_rate_limit(scope, send, endpoint):
+    """Apply main's rate limit to a natively served request; False if it was refused."""
+    if not main.RATE_LIMITING:
+        return True
+    client = (scope.get('client') or ('', 0))[0]
+    identity, multiplier = main.client_identity(client, get_header(scope, 'X-API-Key'))
+    wait = main.limiter.take(identity, endpoint, 1, multiplier)
+    if not wait:
+        return True
+    payload, headers = main.rate_limited(endpoint, wait, 'rate')
+    await send_json(send, payload, 429, headers)
+    return False
+
+
+# Native handlers
+async def send_static(send, method, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers.items()]
+                   + [(b'access-control-allow-origin', b'*')]
+    })
+    await send({'type': 'http.response.body', 'body': b'' if method == 'HEAD' else body})
+
+
+async def claim_wait(scope, receive, send, args, wait):
+    python_version = args.get('python_version', '').strip() or None
+    resources = args.get('resources', '').strip() or None
+    ticket = args.get('ticket', '').strip() or None
+    tenant = scope_tenant(scope)
+    if not await check_lease_limit(send, tenant):
+        return
+
+    watch = WaiterWatch()
+    try:
+        env, waiter = await run_pool(main.wait_queue.join, python_version, resources, ticket, tenant)
+        if env is None:
+            watch.follow(waiter)
+            await wait_for_waiter(watch.woken, wait)
+            env = await run_pool(main.wait_queue.collect, waiter)
+        position = None if env is not None else await run_pool(main.wait_queue.position, waiter)
+    except Exception as e:
+        main.log_event('CLAIM_ERROR', error=str(e))
+        await send_json(send, {'success': False, 'error': 'Internal server error'}, 500)
+        return
+    finally:
+        watch.close()
+
+    if env is None:
+        await send_json(send, {
+            'success': False,
+            'error': 'No Python environments available',
+            'available_count': 0,
+            'message': 'Waiting in queue for a Python environment',
+            'ticket': waiter.ticket,
+            'priority_class': tenant.priority_class,
+            'queue_position': position
+        }, 404)
+        return
+
+    available_count, _ = await run_pool(main.pool.counts)
+    await send_json(send, {
+        'success': True,
+        'env': await run_pool(main.claimed_env_json, env),
+        'remaining': available_count,
+        'message': 'Python environment claimed successfully!'
+    })
+
+
+async def claim_stream(scope, receive, send, args):
+    python_version = args.get('python_version', '').strip() or None
+    resources = args.get('resources', '').strip() or None
+    ticket = get_header(scope, 'Last-Event-ID').strip() or None
+    tenant = scope_tenant(scope)
+    if not await check_lease_limit(send, tenant):
+        return
+
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*')
+        ]
+    })
+
+    watch = WaiterWatch()
+    waiter = None
+    env = None
+    delivered = False
+    try:
+        while not disconnected.is_set():
+            env, waiter = await run_pool(main.wait_queue.join, python_version, resources,
+                                         waiter.ticket if waiter else ticket, tenant)
+            watch.follow(waiter)
+            if env is None:
+                await wait_for_waiter(watch.woken, main.SSE_HEARTBEAT, disconnected)
+                env = await run_pool(main.wait_queue.collect, waiter)
+            if env is not None:
+                # uvicorn drops writes to a closed connection without raising, so this
+                # is the last point where a departed client can be noticed
+                if disconnected.is_set():
+                    break
+                body = await run_pool(main.claimed_env_json, env)
+                event = f"event: claimed\ndata: {json.dumps(body)}\n\n"
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8')})
+                delivered = True
+                break
+            if disconnected.is_set():
+                break
+            position = await run_pool(main.wait_queue.position, waiter)
+            event = (f"id: {waiter.ticket}\nevent: waiting\n"
+                     f"data: {json.dumps({'queue_position': position})}\n\n")
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        if not delivered:
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        watch.close()
+        if env is not None and not delivered:
+            await run_pool(main.wait_queue.give_back, env, 'client_left')
+        elif waiter is not None and env is None:
+            await run_pool(main.wait_queue.cancel, waiter.ticket)
+
+
+async def event_stream(scope, receive, send, args):
+    types = {name.strip() for name in args.get('types', '').split(',') if name.strip()}
+    try:
+        after = int(get_header(scope, 'Last-Event-ID') or args.get('after', main.bus.last_id))
+    except ValueError:
+        after = main.bus.last_id
+
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    listener = lambda: loop.call_soon_threadsafe(woken.set)
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+    main.bus.add_listener(listener)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*')
+        ]
+    })
+    try:
+        while not disconnected.is_set():
+            woken.clear()
+            events, reset = main.bus.since(after)
+            if events:
+                after = events[-1]['id']
+            chunk = main.format_bus_events(events, reset, types)
+            if not chunk:
+                tasks = [asyncio.ensure_future(woken.wait()), asyncio.ensure_future(disconnected.wait())]
+                done, pending = await asyncio.wait(tasks, timeout=main.SSE_HEARTBEAT,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in pending:
+                    task.cancel()
+                if done:
+                    continue
+                chunk = ': heartbeat\n\n'
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        main.bus.remove_listener(listener)
+        watcher.cancel()
+
+
+# WSGI bridge
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for key, value in scope.get('headers', []):
+        key = key.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[key] = value
+        elif f'HTTP_{key}' in environ:
+            environ[f'HTTP_{key}'] += ',' + value
+        else:
+            environ[f'HTTP_{key}'] = value
+    return environ
+
+
+def call_wsgi(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = main.app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+async def bridge(scope, receive, send):
+    body = await read_body(receive)
+    loop = asyncio.get_running_loop()
+    status, headers, body = await loop.run_in_executor(executor, call_wsgi, wsgi_environ(scope, body))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(executor, main.start)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_running_loop().run_in_executor(executor, main.pool.compact)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if not main.started:
+        await asyncio.get_running_loop().run_in_executor(executor, main.start)
+
+    if scope['method'] in ('GET', 'HEAD'):
+        served = main.frontend.serve(scope['path'], get_header(scope, 'If-None-Match'),
+                                     get_header(scope, 'Accept-Encoding'))
+        if served is not None:
+            await send_static(send, scope['method'], *served)
+            return
+
+    args = query_args(scope)
+    if scope['method'] == 'GET' and scope['path'] == '/api/claim':
+        try:
+            wait = min(float(args.get('wait', 0)), main.MAX_WAIT_SECONDS)
+        except ValueError:
+            wait = 0
+        # Keyed claims go through Flask, which owns the idempotency cache
+        if wait > 0 and not get_header(scope, 'Idempotency-Key'):
+            if await check_rate_limit(scope, send, '/api/claim'):
+                await claim_wait(scope, receive, send, args, wait)
+            return
+    elif scope['method'] == 'GET' and scope['path'] == '/api/claim/stream':
+        if await check_rate_limit(scope, send, '/api/claim/stream'):
+            await claim_stream(scope, receive, send, args)
+        return
+    elif scope['method'] == 'GET' and scope['path'] == '/api/events':
+        if await check_rate_limit(scope, send, '/api/events'):
+            await event_stream(scope, receive, send, args)
+        return
+
+    await bridge(scope, receive, send)
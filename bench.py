@@ -0,0 +1,289 @@
+"""Benchmark and load-test the pool API.
+
+    python bench.py                                  # Flask test client, fresh data dir
+    python bench.py --url http://localhost:5000      # against a running server
+    python bench.py --pool-sizes 100,10000,100000 --concurrency 1,16 \\
+        --claim-ratio 0.45 --release-ratio 0.45 --status-ratio 0.05 --output results.json
+
+Each scenario seeds the pool to the requested size, runs a mixed workload of
+add / claim / release / status calls from several threads, releases every
+lease it still holds and then checks the pool through /api/status. The
+report is JSON: per-endpoint p50/p99 latency, throughput, double claims and
+environments that were lost or listed twice.
+
+In test-client mode the pool runs in a temporary data directory and is
+reset between scenarios (POOL_STORAGE selects the backend as usual), with
+rate limiting off. A live server cannot be reset, so it is only topped up to
+each pool size and the checks only cover the environments this run created;
+start it with POOL_RATE_LIMIT=0 or the workload is throttled.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlsplit
+
+SEED_BATCH = 5000
+
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class HttpClient:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+        self.prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, body=None):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, self.prefix + path, body=data, headers=headers)
+        response = self.conn.getresponse()
+        payload = response.read()
+        try:
+            return response.status, json.loads(payload)
+        except ValueError:
+            return response.status, {}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return round(values[index] * 1000, 3)
+
+
+def make_env(run_id, number):
+    return {
+        'url': f'http://bench-{run_id}-{number}.local',
+        'username': 'bench',
+        'password': 'bench',
+        'python_version': random.choice(['3.11', '3.12']),
+        'resources': '2vCPU 4GB RAM'
+    }
+
+
+class Scenario:
+    """Shared state for one workload run."""
+
+    def __init__(self, run_id, seeded):
+        self.run_id = run_id
+        self.lock = threading.Lock()
+        self.held = {}  # url -> user_id for every lease the run holds
+        self.expected = set(seeded)
+        self.next_env = len(seeded)
+        self.latencies = {'add': [], 'claim': [], 'release': [], 'status': []}
+        self.errors = 0
+        self.empty = 0
+        self.double_claims = 0
+
+    def new_env(self):
+        with self.lock:
+            self.next_env += 1
+            return make_env(self.run_id, self.next_env)
+
+
+def worker(client, scenario, ops, mix, seed):
+    rng = random.Random(seed)
+    mine = []
+    for _ in range(ops):
+        roll = rng.random()
+        if roll < mix['add']:
+            op = 'add'
+        elif roll < mix['add'] + mix['status']:
+            op = 'status'
+        elif roll < mix['add'] + mix['status'] + mix['release'] and mine:
+            op = 'release'
+        else:
+            op = 'claim'
+
+        start = time.perf_counter()
+        if op == 'add':
+            env = scenario.new_env()
+            status, data = client.request('POST', '/api/add', env)
+        elif op == 'status':
+            status, data = client.request('GET', '/api/status')
+        elif op == 'release':
+            url, user_id = mine.pop(rng.randrange(len(mine)))
+            with scenario.lock:
+                scenario.held.pop(url, None)
+            status, data = client.request('GET', f'/api/release?user_id={user_id}')
+        else:
+            status, data = client.request('GET', '/api/claim')
+        elapsed = time.perf_counter() - start
+
+        with scenario.lock:
+            scenario.latencies[op].append(elapsed)
+            if op == 'claim' and status == 404:
+                scenario.empty += 1
+            elif status != 200:
+                scenario.errors += 1
+            elif op == 'add':
+                scenario.expected.add(env['url'])
+            elif op == 'claim':
+                url = data['env']['url']
+                if url in scenario.held:
+                    scenario.double_claims += 1
+                scenario.held[url] = data['env']['user_id']
+                mine.append((url, data['env']['user_id']))
+
+    for url, user_id in mine:
+        with scenario.lock:
+            scenario.held.pop(url, None)
+        client.request('GET', f'/api/release?user_id={user_id}')
+
+
+def seed_pool(client, run_id, size):
+    status, data = client.request('GET', '/api/status')
+    missing = max(0, size - data.get('pool_status', {}).get('total_count', 0))
+    urls = []
+    for start in range(0, missing, SEED_BATCH):
+        batch = [make_env(run_id, number) for number in range(start, min(missing, start + SEED_BATCH))]
+        client.request('POST', '/api/add/bulk', batch)
+        urls.extend(env['url'] for env in batch)
+    return urls
+
+
+def check_pool(client, scenario):
+    status, data = client.request('GET', '/api/status')
+    pool_status = data.get('pool_status', {})
+    listed = pool_status.get('available_urls', []) + pool_status.get('in_use_urls', []) + \
+        pool_status.get('quarantined_urls', []) + pool_status.get('rotating_urls', [])
+    ours = [url for url in listed if url in scenario.expected]
+    return {
+        'lost_envs': len(scenario.expected - set(ours)),
+        'duplicate_envs': len(ours) - len(set(ours)),
+        'leaked_in_use': len([url for url in pool_status.get('in_use_urls', []) if url in scenario.expected])
+    }
+
+
+def run_scenario(make_client, reset, pool_size, concurrency, ops, mix):
+    reset()
+    run_id = uuid.uuid4().hex[:8]
+    seeded = seed_pool(make_client(), run_id, pool_size)
+    scenario = Scenario(run_id, seeded)
+
+    threads = [threading.Thread(target=worker, args=(make_client(), scenario, ops, mix, index))
+               for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    total = sum(len(values) for values in scenario.latencies.values())
+    result = {
+        'pool_size': pool_size,
+        'concurrency': concurrency,
+        'ops_per_worker': ops,
+        'mix': mix,
+        'duration_s': round(duration, 4),
+        'total_ops': total,
+        'throughput_ops_s': round(total / duration, 1) if duration else None,
+        'latency_ms': {
+            op: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p99': percentile(values, 99)
+            } for op, values in scenario.latencies.items()
+        },
+        'errors': scenario.errors,
+        'empty_pool_rejections': scenario.empty,
+        'double_claims': scenario.double_claims
+    }
+    result.update(check_pool(make_client(), scenario))
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Benchmark a running server instead of the Flask test client')
+    parser.add_argument('--pool-sizes', default='100,1000,10000')
+    parser.add_argument('--concurrency', default='1,8')
+    parser.add_argument('--ops', type=int, default=500, help='Operations per worker thread')
+    parser.add_argument('--claim-ratio', type=float, default=0.45)
+    parser.add_argument('--release-ratio', type=float, default=0.45)
+    parser.add_argument('--status-ratio', type=float, default=0.05)
+    parser.add_argument('--add-ratio', type=float, default=0.05)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    total = args.claim_ratio + args.release_ratio + args.status_ratio + args.add_ratio
+    mix = {
+        'claim': args.claim_ratio / total,
+        'release': args.release_ratio / total,
+        'status': args.status_ratio / total,
+        'add': args.add_ratio / total
+    }
+
+    if args.url:
+        mode = 'server'
+        backend = None
+        make_client = lambda: HttpClient(args.url)
+        reset = lambda: None
+    else:
+        mode = 'test_client'
+        os.chdir(tempfile.mkdtemp(prefix='pool-bench-'))
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.environ.setdefault('POOL_RATE_LIMIT', '0')
+        import main as pool_app
+        pool_app.start()
+        backend = pool_app.STORAGE_BACKEND
+        make_client = lambda: TestClient(pool_app.app)
+
+        def reset():
+            if isinstance(pool_app.pool, pool_app.PoolStore):
+                pool_app.save_pool([], [])
+                pool_app.truncate_journal()
+                pool_app.pool.load()
+            else:
+                pool_app.pool.import_envs([], [])
+
+    report = {
+        'mode': mode,
+        'backend': backend,
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'scenarios': []
+    }
+    for pool_size in [int(size) for size in args.pool_sizes.split(',')]:
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            result = run_scenario(make_client, reset, pool_size, concurrency, args.ops, mix)
+            report['scenarios'].append(result)
+            print(f"pool={pool_size} concurrency={concurrency} "
+                  f"{result['throughput_ops_s']} ops/s "
+                  f"claim p99={result['latency_ms']['claim']['p99']}ms "
+                  f"double_claims={result['double_claims']} lost={result['lost_envs']}",
+                  file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
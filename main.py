@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, jsonify, render_template_string
 from flask_cors import CORS
 import os
 import json
@@ -6,242 +6,3506 @@ import uuid
 from datetime import datetime, timedelta
 import threading
 import time
+import atexit
+import base64
+import importlib
+import secrets
+import sqlite3
+import heapq
+import bisect
+import functools
+import math
+import itertools
+import asyncio
+import ssl
+import hashlib
+import hmac
+import random
+import re
+import gzip
+import queue
+import shutil
+import socket
+import sys
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode, urlsplit
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
 
 app = Flask(__name__)
 CORS(app)
 
 # Config
-DATA_DIR = 'data'
+DATA_DIR = os.environ.get('POOL_DATA_DIR', 'data')
 AVAILABLE_FILE = os.path.join(DATA_DIR, 'available_python.txt')
 IN_USE_FILE = os.path.join(DATA_DIR, 'in_use_python.txt')
-LOG_FILE = os.path.join(DATA_DIR, 'python_pool_log.txt')
+LOG_FILE = os.path.join(DATA_DIR, 'python_pool_log.jsonl')
+COMMIT_FILE = os.path.join(DATA_DIR, 'pool_commit.txt')
+SNAPSHOT_FILE = os.path.join(DATA_DIR, 'pool_snapshot.txt')
+JOURNAL_FILE = os.path.join(DATA_DIR, 'pool_journal.txt')
+STORAGE_BACKEND = os.environ.get('POOL_STORAGE', 'file')  # 'file' or 'sqlite'
+DB_FILE = os.environ.get('POOL_DB', os.path.join(DATA_DIR, 'pool.db'))
+VAULT_ENABLED = os.environ.get('POOL_VAULT', '1') != '0'  # Encrypt env passwords at rest (needs cryptography)
+VAULT_KEY_FILE = os.environ.get('POOL_VAULT_KEY', os.path.join(DATA_DIR, 'vault.key'))
+VAULT_CACHE_SIZE = 10000  # Decrypted passwords kept in memory...
+VAULT_CACHE_TTL = 300  # ...for at most this many seconds
+ROTATE_HOOK = os.environ.get('POOL_ROTATE_HOOK', '')  # 'module:function', or 'local' to test without touching hosts
+ROTATE_WORKERS = 4  # Rotations run at once
+ROTATE_RETRY_INTERVAL = 30  # Seconds before a failed rotation is tried again
+LEASE_DURATION = timedelta(hours=4)  # Lease length for new claims and the default renewal
+MAX_LEASE_DURATION = timedelta(hours=24)  # Longest a single renewal may extend a lease
+IDEMPOTENCY_TTL = 600  # Seconds a response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_MAX_KEYS = 100000
+RATE_LIMITING = os.environ.get('POOL_RATE_LIMIT', '1') != '0'
+RATE_LIMITS = {  # Per client: tokens per second, burst
+    '/api/claim': (2, 10),
+    '/api/claim/bulk': (1, 20),  # Charged per env requested
+    '/api/claim/stream': (1, 5),
+    '/api/reserve': (2, 10),
+    '/api/add': (10, 50),
+    '/api/add/bulk': (1, 5),
+    '/api/events': (1, 5)
+}
+RATE_LIMIT_MAX_CLIENTS = 100000  # Buckets kept before the least recently used are dropped
+API_KEYS = {key.strip() for key in os.environ.get('POOL_API_KEYS', '').split(',') if key.strip()}
+API_KEY_RATE_MULTIPLIER = 10  # Budget of a client with a known X-API-Key
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('POOL_MAX_CONCURRENCY', 64))  # Long-polls not counted
+TRUST_PROXY = os.environ.get('POOL_TRUST_PROXY', '0') == '1'  # Take the client IP from X-Forwarded-For
+PRIORITY_CLASSES = {  # Class: fair-share weight
+    'internal': 8,
+    'paid': 4,
+    'default': 1
+}
+DEFAULT_PRIORITY_CLASS = 'default'  # Class of clients without a tenant API key
+TENANT_SPECS = os.environ.get('POOL_TENANTS', '')  # key=class[:max_leases[:weight]],...
+DEFAULT_MAX_LEASES = int(os.environ.get('POOL_MAX_LEASES', 0))  # Per client address without a tenant key; 0 = no cap
+EVENT_BUFFER_SIZE = 10000  # Recent pool events kept for /api/events and webhooks
+WEBHOOK_URLS = [url.strip() for url in os.environ.get('POOL_WEBHOOKS', '').split(',') if url.strip()]
+WEBHOOK_SECRET = os.environ.get('POOL_WEBHOOK_SECRET', '')  # Signs deliveries when set
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_LINGER = 0.5  # Seconds to let a burst build up into one batch
+WEBHOOK_TIMEOUT = 5.0
+WEBHOOK_RETRY_BASE = 1.0  # First retry delay, doubling per attempt...
+WEBHOOK_RETRY_MAX = 60.0  # ...up to this
+WEBHOOK_MAX_ATTEMPTS = 12  # Attempts before a batch is given up
+EXPIRY_TICK = 1.0  # Seconds between expiry checks
+RELOAD_ENABLED = os.environ.get('POOL_RELOAD', '1') != '0'  # Apply hand edits of the pool files (file backend)
+RELOAD_INTERVAL = 2.0  # Seconds between checks; an edit must hold still for one to be applied
+MAX_BULK_ITEMS = 10000
+CHANGE_LOG_SIZE = 10000  # Pool changes kept for /api/status?since=
+STATUS_PAGE_SIZE = 1000  # Default and maximum URLs per status page are this and 10x
+BOOT_ID = uuid.uuid4().hex[:8]  # In status ETags, since generations and queue depths restart with the process
+MAX_WAIT_SECONDS = 60  # Longest single long-poll on /api/claim
+WAIT_GRACE = 15  # Seconds a waiter keeps its place between polls
+SSE_HEARTBEAT = 15  # Seconds between 'waiting' events on /api/claim/stream
+FLUSH_INTERVAL = 0.2  # Seconds between journal group commits
+COMPACT_INTERVAL = 60  # Seconds between journal compactions
+LOG_QUEUE_SIZE = 10000  # Events buffered before new ones are dropped
+LOG_BATCH_SIZE = 500
+LOG_MAX_BYTES = 50 * 1024 * 1024  # Rotate the event log past this size...
+LOG_ROTATE_SECONDS = 24 * 3600  # ...or this age
+LOG_BACKUPS = 14  # Rotated logs to keep
+LOG_COMPRESS = True  # gzip rotated logs
+METRICS_ENABLED = os.environ.get('POOL_METRICS', '1') != '0'
+PORT = int(os.environ.get('PORT', 5000))
+POOL_NODES = [node.strip().rstrip('/') for node in os.environ.get('POOL_NODES', '').split(',') if node.strip()]
+POOL_NODE = os.environ.get('POOL_NODE', '').strip().rstrip('/')  # This node's entry in POOL_NODES
+SHARD_VNODES = 64  # Ring points per node
+SHARD_TIMEOUT = 2.0  # Seconds to wait on another node
+HEALTH_CHECKS = os.environ.get('POOL_HEALTH_CHECKS', '0') == '1'
+HEALTH_CONCURRENCY = 64  # Probes in flight at once
+HEALTH_TIMEOUT = 3.0  # Seconds before a probe counts as failed
+HEALTH_INTERVAL = 30  # Seconds between probes of a healthy env, doubling while it stays healthy...
+HEALTH_MAX_INTERVAL = 300  # ...up to this
+HEALTH_RETRY_INTERVAL = 5  # Seconds between probes after a failure
+HEALTH_FAILURES = 2  # Consecutive failures before an env is quarantined
+HEALTH_SCAN_INTERVAL = 10  # Seconds between refreshes of the probe list
+HEALTH_IDLE_CONNECTIONS = 256  # Keep-alive connections kept between probes
+CLAIM_PREFER_WINDOW = 8  # Oldest available envs a claim compares by probe latency
+FORECAST_WINDOWS = {'short': 60, 'long': 900}  # EWMA time constants in seconds
+FORECAST_HORIZON = 300  # Seconds ahead /api/forecast looks by default
+RESERVATION_SECONDS = 30  # Default time to confirm a reservation
+RESERVATION_MAX_SECONDS = 120
+PAGE_MAX_AGE = 60  # Seconds browsers and CDNs reuse the landing page before revalidating
+ASSET_MAX_AGE = 365 * 24 * 3600  # Hashed asset URLs never change content
+
+# Metrics
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+EVENT_COUNTERS = {
+    'ENV_ADDED': 'pool_adds_total',
+    'ENV_CLAIMED': 'pool_claims_total',
+    'ENV_RELEASED': 'pool_releases_total',
+    'ENV_EXPIRED': 'pool_expiries_total',
+    'ENV_RESERVED': 'pool_reservations_total',
+    'RESERVATION_EXPIRED': 'pool_reservation_expiries_total',
+    'ENV_REMOVED': 'pool_removals_total',
+    'ENV_ROTATED': 'pool_rotations_total',
+    'ROTATE_ERROR': 'pool_rotation_failures_total',
+    'POOL_RELOADED': 'pool_reloads_total'
+}
+
+class Metrics:
+    """Prometheus-style counters and histograms rendered by /metrics.
+
+    Gauges are not stored; collectors registered with add_collector() are
+    called at scrape time and yield (name, labels, value) samples. Samples
+    named *_total are totals kept elsewhere and are typed as counters.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
 
-# Ensure data directory exists
-os.makedirs(DATA_DIR, exist_ok=True)
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def count_event(self, event):
+        name = EVENT_COUNTERS.get(event)
+        if name is not None:
+            self.inc(name)
+        elif event.endswith('_ERROR'):
+            self.inc('pool_errors_total', type=event)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, ([*buckets], total, count))
+                                for key, (buckets, total, count) in self.histograms.items())
+        
+        lines = []
+        typed = set()
+        
+        def sample(name, labels, value, kind, base=None):
+            base = base or name
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {base} {kind}")
+            label_text = ','.join(f'{key}="{format_label(value)}"' for key, value in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        
+        for (name, labels), value in counters:
+            sample(name, labels, value, 'counter')
+        for (name, labels), (buckets, total, count) in histograms:
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket
+                sample(f"{name}_bucket", labels + (('le', bound),), cumulative, 'histogram', name)
+            sample(f"{name}_sum", labels, round(total, 6), 'histogram', name)
+            sample(f"{name}_count", labels, count, 'histogram', name)
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    sample(name, tuple(sorted(labels.items())), value,
+                           'counter' if name.endswith('_total') else 'gauge')
+            except Exception as e:
+                lines.append(f"# collector failed: {format_label(str(e))}")
+        return '\n'.join(lines) + '\n'
+
+def format_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = Metrics()
+
+def timed(name, **labels):
+    """Record the wrapped function's duration in the histogram name.
+
+    With metrics disabled the function is returned untouched.
+    """
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+# Event log
+class EventLog:
+    """JSON-lines event log written by a background thread.
+
+    emit() only enqueues, so request threads never touch the file. The
+    writer drains the bounded queue in batches, rotates the file by size
+    and age and gzips rotated files. When the queue is full new events are
+    dropped and counted rather than blocking the caller.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.errors = 0
+        self.file = None
+        self.opened_at = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < LOG_BATCH_SIZE:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            self.write([record for record in records if record is not None])
+            if stop:
+                return
+
+    def write(self, records):
+        if not records:
+            return
+        try:
+            if self.file is None:
+                self.open()
+            elif (self.file.tell() >= LOG_MAX_BYTES
+                  or time.time() - self.opened_at >= LOG_ROTATE_SECONDS):
+                self.rotate()
+            self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+            self.file.flush()
+        except Exception as e:
+            self.errors += 1
+            print(f"Event log write failed: {e}", file=sys.stderr)
+            self.file = None
 
-# Initialize files
-for file in [AVAILABLE_FILE, IN_USE_FILE, LOG_FILE]:
-    if not os.path.exists(file):
-        open(file, 'w').close()
+    def open(self):
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.opened_at = self.first_record_time() if self.file.tell() else time.time()
 
-def log_event(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    def first_record_time(self):
+        # The mtime moves with every append, so a log kept across restarts is aged by its first record
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return parse_time(json.loads(f.readline())['ts'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0  # Unreadable, so rotate it out with the next batch
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(self.path, rotated)
+        if LOG_COMPRESS:
+            with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        
+        prefix = os.path.basename(self.path) + '.'
+        backups = sorted(name for name in os.listdir(os.path.dirname(self.path) or '.')
+                         if name.startswith(prefix))
+        for name in backups[:-LOG_BACKUPS]:
+            os.remove(os.path.join(os.path.dirname(self.path), name))
+        self.open()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+event_log = EventLog(LOG_FILE)
+
+event_listeners = []  # Called with every event record, on the thread that logged it
+
+def log_event(event, **fields):
+    record = {'ts': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'event': event}
+    record.update(fields)
+    event_log.emit(record)
+    if METRICS_ENABLED:
+        metrics.count_event(event)
+    for listener in event_listeners:
+        listener(record)
+
+# Env records
+def format_time(epoch):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch))
+
+@functools.lru_cache(maxsize=65536)
+def epoch_of(text):
+    # Pool files repeat the same second many times over, so this is cached
+    return int(datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                        int(text[11:13]), int(text[14:16]), int(text[17:19])).timestamp())
+
+def parse_time(text):
+    """Epoch seconds for a '%Y-%m-%d %H:%M:%S' timestamp, or now if it is malformed."""
     try:
-        with open(LOG_FILE, 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] {message}\n")
-    except:
-        pass
+        return epoch_of(text)
+    except ValueError:
+        return int(time.time())
+
+class Env:
+    """One pool environment.
+
+    Slotted so a resident pool of 100k+ envs stays small: python_version
+    and resources are interned, and timestamps are epoch seconds. Item
+    access reads like the old dict records, with timestamps formatted the
+    way the pool files store them, so callers and JSON output are unchanged.
+    """
+
+    __slots__ = ('url', 'username', 'password', 'python_version', 'resources',
+                 'added_at', 'user_id', 'claimed_at', 'expires_at')
+    TIMESTAMPS = ('added_at', 'claimed_at', 'expires_at')
+
+    def __init__(self, url, username, password, python_version, resources='2vCPU 4GB RAM',
+                 added_at=None, user_id=None, claimed_at=None, expires_at=None):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.python_version = sys.intern(python_version)
+        self.resources = sys.intern(resources)
+        self.added_at = added_at
+        self.user_id = user_id
+        self.claimed_at = claimed_at
+        self.expires_at = expires_at
 
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return format_time(value) if key in self.TIMESTAMPS else value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.__slots__ if getattr(self, key) is not None]
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+def lease_deadline(claimed_at):
+    # Leases saved before per-lease deadlines run for the default duration
+    return claimed_at + int(LEASE_DURATION.total_seconds())
+
+def available_env(parts):
+    return Env(
+        parts[0], parts[1], parts[2], parts[3],
+        parts[4] if len(parts) > 4 else '2vCPU 4GB RAM',
+        parse_time(parts[5]) if len(parts) > 5 else int(time.time())
+    )
+
+def in_use_env(parts):
+    claimed_at = parse_time(parts[5]) if len(parts) > 5 else int(time.time())
+    return Env(
+        parts[0], parts[1], parts[2], parts[3],
+        parts[6] if len(parts) > 6 else '2vCPU 4GB RAM',
+        user_id=parts[4],
+        claimed_at=claimed_at,
+        expires_at=parse_time(parts[7]) if len(parts) > 7 else lease_deadline(claimed_at)
+    )
+
+@timed('pool_storage_duration_seconds', op='read')
 def get_available_envs():
     if not os.path.exists(AVAILABLE_FILE):
         return []
     
     try:
-        with open(AVAILABLE_FILE, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f.readlines() if line.strip()]
-        
         available = []
-        for line in lines:
-            parts = line.split(' | ')
-            if len(parts) >= 4:
-                available.append({
-                    'url': parts[0],
-                    'username': parts[1],
-                    'password': parts[2],
-                    'python_version': parts[3],
-                    'resources': parts[4] if len(parts) > 4 else '2vCPU 4GB RAM',
-                    'added_at': parts[5] if len(parts) > 5 else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
+        with open(AVAILABLE_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split(' | ')
+                if len(parts) >= 4:
+                    available.append(available_env(parts))
         return available
     except Exception as e:
-        log_event(f"ERROR reading available: {str(e)}")
+        log_event('READ_ERROR', file=AVAILABLE_FILE, error=str(e))
         return []
 
+@timed('pool_storage_duration_seconds', op='read')
 def get_in_use_envs():
     if not os.path.exists(IN_USE_FILE):
         return []
     
     try:
-        with open(IN_USE_FILE, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f.readlines() if line.strip()]
-        
         in_use = []
-        for line in lines:
-            parts = line.split(' | ')
-            if len(parts) >= 5:
-                in_use.append({
-                    'url': parts[0],
-                    'username': parts[1],
-                    'password': parts[2],
-                    'python_version': parts[3],
-                    'user_id': parts[4],
-                    'claimed_at': parts[5] if len(parts) > 5 else datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'resources': parts[6] if len(parts) > 6 else '2vCPU 4GB RAM'
-                })
+        with open(IN_USE_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split(' | ')
+                if len(parts) >= 5:
+                    in_use.append(in_use_env(parts))
         return in_use
     except Exception as e:
-        log_event(f"ERROR reading in-use: {str(e)}")
+        log_event('READ_ERROR', file=IN_USE_FILE, error=str(e))
         return []
 
-def save_available_envs(envs):
+def format_available_envs(envs):
+    lines = []
+    for env in envs:
+        line_parts = [
+            env['url'],
+            env['username'],
+            env['password'],
+            env['python_version'],
+            env.get('resources', '2vCPU 4GB RAM'),
+            env.get('added_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        ]
+        lines.append(' | '.join(line_parts))
+    return '\n'.join(lines)
+
+def format_in_use_envs(envs):
+    lines = []
+    for env in envs:
+        line_parts = [
+            env['url'],
+            env['username'],
+            env['password'],
+            env['python_version'],
+            env['user_id'],
+            env.get('claimed_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            env.get('resources', '2vCPU 4GB RAM'),
+            env.get('expires_at') or format_time(lease_deadline(parse_time(env.get('claimed_at', ''))))
+        ]
+        lines.append(' | '.join(line_parts))
+    return '\n'.join(lines)
+
+def fsync_dir(path):
     try:
-        lines = []
-        for env in envs:
-            line_parts = [
-                env['url'],
-                env['username'],
-                env['password'],
-                env['python_version'],
-                env.get('resources', '2vCPU 4GB RAM'),
-                env.get('added_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            ]
-            lines.append(' | '.join(line_parts))
-        
-        with open(AVAILABLE_FILE, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Directories can't be opened for fsync on every platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+written_files = {}  # path -> (signature, text) of the pool files as the server last wrote them
+
+class PoolFileChanged(Exception):
+    pass
+
+@timed('pool_storage_duration_seconds', op='write')
+def write_pool_files(contents):
+    """Atomically replace one or more pool files.
+
+    Every file is first written and fsynced as ``<path>.tmp``. The commit
+    marker is then published with a single rename; once it exists the
+    temp files are complete and recover_pool_files() will roll them
+    forward, so a crash can never leave the files out of step. A file
+    edited by hand since the last write is not overwritten until the
+    watcher has applied the edit.
+    """
+    for path in contents:
+        if path in written_files and file_signature(path) != written_files[path][0]:
+            raise PoolFileChanged(f'{path} was edited and is waiting to be reloaded')
+    
+    for path, text in contents.items():
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    with open(COMMIT_FILE + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(contents))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(COMMIT_FILE + '.tmp', COMMIT_FILE)
+    fsync_dir(DATA_DIR)
+    
+    for path in contents:
+        os.replace(path + '.tmp', path)
+    fsync_dir(DATA_DIR)
+    os.remove(COMMIT_FILE)
+    for path, text in contents.items():
+        if path in (AVAILABLE_FILE, IN_USE_FILE):
+            written_files[path] = (file_signature(path), text)
+
+def recover_pool_files():
+    committed = []
+    if os.path.exists(COMMIT_FILE):
+        with open(COMMIT_FILE, 'r', encoding='utf-8') as f:
+            committed = [line.strip() for line in f if line.strip()]
+    
+    for path in [AVAILABLE_FILE, IN_USE_FILE, SNAPSHOT_FILE]:
+        if not os.path.exists(path + '.tmp'):
+            continue
+        if path in committed:
+            os.replace(path + '.tmp', path)
+            log_event('POOL_FILE_RECOVERED', file=path)
+        else:
+            os.remove(path + '.tmp')  # Write never committed, keep the old file
+    
+    if committed:
+        fsync_dir(DATA_DIR)
+        os.remove(COMMIT_FILE)
+
+def save_pool(available, in_use, seq=0, held=()):
+    try:
+        write_pool_files({
+            AVAILABLE_FILE: format_available_envs(available),
+            IN_USE_FILE: format_in_use_envs(in_use),
+            SNAPSHOT_FILE: '\n'.join([str(seq)] + list(held))
+        })
         return True
     except Exception as e:
-        log_event(f"ERROR saving available: {str(e)}")
+        log_event('SAVE_ERROR', error=str(e))
         return False
 
-def save_in_use_envs(envs):
+# Journal
+# One line per mutation, appended between snapshots:
+#   <seq> | ADD | url | username | password | python_version | resources | added_at
+#   <seq> | CLAIM | url | user_id | claimed_at | expires_at
+#   <seq> | RENEW | user_id | expires_at
+#   <seq> | RELEASE | user_id | added_at
+#   <seq> | EXPIRE | user_id | added_at
+#   <seq> | REMOVE | url
+#   <seq> | HOLD | url
+#   <seq> | ROTATE | url [| password]
+# HOLD follows the RELEASE or EXPIRE of an env kept out of the pool until
+# it is rotated, and ROTATE ends the hold. The snapshot records the last
+# seq it contains, so replay skips anything already folded in, followed by
+# the urls still held, one per line.
+
+def get_snapshot():
+    """(last journal seq in the snapshot, urls it holds for rotation)."""
     try:
-        lines = []
-        for env in envs:
-            line_parts = [
-                env['url'],
-                env['username'],
-                env['password'],
-                env['python_version'],
-                env['user_id'],
-                env.get('claimed_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-                env.get('resources', '2vCPU 4GB RAM')
-            ]
-            lines.append(' | '.join(line_parts))
-        
-        with open(IN_USE_FILE, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        with open(SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        return int(lines[0].strip() or 0), {line.strip() for line in lines[1:] if line.strip()}
+    except (OSError, ValueError):
+        return 0, set()
+
+@timed('pool_storage_duration_seconds', op='journal_read')
+def get_journal_records():
+    if not os.path.exists(JOURNAL_FILE):
+        return []
+    
+    records = []
+    with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break  # Torn final append
+            parts = line.rstrip('\n').split(' | ')
+            try:
+                parts[0] = int(parts[0])
+            except ValueError:
+                break
+            records.append(parts)
+    return records
+
+@timed('pool_storage_duration_seconds', op='journal_append')
+def append_journal(lines):
+    try:
+        with open(JOURNAL_FILE, 'a', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
         return True
     except Exception as e:
-        log_event(f"ERROR saving in-use: {str(e)}")
+        log_event('JOURNAL_ERROR', error=str(e))
         return False
 
+def truncate_journal():
+    with open(JOURNAL_FILE, 'w', encoding='utf-8') as f:
+        f.flush()
+        os.fsync(f.fileno())
+
+def apply_journal_record(available, in_use, urls, parts, held=None):
+    # available is a url -> env dict so replay can move entries in O(1); held collects HOLD urls
+    op = parts[1]
+    if op == 'ADD' and len(parts) >= 8:
+        url = parts[2]
+        if url in urls:
+            return
+        urls.add(url)
+        available[url] = Env(url, parts[3], parts[4], parts[5], parts[6], parse_time(parts[7]))
+    elif op == 'CLAIM' and len(parts) >= 5:
+        env = available.pop(parts[2], None)
+        if env is None:
+            return
+        env.user_id = parts[3]
+        env.claimed_at = parse_time(parts[4])
+        env.expires_at = parse_time(parts[5]) if len(parts) >= 6 else lease_deadline(env.claimed_at)
+        in_use[parts[3]] = env
+    elif op == 'RENEW' and len(parts) >= 4:
+        env = in_use.get(parts[2])
+        if env is not None:
+            env.expires_at = parse_time(parts[3])
+    elif op in ('RELEASE', 'EXPIRE') and len(parts) >= 4:
+        env = in_use.pop(parts[2], None)
+        if env is None:
+            return
+        available[env.url] = Env(env.url, env.username, env.password, env.python_version,
+                                 env.resources, parse_time(parts[3]))
+    elif op == 'REMOVE' and len(parts) >= 3:
+        if available.pop(parts[2], None) is not None:
+            urls.discard(parts[2])
+        if held is not None:
+            held.discard(parts[2])
+    elif op == 'HOLD' and len(parts) >= 3:
+        if held is not None and parts[2] in available:
+            held.add(parts[2])
+    elif op == 'ROTATE' and len(parts) >= 3:
+        if held is not None:
+            held.discard(parts[2])
+        env = available.get(parts[2])
+        if env is not None and len(parts) >= 4:
+            env.password = parts[3]
+
+# Sharding
+# With POOL_NODES set, each node owns the envs whose url hashes to it on a
+# consistent-hash ring and keeps them in its own store. user_ids carry the
+# owning node's tag (user_<tag>_<hex>) so a release can be routed back
+# without a lookup.
+def shard_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+def node_tag(node):
+    return hashlib.md5(node.encode('utf-8')).hexdigest()[:6]
+
+class HashRing:
+    def __init__(self, nodes, vnodes=SHARD_VNODES):
+        self.points = sorted((shard_hash(f'{node}#{index}'), node)
+                             for node in nodes for index in range(vnodes))
+        self.hashes = [point for point, _ in self.points]
+
+    def owner(self, key):
+        index = bisect.bisect(self.hashes, shard_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+if POOL_NODES and POOL_NODE not in POOL_NODES:
+    raise ValueError(f"POOL_NODE must be one of POOL_NODES ({', '.join(POOL_NODES)})")
+
+ring = HashRing(POOL_NODES) if POOL_NODES else None
+NODE_TAGS = {node_tag(node): node for node in POOL_NODES}
+PEERS = [node for node in POOL_NODES if node != POOL_NODE]
+
+def resolve_peers():
+    addresses = set()
+    for node in PEERS:
+        try:
+            addresses.add(socket.gethostbyname(urlsplit(node).hostname))
+        except (OSError, TypeError):
+            pass
+    return addresses
+
+PEER_ADDRESSES = set()  # Node-to-node calls from these skip rate limits; filled in by start()
+
+def peer_forwarded(remote_addr, header):
+    """True for a node-to-node call: the forwarded header, sent from a peer's address."""
+    return bool(header) and remote_addr in PEER_ADDRESSES
+
+def owner_of(url):
+    return ring.owner(url) if ring else POOL_NODE
+
+def shard_of(user_id):
+    """Node holding the lease for user_id; untagged ids are treated as local."""
+    parts = user_id.split('_')
+    if ring and len(parts) == 3:
+        return NODE_TAGS.get(parts[1], POOL_NODE)
+    return POOL_NODE
+
 def generate_user_id():
+    if ring:
+        return f"user_{node_tag(POOL_NODE)}_{uuid.uuid4().hex[:12]}"
     return f"user_{uuid.uuid4().hex[:12]}"
 
-def cleanup_expired():
-    in_use = get_in_use_envs()
-    available = get_available_envs()
-    now = datetime.now()
-    expired_found = False
+# Credential vault
+class VaultError(Exception):
+    pass
+
+class Vault:
+    """Env passwords sealed with AES-GCM under a local key file.
+
+    A sealed password is 'vault:1:' and the base64 of a random nonce and
+    the ciphertext, with the env url as associated data so a blob only
+    opens for the env it was sealed for. The stores keep passwords sealed,
+    on disk and in memory, and they are only opened when a claim hands
+    one out. Opened passwords are cached per url for a few minutes, so a
+    busy pool doesn't pay for AES on every claim. Values without the prefix
+    are plaintext from before the vault and pass through as they are.
+    """
+
+    PREFIX = 'vault:1:'
+
+    def __init__(self, key_file=VAULT_KEY_FILE, cache_size=VAULT_CACHE_SIZE, cache_ttl=VAULT_CACHE_TTL):
+        self.key_file = key_file
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = OrderedDict()  # url -> (sealed, password, deadline)
+        self.lock = threading.Lock()
+        self.aead = None
+        self.sealing = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, sealing=True):
+        """Read the key file, creating it on first use."""
+        try:
+            with open(self.key_file, 'rb') as f:
+                key = base64.b64decode(f.read().strip(), validate=True)
+        except FileNotFoundError:
+            tmp = f'{self.key_file}.{os.getpid()}.tmp'
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(base64.b64encode(AESGCM.generate_key(bit_length=256)) + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(tmp, self.key_file)  # Fails if another process got there first
+                log_event('VAULT_KEY_CREATED', path=self.key_file)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+            return self.load(sealing)
+        self.aead = AESGCM(key)
+        self.sealing = sealing
+
+    def sealed(self, value):
+        return value.startswith(self.PREFIX)
+
+    def seal(self, url, password):
+        if not self.sealing or password.startswith(self.PREFIX):
+            return password
+        nonce = os.urandom(12)
+        blob = nonce + self.aead.encrypt(nonce, password.encode('utf-8'), url.encode('utf-8'))
+        return self.PREFIX + base64.urlsafe_b64encode(blob).decode('ascii')
+
+    def unseal(self, url, value):
+        """The plaintext of a stored password."""
+        if not value.startswith(self.PREFIX):
+            return value
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(url)
+            if entry is not None and entry[0] == value and entry[2] > now:
+                self.cache.move_to_end(url)
+                self.hits += 1
+                return entry[1]
+
+        if self.aead is None:
+            raise VaultError(f'The password of {url} is sealed and no vault key is loaded')
+        try:
+            blob = base64.urlsafe_b64decode(value[len(self.PREFIX):])
+            password = self.aead.decrypt(blob[:12], blob[12:], url.encode('utf-8')).decode('utf-8')
+        except Exception:
+            raise VaultError(f'The password of {url} does not open with {self.key_file}')
+        with self.lock:
+            self.misses += 1
+            self.cache[url] = (value, password, now + self.cache_ttl)
+            self.cache.move_to_end(url)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return password
+
+vault = Vault()
+
+# In-memory pool
+class PoolStore:
+    """Process-resident pool state.
+
+    The text files hold the last snapshot and are read once by load().
+    Each mutation appends one record to the journal, which the
+    persist_worker thread group-commits; compact() folds the journal back
+    into a fresh snapshot. All state is guarded by one lock so a claim can
+    never hand the same env to two users. Leases sit in a min-heap keyed by
+    deadline, so expiry only touches the leases that are actually due.
+
+    Available envs are kept oldest-first both globally and per
+    (python_version, resources) bucket; bucket entries carry a queue ticket
+    so a partially filtered claim can still pick the oldest match.
+    Quarantined envs are held aside where claims cannot see them, but are
+    still saved as available. So are released envs while a rotation hook
+    gives them a new password, and the snapshot and journal also record
+    that they are held, so a restart keeps them out of the pool.
+    """
+
+    def __init__(self):
+        self.available = OrderedDict()
+        self.buckets = {}
+        self.ticket = 0
+        self.in_use = {}
+        self.urls = set()
+        self.expiry_heap = []
+        self.dirty = threading.Event()
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.seq = 0
+        self.journal = []
+        self.journal_records = 0
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self.quarantined = {}
+        self.rotating = {}
+        self.hold_released = bool(ROTATE_HOOK)
+        self.latency = {}
+
+    def load(self):
+        recover_pool_files()
+        available = {}
+        in_use = {}
+        urls = set()
+        for env in get_in_use_envs():
+            if env.url not in urls:
+                in_use[env.user_id] = env
+                urls.add(env.url)
+        for env in get_available_envs():
+            if env.url not in urls:
+                available[env.url] = env
+                urls.add(env.url)
+        
+        self.seq, held = get_snapshot()
+        replayed = 0
+        records = get_journal_records()
+        for parts in records:
+            if parts[0] <= self.seq:
+                continue
+            apply_journal_record(available, in_use, urls, parts, held)
+            self.seq = parts[0]
+            replayed += 1
+        
+        sealed = 0
+        if vault.sealing:
+            for env in itertools.chain(available.values(), in_use.values()):
+                if not vault.sealed(env.password):
+                    env.password = vault.seal(env.url, env.password)
+                    sealed += 1
+        
+        expiry_heap = [(env.expires_at, user_id) for user_id, env in in_use.items()]
+        heapq.heapify(expiry_heap)
+        
+        with self.lock:
+            self.available = OrderedDict()
+            self.buckets = {}
+            self.rotating = {}
+            for env in available.values():
+                # The rotator picks held envs up at start; without a hook they go back as they are
+                if env.url in held and self.hold_released:
+                    self.rotating[env.url] = env
+                else:
+                    self.enqueue(env)
+            self.in_use = in_use
+            self.urls = urls
+            self.quarantined = {}
+            self.expiry_heap = expiry_heap
+            self.journal = []
+            # A leftover journal, or passwords saved before the vault, are
+            # written out by the compaction thread, off the startup path
+            self.journal_records = len(records) + sealed
+            self.changes.clear()
+        
+        if replayed:
+            log_event('JOURNAL_REPLAYED', records=replayed)
+        if sealed:
+            log_event('PASSWORDS_SEALED', count=sealed)
+
+    def mark_dirty(self):
+        self.dirty.set()
+
+    def record(self, url, *fields):
+        # The pool generation is the journal sequence number
+        self.seq += 1
+        self.journal.append(' | '.join([str(self.seq)] + list(fields)))
+        self.changes.append((self.seq, fields[0], url))
+        self.mark_dirty()
+
+    def note(self, url, op):
+        # A change clients should see that is not journaled
+        self.seq += 1
+        self.changes.append((self.seq, op, url))
+
+    def generation(self):
+        return self.seq
+
+    def changes_since(self, generation):
+        """Changes after generation, or None if they are no longer kept."""
+        with self.lock:
+            oldest = self.changes[0][0] - 1 if self.changes else self.seq
+            if generation < oldest or generation > self.seq:
+                return None
+            changes = []
+            for change in reversed(self.changes):
+                if change[0] <= generation:
+                    break
+                changes.append(change)
+            changes.reverse()
+            return changes
+
+    def enqueue(self, env):
+        self.ticket += 1
+        self.available[env.url] = env
+        self.buckets.setdefault((env.python_version, env.resources), OrderedDict())[env.url] = self.ticket
+
+    def dequeue(self, url):
+        env = self.available.pop(url)
+        key = (env.python_version, env.resources)
+        bucket = self.buckets[key]
+        del bucket[url]
+        if not bucket:
+            del self.buckets[key]
+        return env
+
+    def next_available(self, python_version=None, resources=None):
+        # Once probes have run, pick the fastest of the oldest few matches
+        window = CLAIM_PREFER_WINDOW if self.latency else 1
+        if python_version is None and resources is None:
+            candidates = list(itertools.islice(self.available, window))
+        else:
+            heads = []
+            for (version, tier), bucket in self.buckets.items():
+                if python_version not in (None, version) or resources not in (None, tier):
+                    continue
+                heads.extend((ticket, url) for url, ticket in itertools.islice(bucket.items(), window))
+            candidates = [url for _, url in heapq.nsmallest(window, heads)]
+        return min(candidates, key=lambda url: self.latency.get(url, float('inf')), default=None)
+
+    @timed('pool_operation_duration_seconds', backend='file', op='add')
+    def add(self, env):
+        with self.lock:
+            if env['url'] in self.urls:
+                return False
+            env.password = vault.seal(env.url, env.password)
+            self.enqueue(env)
+            self.urls.add(env['url'])
+            self.record(env['url'], 'ADD', env['url'], env['username'], env['password'],
+                        env['python_version'], env['resources'], env['added_at'])
+            return True
+
+    @timed('pool_operation_duration_seconds', backend='file', op='claim')
+    def claim(self, user_id, python_version=None, resources=None):
+        with self.lock:
+            url = self.next_available(python_version, resources)
+            if url is None:
+                return None
+            env = self.dequeue(url)
+            env.user_id = user_id
+            env.claimed_at = int(time.time())
+            env.expires_at = lease_deadline(env.claimed_at)
+            self.in_use[user_id] = env
+            heapq.heappush(self.expiry_heap, (env.expires_at, user_id))
+            self.record(url, 'CLAIM', url, user_id, env['claimed_at'], env['expires_at'])
+            return env
+
+    @timed('pool_operation_duration_seconds', backend='file', op='renew')
+    def renew(self, user_id, seconds):
+        """Push a lease's deadline out to seconds from now; never brings it forward."""
+        with self.lock:
+            env = self.in_use.get(user_id)
+            if env is None:
+                return None
+            env.expires_at = max(env.expires_at, int(time.time() + seconds))
+            heapq.heappush(self.expiry_heap, (env.expires_at, user_id))
+            self.record(env.url, 'RENEW', user_id, env['expires_at'])
+            return env
+
+    @timed('pool_operation_duration_seconds', backend='file', op='release')
+    def release(self, user_id, reason='RELEASE', rotate=True):
+        """End a lease. With a rotation hook set, the env is held until rotated() unless rotate is False."""
+        with self.lock:
+            env = self.in_use.pop(user_id, None)
+            if env is None:
+                return None
+            added_at = int(time.time())
+            released = Env(env.url, env.username, env.password, env.python_version, env.resources, added_at)
+            if rotate and self.hold_released:
+                self.rotating[env.url] = released
+            else:
+                self.enqueue(released)
+            self.record(env.url, reason, user_id, format_time(added_at))
+            if env.url in self.rotating:
+                self.record(env.url, 'HOLD', env.url)
+            return env
+
+    def rotating_env(self, url):
+        with self.lock:
+            return self.rotating.get(url)
+
+    def lease(self, user_id):
+        """The env leased to user_id, or None once the lease has ended."""
+        with self.lock:
+            return self.in_use.get(user_id)
+
+    def rotated(self, url, password=None):
+        """Put an env held for rotation back in the pool, with its new password if there is one."""
+        with self.lock:
+            env = self.rotating.pop(url, None)
+            if env is None:
+                return None
+            if password is None:
+                self.record(url, 'ROTATE', url)
+            else:
+                env.password = vault.seal(url, password)
+                self.record(url, 'ROTATE', url, env.password)
+            self.enqueue(env)
+            return env
+
+    def remove(self, url):
+        """Take an available, quarantined or held env out of the pool."""
+        with self.lock:
+            if url in self.available:
+                env = self.dequeue(url)
+            elif url in self.quarantined:
+                env = self.quarantined.pop(url)
+            elif url in self.rotating:
+                env = self.rotating.pop(url)
+            else:
+                return None
+            self.urls.discard(url)
+            self.latency.pop(url, None)
+            self.record(url, 'REMOVE', url)
+            return env
+
+    def apply_edits(self, remove, add, release, renew):
+        """Apply a diff of the pool files to the live pool in one step.
+
+        Releases go first so an env moved from the in-use file to the
+        available one comes back and is then updated. An edit that no
+        longer fits (the env was claimed or released since the files were
+        written) is skipped. Returns (changes, skipped), each a list of
+        (op, env or url, reason).
+        """
+        changes, skipped = [], []
+        with self.lock:
+            for user_id in release:
+                env = self.release(user_id)
+                if env is None:
+                    skipped.append(('release', user_id, 'not_in_use'))
+                else:
+                    changes.append(('release', env, None))
+            for user_id, deadline in renew.items():
+                env = self.in_use.get(user_id)
+                if env is None:
+                    skipped.append(('renew', user_id, 'not_in_use'))
+                    continue
+                env.expires_at = deadline
+                heapq.heappush(self.expiry_heap, (deadline, user_id))
+                self.record(env.url, 'RENEW', user_id, env['expires_at'])
+                changes.append(('renew', env, None))
+            for url in remove:
+                env = self.remove(url)
+                if env is None:
+                    skipped.append(('remove', url, 'in_use' if url in self.urls else 'missing'))
+                else:
+                    changes.append(('remove', env, None))
+            for env in add:
+                current = self.available.get(env.url) or self.quarantined.get(env.url)
+                if current is not None:
+                    if (current.username, current.password, current.python_version, current.resources) == \
+                            (env.username, env.password, env.python_version, env.resources):
+                        continue
+                    self.remove(env.url)
+                elif env.url in self.urls:
+                    skipped.append(('add', env.url, 'rotating' if env.url in self.rotating else 'in_use'))
+                    continue
+                self.add(env)
+                changes.append(('add', env, 'updated' if current is not None else None))
+        return changes, skipped
+
+    @timed('pool_operation_duration_seconds', backend='file', op='add_many')
+    def add_many(self, envs):
+        with self.lock:
+            return [self.add(env) for env in envs]
+
+    @timed('pool_operation_duration_seconds', backend='file', op='claim_many')
+    def claim_many(self, user_ids, python_version=None, resources=None, partial=False):
+        with self.lock:
+            if not partial and self.available_count(python_version, resources) < len(user_ids):
+                return []
+            envs = []
+            for user_id in user_ids:
+                env = self.claim(user_id, python_version, resources)
+                if env is None:
+                    break
+                envs.append(env)
+            return envs
+
+    @timed('pool_operation_duration_seconds', backend='file', op='release_many')
+    def release_many(self, user_ids, rotate=True):
+        with self.lock:
+            return [self.release(user_id, rotate=rotate) for user_id in user_ids]
+
+    @timed('pool_operation_duration_seconds', backend='file', op='expire')
+    def expire(self, now):
+        expired = []
+        with self.lock:
+            heap = self.expiry_heap
+            while heap and heap[0][0] < now:
+                deadline, user_id = heapq.heappop(heap)
+                # Released and renewed leases leave stale entries behind
+                env = self.in_use.get(user_id)
+                if env is None or env.expires_at != deadline:
+                    continue
+                expired.append(self.release(user_id, 'EXPIRE'))
+            if len(heap) > 2 * len(self.in_use) + 1024:
+                self.expiry_heap = [(env.expires_at, user_id) for user_id, env in self.in_use.items()]
+                heapq.heapify(self.expiry_heap)
+        return expired
+
+    def quarantine(self, url):
+        with self.lock:
+            if url not in self.available:
+                return False
+            self.quarantined[url] = self.dequeue(url)
+            self.note(url, 'QUARANTINE')
+            return True
+
+    def restore(self, url):
+        with self.lock:
+            env = self.quarantined.pop(url, None)
+            if env is None:
+                return False
+            self.enqueue(env)
+            self.note(url, 'RESTORE')
+            return True
+
+    def set_latency(self, url, latency_ms):
+        with self.lock:
+            self.latency[url] = latency_ms
+
+    def quarantined_urls(self):
+        with self.lock:
+            return list(self.quarantined)
+
+    def rotating_urls(self):
+        with self.lock:
+            return list(self.rotating)
+
+    def probe_targets(self):
+        with self.lock:
+            return list(self.available) + list(self.quarantined)
+
+    def counts(self):
+        with self.lock:
+            return len(self.available), len(self.in_use)
+
+    def available_count(self, python_version=None, resources=None):
+        with self.lock:
+            if python_version is None and resources is None:
+                return len(self.available)
+            return sum(len(bucket) for (version, tier), bucket in self.buckets.items()
+                       if python_version in (None, version) and resources in (None, tier))
+
+    def bucket_counts(self):
+        with self.lock:
+            return [{
+                'python_version': version,
+                'resources': tier,
+                'available_count': len(bucket)
+            } for (version, tier), bucket in self.buckets.items()]
+
+    @timed('pool_operation_duration_seconds', backend='file', op='snapshot')
+    def snapshot(self):
+        with self.lock:
+            return (list(self.available.values()) + list(self.quarantined.values()) +
+                    list(self.rotating.values()), list(self.in_use.values()))
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                self.dirty.clear()
+                lines, self.journal = self.journal, []
+            if not lines:
+                return True
+            if not append_journal(lines):
+                with self.lock:
+                    self.journal[:0] = lines
+                    self.mark_dirty()
+                return False
+            self.journal_records += len(lines)
+            return True
+
+    def compact(self):
+        with self.flush_lock:
+            with self.lock:
+                self.dirty.clear()
+                lines, self.journal = self.journal, []
+                available, in_use = self.snapshot()
+                held = list(self.rotating)
+                seq = self.seq
+            # Pending records are already part of the snapshot
+            if not save_pool(available, in_use, seq, held):
+                if append_journal(lines):
+                    self.journal_records += len(lines)
+                else:
+                    with self.lock:
+                        self.journal[:0] = lines
+                        self.mark_dirty()
+                return False
+            try:
+                truncate_journal()
+                self.journal_records = 0
+            except Exception as e:
+                log_event('JOURNAL_ERROR', error=str(e))
+            return True
+
+# SQLite pool
+class SqlitePoolStore:
+    """Pool state kept in a shared SQLite database in WAL mode.
+
+    Offers the same operations as PoolStore, but every call is a single
+    transaction against the database, so several server processes can
+    serve one pool. Requires SQLite 3.35+ for UPDATE ... RETURNING.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS envs (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            python_version TEXT NOT NULL,
+            resources TEXT NOT NULL,
+            added_at TEXT NOT NULL,
+            queued_at REAL NOT NULL,
+            user_id TEXT,
+            claimed_at TEXT,
+            quarantined INTEGER NOT NULL DEFAULT 0,
+            latency_ms REAL,
+            expires_at TEXT,
+            rotating INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_envs_url ON envs(url);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_envs_user_id ON envs(user_id);
+        CREATE INDEX IF NOT EXISTS idx_envs_python_version ON envs(python_version);
+        CREATE INDEX IF NOT EXISTS idx_envs_claimed_at ON envs(claimed_at);
+        CREATE INDEX IF NOT EXISTS idx_envs_queue ON envs(queued_at) WHERE user_id IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_envs_bucket_queue
+            ON envs(python_version, resources, queued_at) WHERE user_id IS NULL;
+        CREATE TABLE IF NOT EXISTS changes (
+            generation INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            url TEXT NOT NULL
+        );
+    '''
+    AVAILABLE_COLUMNS = 'url, username, password, python_version, resources, added_at'
+    IN_USE_COLUMNS = 'url, username, password, python_version, resources, added_at, user_id, claimed_at, expires_at'
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.hold_released = bool(ROTATE_HOOK)
+
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        if conn.in_transaction:
+            yield conn  # Nested call, the outer block commits
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def load(self):
+        conn = self.connect()
+        conn.executescript(self.SCHEMA)
+        # Databases created before health checks lack the probe columns
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(envs)')}
+        if 'quarantined' not in columns:
+            conn.execute('ALTER TABLE envs ADD COLUMN quarantined INTEGER NOT NULL DEFAULT 0')
+        if 'latency_ms' not in columns:
+            conn.execute('ALTER TABLE envs ADD COLUMN latency_ms REAL')
+        if 'expires_at' not in columns:
+            conn.execute('ALTER TABLE envs ADD COLUMN expires_at TEXT')
+            with self.transaction():
+                conn.executemany('UPDATE envs SET expires_at = ? WHERE user_id = ?', [
+                    (format_time(lease_deadline(parse_time(row[1]))), row[0]) for row in
+                    conn.execute('SELECT user_id, claimed_at FROM envs WHERE user_id IS NOT NULL').fetchall()])
+        if 'rotating' not in columns:
+            conn.execute('ALTER TABLE envs ADD COLUMN rotating INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_envs_expires_at ON envs(expires_at)')
+        if vault.sealing:
+            # Passwords saved before the vault
+            rows = conn.execute('SELECT id, url, password FROM envs WHERE password NOT LIKE ?',
+                                (vault.PREFIX + '%',)).fetchall()
+            if rows:
+                with self.transaction():
+                    conn.executemany('UPDATE envs SET password = ? WHERE id = ? AND password = ?',
+                                     [(vault.seal(row[1], row[2]), row[0], row[2]) for row in rows])
+                log_event('PASSWORDS_SEALED', count=len(rows))
+
+    @staticmethod
+    def bucket_filter(python_version, resources):
+        where, params = ['user_id IS NULL', 'quarantined = 0', 'rotating = 0'], []
+        if python_version is not None:
+            where.append('python_version = ?')
+            params.append(python_version)
+        if resources is not None:
+            where.append('resources = ?')
+            params.append(resources)
+        return ' AND '.join(where), params
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='add')
+    def add(self, env):
+        with self.transaction() as conn:
+            try:
+                conn.execute(
+                    'INSERT INTO envs (url, username, password, python_version, resources, added_at, queued_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (env['url'], env['username'], vault.seal(env['url'], env['password']), env['python_version'],
+                     env['resources'], env['added_at'], time.time()))
+            except sqlite3.IntegrityError:
+                return False
+            conn.execute("INSERT INTO changes (op, url) VALUES ('ADD', ?)", (env['url'],))
+            return True
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='claim')
+    def claim(self, user_id, python_version=None, resources=None):
+        where, params = self.bucket_filter(python_version, resources)
+        now = int(time.time())
+        with self.transaction() as conn:
+            row = conn.execute(
+                f'''UPDATE envs SET user_id = ?, claimed_at = ?, expires_at = ?
+                   WHERE id = (SELECT id FROM (SELECT id, latency_ms, queued_at FROM envs WHERE {where}
+                                               ORDER BY queued_at LIMIT ?)
+                               ORDER BY latency_ms IS NULL, latency_ms, queued_at LIMIT 1)
+                   RETURNING {self.IN_USE_COLUMNS}''',
+                [user_id, format_time(now), format_time(lease_deadline(now))] + params +
+                [CLAIM_PREFER_WINDOW]).fetchone()
+            if row is None:
+                return None
+            conn.execute("INSERT INTO changes (op, url) VALUES ('CLAIM', ?)", (row['url'],))
+            return dict(row)
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='release')
+    def release(self, user_id, reason='RELEASE', rotate=True):
+        with self.transaction() as conn:
+            row = conn.execute(
+                f'''UPDATE envs SET user_id = NULL, claimed_at = NULL, expires_at = NULL, added_at = ?, queued_at = ?,
+                                   rotating = ?
+                   WHERE user_id = ?
+                   RETURNING {self.AVAILABLE_COLUMNS}''',
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), time.time(),
+                 int(rotate and self.hold_released), user_id)).fetchone()
+            if row is None:
+                return None
+            conn.execute('INSERT INTO changes (op, url) VALUES (?, ?)', (reason, row['url']))
+            return dict(row, user_id=user_id)
+
+    def rotating_env(self, url):
+        row = self.connect().execute(
+            f'SELECT {self.AVAILABLE_COLUMNS} FROM envs WHERE url = ? AND rotating = 1', (url,)).fetchone()
+        return dict(row) if row else None
+
+    def lease(self, user_id):
+        row = self.connect().execute(
+            f'SELECT {self.IN_USE_COLUMNS} FROM envs WHERE user_id = ?', (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def rotated(self, url, password=None):
+        with self.transaction() as conn:
+            row = conn.execute(
+                f'''UPDATE envs SET rotating = 0, password = COALESCE(?, password), queued_at = ?
+                   WHERE url = ? AND rotating = 1
+                   RETURNING {self.AVAILABLE_COLUMNS}''',
+                (None if password is None else vault.seal(url, password), time.time(), url)).fetchone()
+            if row is None:
+                return None
+            conn.execute("INSERT INTO changes (op, url) VALUES ('ROTATE', ?)", (url,))
+            return dict(row)
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='renew')
+    def renew(self, user_id, seconds):
+        with self.transaction() as conn:
+            row = conn.execute(
+                # Timestamps are zero-padded, so MAX() keeps the later deadline
+                f'UPDATE envs SET expires_at = MAX(expires_at, ?) WHERE user_id = ? RETURNING {self.IN_USE_COLUMNS}',
+                (format_time(time.time() + seconds), user_id)).fetchone()
+            if row is None:
+                return None
+            conn.execute("INSERT INTO changes (op, url) VALUES ('RENEW', ?)", (row['url'],))
+            return dict(row)
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='add_many')
+    def add_many(self, envs):
+        with self.transaction():
+            return [self.add(env) for env in envs]
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='claim_many')
+    def claim_many(self, user_ids, python_version=None, resources=None, partial=False):
+        with self.transaction():
+            if not partial and self.available_count(python_version, resources) < len(user_ids):
+                return []
+            envs = []
+            for user_id in user_ids:
+                env = self.claim(user_id, python_version, resources)
+                if env is None:
+                    break
+                envs.append(env)
+            return envs
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='release_many')
+    def release_many(self, user_ids, rotate=True):
+        with self.transaction():
+            return [self.release(user_id, rotate=rotate) for user_id in user_ids]
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='expire')
+    def expire(self, now):
+        cutoff = format_time(now)
+        with self.transaction() as conn:
+            expired = [dict(row) for row in conn.execute(
+                f'SELECT {self.IN_USE_COLUMNS} FROM envs WHERE expires_at < ?', (cutoff,))]
+            conn.execute(
+                'UPDATE envs SET user_id = NULL, claimed_at = NULL, expires_at = NULL, added_at = ?, queued_at = ?, '
+                'rotating = ? WHERE expires_at < ?',
+                (format_time(now), time.time(), int(self.hold_released), cutoff))
+            conn.executemany("INSERT INTO changes (op, url) VALUES ('EXPIRE', ?)",
+                             [(env['url'],) for env in expired])
+            conn.execute('DELETE FROM changes WHERE generation <= (SELECT MAX(generation) FROM changes) - ?',
+                         (CHANGE_LOG_SIZE,))
+        return expired
+
+    def generation(self):
+        # AUTOINCREMENT keeps counting after old changes are trimmed
+        row = self.connect().execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, generation):
+        """Changes after generation, or None if they are no longer kept."""
+        conn = self.connect()
+        conn.execute('BEGIN')
+        try:
+            newest = self.generation()
+            oldest = conn.execute('SELECT MIN(generation) - 1 FROM changes').fetchone()[0]
+            if generation < (newest if oldest is None else oldest) or generation > newest:
+                return None
+            return [tuple(row) for row in conn.execute(
+                'SELECT generation, op, url FROM changes WHERE generation > ? ORDER BY generation',
+                (generation,))]
+        finally:
+            conn.execute('COMMIT')
+
+    def quarantine(self, url):
+        with self.transaction() as conn:
+            row = conn.execute('UPDATE envs SET quarantined = 1 '
+                               'WHERE url = ? AND user_id IS NULL AND quarantined = 0 AND rotating = 0 RETURNING url',
+                               (url,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("INSERT INTO changes (op, url) VALUES ('QUARANTINE', ?)", (url,))
+            return True
+
+    def restore(self, url):
+        with self.transaction() as conn:
+            row = conn.execute('UPDATE envs SET quarantined = 0, queued_at = ? '
+                               'WHERE url = ? AND quarantined = 1 RETURNING url',
+                               (time.time(), url)).fetchone()
+            if row is None:
+                return False
+            conn.execute("INSERT INTO changes (op, url) VALUES ('RESTORE', ?)", (url,))
+            return True
+
+    def set_latency(self, url, latency_ms):
+        self.connect().execute('UPDATE envs SET latency_ms = ? WHERE url = ?', (latency_ms, url))
+
+    def quarantined_urls(self):
+        return [row[0] for row in self.connect().execute('SELECT url FROM envs WHERE quarantined = 1')]
+
+    def rotating_urls(self):
+        return [row[0] for row in self.connect().execute('SELECT url FROM envs WHERE rotating = 1')]
+
+    def probe_targets(self):
+        return [row[0] for row in self.connect().execute(
+            'SELECT url FROM envs WHERE user_id IS NULL AND rotating = 0')]
+
+    def counts(self):
+        row = self.connect().execute(
+            'SELECT COUNT(*) - COUNT(user_id) - COALESCE(SUM(quarantined), 0) - COALESCE(SUM(rotating), 0), '
+            'COUNT(user_id) FROM envs').fetchone()
+        return row[0], row[1]
+
+    def available_count(self, python_version=None, resources=None):
+        where, params = self.bucket_filter(python_version, resources)
+        return self.connect().execute(f'SELECT COUNT(*) FROM envs WHERE {where}', params).fetchone()[0]
+
+    def bucket_counts(self):
+        return [{
+            'python_version': row[0],
+            'resources': row[1],
+            'available_count': row[2]
+        } for row in self.connect().execute(
+            'SELECT python_version, resources, COUNT(*) FROM envs '
+            'WHERE user_id IS NULL AND quarantined = 0 AND rotating = 0 GROUP BY python_version, resources')]
+
+    @timed('pool_operation_duration_seconds', backend='sqlite', op='snapshot')
+    def snapshot(self):
+        conn = self.connect()
+        conn.execute('BEGIN')
+        try:
+            available = [dict(row) for row in conn.execute(
+                f'SELECT {self.AVAILABLE_COLUMNS} FROM envs WHERE user_id IS NULL ORDER BY queued_at')]
+            in_use = [dict(row) for row in conn.execute(
+                f'SELECT {self.IN_USE_COLUMNS} FROM envs WHERE user_id IS NOT NULL ORDER BY claimed_at')]
+        finally:
+            conn.execute('COMMIT')
+        return available, in_use
+
+    def import_envs(self, available, in_use):
+        """Replace the database contents with the given env lists."""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM envs')
+            # Bump the generation and drop the change log so delta clients resync
+            conn.execute("INSERT INTO changes (op, url) VALUES ('IMPORT', '')")
+            conn.execute('DELETE FROM changes')
+            conn.executemany(
+                'INSERT OR IGNORE INTO envs (url, username, password, python_version, resources, '
+                'added_at, queued_at, user_id, claimed_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(env['url'], env['username'], env['password'], env['python_version'],
+                  env.get('resources', '2vCPU 4GB RAM'), env.get('added_at', env.get('claimed_at', '')),
+                  now, env['user_id'], env['claimed_at'],
+                  env.get('expires_at') or format_time(lease_deadline(parse_time(env['claimed_at']))))
+                 for env in in_use] +
+                [(env['url'], env['username'], env['password'], env['python_version'],
+                  env.get('resources', '2vCPU 4GB RAM'), env['added_at'],
+                  now + i * 1e-6, None, None, None) for i, env in enumerate(available)])
+
+    def flush(self):
+        return True  # Every operation commits on its own
+
+    def compact(self):
+        return True
+
+if STORAGE_BACKEND == 'sqlite':
+    pool = SqlitePoolStore(DB_FILE)
+else:
+    pool = PoolStore()
+
+# Tenants
+class Tenant:
+    """Who a claim is for: its priority class, fair-share weight and lease cap."""
     
-    for env in in_use[:]:
+    __slots__ = ('name', 'priority_class', 'weight', 'max_leases')
+    
+    def __init__(self, name, priority_class=DEFAULT_PRIORITY_CLASS, weight=1, max_leases=0):
+        self.name = name
+        self.priority_class = priority_class if priority_class in PRIORITY_CLASSES else DEFAULT_PRIORITY_CLASS
+        self.weight = weight if weight > 0 else 1
+        self.max_leases = max_leases  # 0 = no cap
+
+def parse_tenants(text):
+    """API key -> Tenant from POOL_TENANTS. Tenants are named by a hash of their key."""
+    tenants = {}
+    for item in text.split(','):
+        key, _, spec = item.strip().partition('=')
+        if not key:
+            continue
+        fields = spec.split(':')
+        tenants[key] = Tenant(
+            'key:' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:12],
+            fields[0].strip() or DEFAULT_PRIORITY_CLASS,
+            float(fields[2]) if len(fields) > 2 and fields[2].strip() else 1,
+            int(fields[1]) if len(fields) > 1 and fields[1].strip() else 0
+        )
+    return tenants
+
+TENANTS = parse_tenants(TENANT_SPECS)
+ANONYMOUS = Tenant('anonymous')  # Claims made by the server itself
+
+def tenant_of(remote_addr, api_key, forwarded=False):
+    """Tenant for a request: its API key's, else one per client address.
+
+    forwarded must only be set for calls peer_forwarded() accepted.
+    """
+    tenant = TENANTS.get(api_key)
+    if tenant is not None:
+        return tenant
+    if forwarded:
+        # Claims stolen by another node count against its own tenants
+        return Tenant(f'peer:{remote_addr}')
+    return Tenant(f'ip:{remote_addr}', max_leases=DEFAULT_MAX_LEASES)
+
+# Waiting queue
+class Waiter:
+    def __init__(self, number, python_version, resources, tenant):
+        self.ticket = uuid.uuid4().hex
+        self.number = number
+        self.python_version = python_version
+        self.resources = resources
+        self.tenant = tenant
+        self.event = threading.Event()
+        self.listeners = []
+        self.env = None
+        self.joined_at = time.time()
+        self.detached_at = None
+        self.queued = False  # Not yet served or gone
+        self.slot = None  # In its class's ArrivalOrder
+
+    def wake(self):
+        self.event.set()
+        for listener in list(self.listeners):
+            listener()
+
+    def add_listener(self, listener):
+        """Call listener once this waiter has been handed an env."""
+        self.listeners.append(listener)
+        if self.event.is_set():
+            listener()
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+class ArrivalOrder:
+    """Unserved waiters of one priority class, in the order they arrived.
+
+    A Fenwick tree over arrival slots, so a waiter's place is a prefix sum
+    instead of a count over everyone queued. Slots start over whenever the
+    class has nobody left waiting.
+    """
+
+    def __init__(self):
+        self.tree = [0]
+        self.live = 0
+
+    def prefix(self, slot):
+        total = 0
+        while slot > 0:
+            total += self.tree[slot]
+            slot -= slot & -slot
+        return total
+
+    def append(self):
+        """Add a waiter behind everyone else; returns its slot."""
+        if not self.live:
+            self.tree = [0]
+        slot = len(self.tree)
+        # The new node covers (slot - lowbit, slot], so sum the part already there
+        self.tree.append(1 + self.prefix(slot - 1) - self.prefix(slot - (slot & -slot)))
+        self.live += 1
+        return slot
+
+    def remove(self, slot):
+        self.live -= 1
+        while slot < len(self.tree):
+            self.tree[slot] -= 1
+            slot += slot & -slot
+
+    def rank(self, slot):
+        """1-based place of the waiter in slot."""
+        return self.prefix(slot)
+
+class WaitLane:
+    """Unserved waiters of one priority class asking for the same filter.
+
+    Each tenant's waiters queue oldest first, and a heap orders the tenants
+    by (virtual finish time, oldest waiter). Both only grow while a tenant
+    waits here, so entries are re-keyed lazily when they surface stale.
+    Tenants at their lease cap are parked off the heap until one of their
+    leases ends.
+    """
+
+    def __init__(self):
+        self.queues = {}  # tenant name -> deque of waiters; ones no longer queued are skipped
+        self.live = {}  # tenant name -> waiters still queued
+        self.heap = []
+        self.entries = {}  # tenant name -> its current heap entry
+        self.parked = set()
+
+    def oldest(self, name):
+        queue = self.queues[name]
+        while not queue[0].queued:
+            queue.popleft()
+        return queue[0]
+
+    def push(self, name, finish):
+        waiter = self.oldest(name)
+        entry = (finish(waiter.tenant), waiter.number, name)
+        self.entries[name] = entry
+        heapq.heappush(self.heap, entry)
+
+    def add(self, waiter, finish):
+        name = waiter.tenant.name
+        self.queues.setdefault(name, deque()).append(waiter)
+        self.live[name] = self.live.get(name, 0) + 1
+        if name not in self.entries and name not in self.parked:
+            self.push(name, finish)
+
+    def discard(self, waiter):
+        """Stop counting a waiter that is no longer queued."""
+        name = waiter.tenant.name
+        left = self.live.pop(name) - 1
+        if left:
+            self.live[name] = left
+            return
+        del self.queues[name]
+        self.entries.pop(name, None)
+        self.parked.discard(name)
+
+    def unpark(self, name, finish):
+        if name in self.parked:
+            self.parked.discard(name)
+            self.push(name, finish)
+
+    def head(self, finish, has_room):
+        """Next waiter in fair-share order whose tenant may take a lease."""
+        while self.heap:
+            entry = self.heap[0]
+            finishes, number, name = entry
+            if self.entries.get(name) is not entry:
+                heapq.heappop(self.heap)
+                continue
+            waiter = self.oldest(name)
+            if (finishes, number) != (finish(waiter.tenant), waiter.number):
+                heapq.heappop(self.heap)
+                self.push(name, finish)
+                continue
+            if not has_room(waiter.tenant):
+                heapq.heappop(self.heap)
+                del self.entries[name]
+                self.parked.add(name)
+                continue
+            return waiter
+        return None
+
+class WaitQueue:
+    """Clients waiting for an env while the pool is empty, and who goes next.
+
+    Freed envs are claimed for waiters by dispatch(), and plain claims
+    dispatch first, so nobody can jump the queue. Waiters are served by
+    weighted fair share: each priority class has a pass that advances by
+    1/weight per env it is handed, and the class whose next env would
+    finish first (pass + 1/weight) goes next, so weight decides even when
+    every pass is still equal. The same is done between the tenants of a
+    class, and a tenant's own waiters go oldest first. A class or tenant
+    that starts waiting again picks up at the current pass rather than
+    spending credit saved up while idle. Tenants at their lease cap are
+    skipped until they release one.
+
+    Lease counts are kept in memory from the claims made here, so after a
+    restart they start from zero, and leases stolen from other shards count
+    on the node that owns them.
+
+    A waiter between long-polls is detached and keeps its place for
+    WAIT_GRACE seconds; reap() drops it after that and returns any env it
+    was handed.
+
+    Unserved waiters sit in a WaitLane per (priority class, filter), so
+    dispatch compares one head per lane that has a matching env free
+    rather than every waiter, and an ArrivalOrder per class gives queue
+    positions without a scan.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.waiters = OrderedDict()
+        self.lanes = {}  # (priority class, python_version, resources) -> WaitLane
+        self.order = {priority_class: ArrivalOrder() for priority_class in PRIORITY_CLASSES}
+        self.lock = threading.Lock()
+        self.count = 0
+        self.depth = dict.fromkeys(PRIORITY_CLASSES, 0)  # class -> waiters not yet served
+        self.tenant_waiting = {}  # tenant name -> waiters not yet served
+        self.class_pass = dict.fromkeys(PRIORITY_CLASSES, 0.0)
+        self.class_clock = 0.0  # Pass of the class served last
+        self.tenant_pass = {}  # tenant name -> pass, while it has waiters
+        self.tenant_clock = dict.fromkeys(PRIORITY_CLASSES, 0.0)
+        self.leases = {}  # user_id -> Tenant
+        self.tenant_leases = {}  # tenant name -> active leases
+        self.class_leases = dict.fromkeys(PRIORITY_CLASSES, 0)
+
+    def class_finish(self, priority_class):
+        return self.class_pass[priority_class] + 1 / PRIORITY_CLASSES[priority_class]
+
+    def tenant_finish(self, tenant):
+        return self.tenant_pass[tenant.name] + 1 / tenant.weight
+
+    def lease_room_locked(self, tenant):
+        if not tenant.max_leases:
+            return math.inf
+        return max(0, tenant.max_leases - self.tenant_leases.get(tenant.name, 0))
+
+    def lease_room(self, tenant):
+        """Leases tenant may still take before hitting its cap."""
+        with self.lock:
+            return self.lease_room_locked(tenant)
+
+    def record_locked(self, tenant, env):
+        self.leases[env['user_id']] = tenant
+        self.tenant_leases[tenant.name] = self.tenant_leases.get(tenant.name, 0) + 1
+        self.class_leases[tenant.priority_class] += 1
+
+    def forget(self, user_id):
+        """Drop a lease that has ended from its tenant's count."""
+        with self.lock:
+            tenant = self.leases.pop(user_id, None)
+            if tenant is None:
+                return
+            left = self.tenant_leases.pop(tenant.name) - 1
+            if left:
+                self.tenant_leases[tenant.name] = left
+            self.class_leases[tenant.priority_class] -= 1
+            blocked = tenant.max_leases and self.tenant_waiting.get(tenant.name)
+            if blocked:
+                for lane in self.lanes.values():
+                    lane.unpark(tenant.name, self.tenant_finish)
+        if blocked:
+            self.dispatch()
+
+    def observe(self, record):
+        if record['event'] in ('ENV_RELEASED', 'ENV_EXPIRED') and record.get('user_id'):
+            self.forget(record['user_id'])
+
+    def enqueue_locked(self, waiter):
+        tenant = waiter.tenant
+        priority_class = tenant.priority_class
+        if not self.depth[priority_class]:
+            self.class_pass[priority_class] = max(self.class_pass[priority_class], self.class_clock)
+        if not self.tenant_waiting.get(tenant.name):
+            self.tenant_pass[tenant.name] = max(self.tenant_pass.get(tenant.name, 0.0),
+                                                self.tenant_clock[priority_class])
+        self.depth[priority_class] += 1
+        self.tenant_waiting[tenant.name] = self.tenant_waiting.get(tenant.name, 0) + 1
+        self.waiters[waiter.ticket] = waiter
+        waiter.queued = True
+        waiter.slot = self.order[priority_class].append()
+        key = (priority_class, waiter.python_version, waiter.resources)
+        if key not in self.lanes:
+            self.lanes[key] = WaitLane()
+        self.lanes[key].add(waiter, self.tenant_finish)
+
+    def dequeue_locked(self, waiter):
+        """Stop counting a waiter that was served or left."""
+        tenant = waiter.tenant
+        waiter.queued = False
+        self.order[tenant.priority_class].remove(waiter.slot)
+        key = (tenant.priority_class, waiter.python_version, waiter.resources)
+        lane = self.lanes[key]
+        lane.discard(waiter)
+        if not lane.live:
+            del self.lanes[key]
+        self.depth[tenant.priority_class] -= 1
+        left = self.tenant_waiting.pop(tenant.name) - 1
+        if left:
+            self.tenant_waiting[tenant.name] = left
+        else:
+            self.tenant_pass.pop(tenant.name, None)
+
+    def grant_locked(self, waiter, env):
+        tenant = waiter.tenant
+        priority_class = tenant.priority_class
+        self.class_clock = self.class_pass[priority_class]
+        self.class_pass[priority_class] += 1 / PRIORITY_CLASSES[priority_class]
+        self.tenant_clock[priority_class] = self.tenant_pass[tenant.name]
+        self.tenant_pass[tenant.name] += 1 / tenant.weight
+        self.record_locked(tenant, env)
+        self.dequeue_locked(waiter)
+        log_event('ENV_CLAIMED', url=env['url'], user_id=env['user_id'],
+                  python_version=env['python_version'], priority_class=priority_class,
+                  waited_ms=round((time.time() - waiter.joined_at) * 1000, 1))
+        waiter.env = env
+        waiter.wake()
+
+    def dispatch_locked(self):
+        has_room = lambda tenant: self.lease_room_locked(tenant) >= 1
+        while True:
+            if not self.store.counts()[0]:
+                break
+            stocked = {}  # (python_version, resources) -> matching envs free
+            best = None
+            for (priority_class, python_version, resources), lane in self.lanes.items():
+                key = (python_version, resources)
+                if key not in stocked:
+                    stocked[key] = self.store.available_count(*key)
+                if not stocked[key]:
+                    continue
+                waiter = lane.head(self.tenant_finish, has_room)
+                if waiter is None:
+                    continue
+                rank = (self.class_finish(priority_class), self.tenant_finish(waiter.tenant), waiter.number)
+                if best is None or rank < best[0]:
+                    best = (rank, waiter)
+            if best is None:
+                break
+            waiter = best[1]
+            env = self.store.claim(generate_user_id(), waiter.python_version, waiter.resources)
+            if env is None:
+                break  # Taken by another process since it was counted; the next tick retries
+            self.grant_locked(waiter, env)
+
+    def dispatch(self):
+        with self.lock:
+            self.dispatch_locked()
+
+    def claim_locked(self, user_id, python_version, resources, tenant):
+        if self.lease_room_locked(tenant) < 1:
+            return None
+        env = self.store.claim(user_id, python_version, resources)
+        if env is not None:
+            self.record_locked(tenant, env)
+        return env
+
+    def claim(self, user_id, python_version=None, resources=None, tenant=ANONYMOUS):
+        with self.lock:
+            self.dispatch_locked()
+            return self.claim_locked(user_id, python_version, resources, tenant)
+
+    def claim_many(self, user_ids, python_version=None, resources=None, partial=False, tenant=ANONYMOUS):
+        with self.lock:
+            self.dispatch_locked()
+            allowed = self.lease_room_locked(tenant)
+            if allowed < len(user_ids):
+                if not partial:
+                    return []
+                user_ids = user_ids[:max(allowed, 0)]
+            envs = self.store.claim_many(user_ids, python_version, resources, partial)
+            for env in envs:
+                self.record_locked(tenant, env)
+            return envs
+
+    def join(self, python_version, resources, ticket=None, tenant=ANONYMOUS):
+        """Claim right away or queue up; returns (env, waiter)."""
+        with self.lock:
+            waiter = self.waiters.get(ticket) if ticket else None
+            if waiter is None:
+                self.dispatch_locked()
+                env = self.claim_locked(generate_user_id(), python_version, resources, tenant)
+                if env is not None:
+                    log_event('ENV_CLAIMED', url=env['url'], user_id=env['user_id'],
+                              python_version=env['python_version'],
+                              priority_class=tenant.priority_class, waited_ms=0)
+                    return env, None
+                self.count += 1
+                waiter = Waiter(self.count, python_version, resources, tenant)
+                self.enqueue_locked(waiter)
+            waiter.detached_at = None
+            return None, waiter
+
+    def collect(self, waiter):
+        """Take the env handed to waiter, or detach it until the next poll."""
+        with self.lock:
+            if waiter.env is not None:
+                self.waiters.pop(waiter.ticket, None)
+                return waiter.env
+            waiter.detached_at = time.time()
+            return None
+
+    def wait(self, python_version, resources, timeout, ticket=None, tenant=ANONYMOUS):
+        """Return (env, waiter); env is None if the timeout passed first."""
+        env, waiter = self.join(python_version, resources, ticket, tenant)
+        if env is not None:
+            return env, None
+        waiter.event.wait(timeout)
+        return self.collect(waiter), waiter
+
+    def cancel(self, ticket):
+        with self.lock:
+            waiter = self.waiters.pop(ticket, None)
+            if waiter is not None and waiter.env is None:
+                self.dequeue_locked(waiter)
+        if waiter is not None and waiter.env is not None:
+            self.give_back(waiter.env, 'waiter_left')
+
+    def give_back(self, env, reason):
+        """Release an env claimed for a client it never reached."""
+        self.store.release(env['user_id'], rotate=False)  # Its password was never handed out
+        log_event('ENV_RELEASED', url=env['url'], user_id=env['user_id'],
+                  python_version=env['python_version'], reason=reason)
+        self.dispatch()
+
+    def reap(self):
+        cutoff = time.time() - WAIT_GRACE
+        with self.lock:
+            gone = [waiter.ticket for waiter in self.waiters.values()
+                    if waiter.detached_at is not None and waiter.detached_at < cutoff]
+        for ticket in gone:
+            self.cancel(ticket)
+
+    def position(self, waiter):
+        """Place among the unserved waiters of the same priority class."""
+        with self.lock:
+            if not waiter.queued:
+                return 1  # Served since the caller last looked
+            return self.order[waiter.tenant.priority_class].rank(waiter.slot)
+
+    def depths(self):
+        """Unserved waiters per priority class."""
+        with self.lock:
+            return dict(self.depth)
+
+    def lease_counts(self):
+        """Active leases per priority class."""
+        with self.lock:
+            return dict(self.class_leases)
+
+    def __len__(self):
+        return len(self.waiters)
+
+wait_queue = WaitQueue(pool)
+event_listeners.append(wait_queue.observe)
+
+# Status cache
+class StatusCache:
+    """Serialized /api/status bodies for the current pool generation.
+
+    Entries are dropped as soon as the store reports a new generation, so
+    repeated status calls between mutations cost one dict lookup.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.generation = None
+        self.bodies = {}
+        self.url_lists = None
+
+    def current(self):
+        generation = self.store.generation()
+        with self.lock:
+            if generation != self.generation:
+                self.generation = generation
+                self.bodies = {}
+                self.url_lists = None
+        return generation
+
+    def body(self, key, build):
+        generation = self.current()
+        with self.lock:
+            body = self.bodies.get(key)
+        if body is None:
+            body = build()
+            with self.lock:
+                if self.generation == generation:
+                    self.bodies[key] = body
+        return generation, body
+
+    def sorted_urls(self, name):
+        """URL lists in sorted order, so url cursors stay valid across pages."""
+        generation = self.current()
+        with self.lock:
+            url_lists = self.url_lists
+        if url_lists is None:
+            available, in_use = self.store.snapshot()
+            quarantined = set(self.store.quarantined_urls())
+            held = quarantined.union(self.store.rotating_urls())
+            url_lists = {
+                'available': sorted(env['url'] for env in available if env['url'] not in held),
+                'in_use': sorted(env['url'] for env in in_use),
+                'quarantined': sorted(quarantined)
+            }
+            with self.lock:
+                if self.generation == generation:
+                    self.url_lists = url_lists
+        return generation, url_lists[name]
+
+status_cache = StatusCache(pool)
+
+# Demand forecast
+class DemandForecast:
+    """Claim, rejection and release rates per python_version.
+
+    Each rate is an exponentially weighted moving average in events per
+    second, decayed on read so no timer is needed: 'short' reacts to bursts
+    such as a class starting, 'long' tracks the baseline. It is fed from
+    the event log, so every claim path counts.
+    """
+
+    SERIES = {
+        'ENV_CLAIMED': 'claims',
+        'ENV_RESERVED': 'claims',
+        'CLAIM_REJECTED': 'rejections',
+        'ENV_RELEASED': 'releases',
+        'ENV_EXPIRED': 'releases',
+        'RESERVATION_EXPIRED': 'releases'
+    }
+
+    def __init__(self, windows=FORECAST_WINDOWS):
+        self.windows = windows
+        self.lock = threading.Lock()
+        self.rates = {}  # (python_version, series, window) -> [rate, updated]
+
+    def observe(self, record):
+        series = self.SERIES.get(record['event'])
+        if series is None:
+            return
+        python_version = record.get('python_version') or 'any'
+        count = record.get('count', 1)
+        now = time.monotonic()
+        with self.lock:
+            for window, tau in self.windows.items():
+                entry = self.rates.setdefault((python_version, series, window), [0.0, now])
+                entry[0] = entry[0] * math.exp(-(now - entry[1]) / tau) + count / tau
+                entry[1] = now
+
+    def rate(self, python_version, series, window, now):
+        entry = self.rates.get((python_version, series, window))
+        if entry is None:
+            return 0.0
+        return entry[0] * math.exp(-(now - entry[1]) / self.windows[window])
+
+    def forecast(self, horizon=FORECAST_HORIZON):
+        """Expected demand against available envs over the next horizon seconds."""
+        available = {}
+        for bucket in pool.bucket_counts():
+            available[bucket['python_version']] = available.get(bucket['python_version'], 0) + bucket['available_count']
+        now = time.monotonic()
+        with self.lock:
+            versions = set(available) | {key[0] for key in self.rates}
+            rates = {version: {series: {window: self.rate(version, series, window, now)
+                                        for window in self.windows}
+                               for series in ('claims', 'rejections', 'releases')}
+                     for version in versions}
+        
+        buckets = []
+        for version in sorted(versions):
+            count = sum(available.values()) if version == 'any' else available.get(version, 0)
+            # Each window gives its own outlook; plan for the worse one
+            pressure, net = 0.0, 0.0
+            for window in self.windows:
+                demand = rates[version]['claims'][window] + rates[version]['rejections'][window]
+                supply = rates[version]['releases'][window]
+                pressure = max(pressure, demand * horizon / max(count + supply * horizon, 1))
+                net = max(net, demand - supply)
+            buckets.append({
+                'python_version': version,
+                'available_count': count,
+                'claims_per_min': {window: round(rate * 60, 3) for window, rate in rates[version]['claims'].items()},
+                'rejections_per_min': {window: round(rate * 60, 3) for window, rate in rates[version]['rejections'].items()},
+                'releases_per_min': {window: round(rate * 60, 3) for window, rate in rates[version]['releases'].items()},
+                'pressure': round(pressure, 3),
+                'seconds_to_empty': round(count / net, 1) if net > 0 else None,
+                'recommended_adds': max(0, math.ceil(net * horizon - count))
+            })
+        return buckets
+
+forecast = DemandForecast()
+event_listeners.append(forecast.observe)
+
+# Reservations
+class Reservations:
+    """Envs held for a client that confirms within a few seconds.
+
+    A reservation is an ordinary claim whose user_id and credentials are
+    withheld until confirm(); reap() hands unconfirmed ones back to the
+    pool. Reservation ids carry the shard tag like user_ids do.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.pending = {}  # reservation_id -> (deadline, env)
+
+    def reserve(self, python_version, resources, ttl, tenant=ANONYMOUS):
+        env = wait_queue.claim(generate_user_id(), python_version, resources, tenant)
+        if env is None:
+            return None, None
+        reservation_id = generate_user_id().replace('user_', 'resv_', 1)
+        with self.lock:
+            self.pending[reservation_id] = (time.time() + ttl, env)
+        return reservation_id, env
+
+    def confirm(self, reservation_id):
+        with self.lock:
+            entry = self.pending.pop(reservation_id, None)
+        return entry[1] if entry else None
+
+    def reap(self):
+        now = time.time()
+        with self.lock:
+            expired = [reservation_id for reservation_id, (deadline, _) in self.pending.items()
+                       if deadline < now]
+            envs = [self.pending.pop(reservation_id)[1] for reservation_id in expired]
+        for reservation_id, env in zip(expired, envs):
+            wait_queue.forget(env['user_id'])
+            if self.store.release(env['user_id'], rotate=False):
+                log_event('RESERVATION_EXPIRED', url=env['url'], reservation_id=reservation_id,
+                          python_version=env['python_version'])
+        if envs:
+            wait_queue.dispatch()
+
+    def __len__(self):
+        return len(self.pending)
+
+reservations = Reservations(pool)
+
+# Event bus
+BUS_EVENTS = {
+    'ENV_ADDED', 'ENV_CLAIMED', 'ENV_RELEASED', 'ENV_EXPIRED', 'ENV_RESERVED',
+    'RESERVATION_EXPIRED', 'RESERVATION_CONFIRMED', 'LEASE_RENEWED',
+    'ENV_QUARANTINED', 'ENV_RESTORED', 'ENV_REMOVED', 'ENV_ROTATED'
+}
+
+class EventBus:
+    """Recent pool changes for /api/events subscribers and webhooks.
+
+    publish() runs on the thread that changed the pool, so it only appends
+    to a bounded ring and wakes readers. Readers keep their own cursor (the
+    last event id they saw); one that falls off the end of the ring is told
+    to resync.
+    """
+
+    def __init__(self, size=EVENT_BUFFER_SIZE):
+        self.events = deque(maxlen=size)
+        self.last_id = 0
+        self.cond = threading.Condition()
+        self.listeners = []
+
+    def publish(self, record):
+        if record['event'] not in BUS_EVENTS:
+            return
+        event = {key: value for key, value in record.items() if key not in ('user_id', 'reservation_id')}
+        if record.get('user_id'):
+            # user_ids release leases, so subscribers get a stable alias instead
+            event['lease_id'] = hashlib.sha256(record['user_id'].encode('utf-8')).hexdigest()[:16]
+        if ring:
+            event['node'] = POOL_NODE
+        with self.cond:
+            self.last_id += 1
+            event['id'] = self.last_id
+            self.events.append(event)
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def since(self, after):
+        """(events after id after, reset) where reset means some were already dropped."""
+        with self.cond:
+            if not self.events or after >= self.last_id:
+                return [], False
+            oldest = self.events[0]['id']
+            start = max(after - oldest + 1, 0)
+            return list(itertools.islice(self.events, start, None)), after < oldest - 1
+
+    def wait(self, after, timeout):
+        with self.cond:
+            if after >= self.last_id:
+                self.cond.wait(timeout)
+        return self.since(after)
+
+    def add_listener(self, listener):
+        with self.cond:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.cond:
+            self.listeners.remove(listener)
+
+bus = EventBus()
+event_listeners.append(bus.publish)
+
+def format_bus_events(events, reset, types=None):
+    """SSE text for events read from the bus."""
+    chunks = ['event: reset\ndata: {}\n\n'] if reset else []
+    for event in events:
+        if not types or event['event'] in types:
+            chunks.append(f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n")
+    return ''.join(chunks)
+
+# Webhooks
+class WebhookWorker:
+    """Delivers bus events to one webhook URL in batches.
+
+    Each worker follows the bus with its own cursor on its own thread, so a
+    slow or failing receiver only delays itself. Failed batches are retried
+    with exponential backoff and jitter, then dropped after
+    WEBHOOK_MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, url, secret=WEBHOOK_SECRET):
+        self.url = url
+        self.secret = secret.encode('utf-8')
+        self.after = bus.last_id
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def deliver(self, events):
+        body = json.dumps({'events': events}).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'alpine-pool-webhook'}
+        if self.secret:
+            headers['X-Pool-Signature'] = 'sha256=' + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
         try:
-            claimed_time = datetime.strptime(env['claimed_at'], '%Y-%m-%d %H:%M:%S')
-            if (now - claimed_time) > timedelta(hours=4):
-                available.append({
-                    'url': env['url'],
-                    'username': env['username'],
-                    'password': env['password'],
-                    'python_version': env['python_version'],
-                    'resources': env.get('resources', '2vCPU 4GB RAM'),
-                    'added_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
-                in_use.remove(env)
-                expired_found = True
-                log_event(f"ENV EXPIRED: {env['url']}")
-        except:
+            with urllib.request.urlopen(urllib.request.Request(self.url, data=body, headers=headers),
+                                        timeout=WEBHOOK_TIMEOUT) as response:
+                ok = 200 <= response.status < 300
+        except (OSError, ValueError):
+            ok = False
+        if METRICS_ENABLED:
+            metrics.inc('pool_webhook_deliveries_total', result='ok' if ok else 'error')
+        return ok
+
+    def run(self):
+        while True:
+            try:
+                events, reset = bus.wait(self.after, SSE_HEARTBEAT)
+                if reset:
+                    log_event('WEBHOOK_EVENTS_DROPPED', webhook=self.url, after=self.after)
+                if not events:
+                    continue
+                time.sleep(WEBHOOK_LINGER)
+                events, _ = bus.since(self.after)
+                batch = events[:WEBHOOK_BATCH_SIZE]
+                
+                delay = WEBHOOK_RETRY_BASE
+                for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+                    if self.deliver(batch):
+                        break
+                    if attempt == WEBHOOK_MAX_ATTEMPTS:
+                        log_event('WEBHOOK_FAILED', webhook=self.url, first_id=batch[0]['id'],
+                                  last_id=batch[-1]['id'], attempts=attempt)
+                        break
+                    time.sleep(delay + random.uniform(0, delay / 2))
+                    delay = min(delay * 2, WEBHOOK_RETRY_MAX)
+                self.after = batch[-1]['id']
+            except Exception as e:
+                log_event('WEBHOOK_ERROR', webhook=self.url, error=str(e))
+                time.sleep(WEBHOOK_RETRY_BASE)
+
+webhooks = [WebhookWorker(url) for url in WEBHOOK_URLS]
+
+@timed('pool_cleanup_duration_seconds')
+def cleanup_expired():
+    expired = pool.expire(time.time())
+    for env in expired:
+        log_event('ENV_EXPIRED', url=env['url'], user_id=env['user_id'],
+                  python_version=env['python_version'])
+    if expired:
+        wait_queue.dispatch()
+    return bool(expired)
+
+# Auto-cleanup thread
+def cleanup_worker():
+    # dispatch() also picks up envs freed by other processes
+    steps = (cleanup_expired, reservations.reap, wait_queue.reap, wait_queue.dispatch)
+    while True:
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                # One failing step must not hold up the others or the next tick
+                log_event('CLEANUP_ERROR', step=step.__name__, error=str(e))
+        time.sleep(EXPIRY_TICK)
+
+cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
+
+# Write-behind persistence thread (file backend only)
+def persist_worker():
+    while True:
+        pool.dirty.wait()
+        time.sleep(FLUSH_INTERVAL)  # Coalesce bursts of mutations into one write
+        pool.flush()
+
+persist_thread = threading.Thread(target=persist_worker, daemon=True)
+
+# Journal compaction thread
+def compact_worker():
+    while True:
+        time.sleep(COMPACT_INTERVAL)
+        if pool.journal_records or pool.journal:
+            pool.compact()
+
+compact_thread = threading.Thread(target=compact_worker, daemon=True)
+
+# Pool file watcher
+TIMESTAMP_FORMAT = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$')
+
+def parse_pool_text(text, in_use):
+    """url -> line for the text of a pool file, and the problems found in it."""
+    name = os.path.basename(IN_USE_FILE if in_use else AVAILABLE_FILE)
+    low, high = (5, 8) if in_use else (4, 6)
+    lines, errors = {}, []
+    for number, line in enumerate(text.split('\n'), 1):
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.split(' | ')
+        if not low <= len(parts) <= high or not all(part.strip() for part in parts):
+            errors.append(f'{name}:{number}: expected {low} to {high} non-empty fields')
+            continue
+        timestamps = parts[5:6] + parts[7:8] if in_use else parts[5:6]
+        try:
+            for ts in timestamps:
+                if not TIMESTAMP_FORMAT.match(ts):
+                    raise ValueError(ts)
+                epoch_of(ts)
+        except ValueError:
+            errors.append(f'{name}:{number}: bad timestamp')
             continue
+        if parts[0] in lines:
+            errors.append(f'{name}:{number}: {parts[0]} is listed twice')
+            continue
+        lines[parts[0]] = line
+    return lines, errors
+
+class PoolFileWatcher:
+    """Applies hand edits of the pool files to the live pool.
+
+    The files are polled for a new (inode, size, mtime); the standard
+    library has no inotify. A change is only read once it has held still
+    for a whole interval, and is read in one go and checked again after,
+    so an editor that is still saving is never picked up half way. The new
+    text is validated and diffed against what the server itself last
+    wrote, and the diff goes through PoolStore.apply_edits() under the
+    pool lock. Requests are served from memory throughout and see the
+    whole edit or none of it. Files that fail validation are logged once
+    and then treated as the server's own, so the next save overwrites them
+    with the live pool instead of waiting for another edit.
+    """
+
+    def __init__(self, store, paths=(AVAILABLE_FILE, IN_USE_FILE)):
+        self.store = store
+        self.paths = paths
+        self.pending = None  # Signatures seen on the last poll, waiting to settle
+
+    def start(self):
+        # Files the server has not written yet are taken as they were loaded
+        for path in self.paths:
+            if path not in written_files:
+                signature = file_signature(path)
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    written_files[path] = (signature, f.read())
+
+    def poll(self):
+        signatures = tuple(file_signature(path) for path in self.paths)
+        if None in signatures or signatures == tuple(written_files[path][0] for path in self.paths):
+            self.pending = None
+            return False
+        if signatures != self.pending:
+            self.pending = signatures
+            return False
+        self.pending = None
+        
+        texts = []
+        for path in self.paths:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                texts.append(f.read())
+        if tuple(file_signature(path) for path in self.paths) != signatures:
+            return False  # Changed again while being read
+        return self.apply(signatures, texts)
+
+    def apply(self, signatures, texts):
+        available, errors = parse_pool_text(texts[0], False)
+        in_use, in_use_errors = parse_pool_text(texts[1], True)
+        errors += in_use_errors
+        errors += [f'{url} is listed as both available and in use' for url in available.keys() & in_use.keys()]
+        user_ids = [line.split(' | ')[4] for line in in_use.values()]
+        if len(set(user_ids)) != len(user_ids):
+            errors.append('a user_id is listed for more than one lease')
+        if errors:
+            # Keep diffing against the last good text, but let compaction write over the edit
+            for path, signature in zip(self.paths, signatures):
+                written_files[path] = (signature, written_files[path][1])
+            log_event('RELOAD_REJECTED', errors=errors[:20], error_count=len(errors))
+            return False
+        
+        old_available, _ = parse_pool_text(written_files[self.paths[0]][1], False)
+        old_in_use, _ = parse_pool_text(written_files[self.paths[1]][1], True)
+        remove = [url for url in old_available if url not in available and url not in in_use]
+        add = [available_env(line.split(' | ')) for url, line in available.items()
+               if old_available.get(url) != line]
+        release = [old.split(' | ')[4] for url, old in old_in_use.items() if url not in in_use]
+        renew, ignored = {}, []
+        for url, line in in_use.items():
+            old = old_in_use.get(url)
+            if old == line:
+                continue
+            parts = line.split(' | ')
+            if old is None:
+                ignored.append(('lease', url, 'new_lease'))
+            elif old.split(' | ')[:7] == parts[:7] and len(parts) > 7:
+                renew[parts[4]] = parse_time(parts[7])
+            else:
+                ignored.append(('lease', url, 'lease_edit'))
+        
+        changes, skipped = self.store.apply_edits(remove, add, release, renew)
+        skipped += ignored
+        for path, signature, text in zip(self.paths, signatures, texts):
+            written_files[path] = (signature, text)
+        
+        for op, env, reason in changes:
+            if op == 'add':
+                log_event('ENV_ADDED', url=env['url'], python_version=env['python_version'],
+                          reason='reload', updated=reason == 'updated')
+            elif op == 'remove':
+                log_event('ENV_REMOVED', url=env['url'], python_version=env['python_version'], reason='reload')
+            elif op == 'release':
+                log_event('ENV_RELEASED', url=env['url'], user_id=env['user_id'],
+                          python_version=env['python_version'], reason='reload')
+            else:
+                log_event('LEASE_RENEWED', url=env['url'], user_id=env['user_id'],
+                          expires_at=env['expires_at'], reason='reload')
+        counts = {op: sum(1 for change in changes if change[0] == op)
+                  for op in ('add', 'remove', 'release', 'renew')}
+        log_event('POOL_RELOADED', added=counts['add'], removed=counts['remove'],
+                  released=counts['release'], renewed=counts['renew'], skipped_count=len(skipped),
+                  skipped=[{'op': op, 'key': key, 'reason': reason} for op, key, reason in skipped[:20]])
+        if counts['add'] or counts['release']:
+            wait_queue.dispatch()
+        return True
+
+def reload_worker():
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            pool_watcher.poll()
+        except Exception as e:
+            log_event('RELOAD_ERROR', error=str(e))
+
+pool_watcher = PoolFileWatcher(pool)
+reload_thread = threading.Thread(target=reload_worker, daemon=True)
+
+# Password rotation
+# A rotation hook is called with the url, username, current password,
+# python_version and resources of a released env. It changes the password
+# on the host and returns the new one, or returns None to keep the old one.
+def local_rotate(env):
+    """Rotation hook for trying rotation out locally: a new random password, hosts untouched."""
+    return secrets.token_urlsafe(18)
+
+def load_rotate_hook(spec):
+    """The hook named by POOL_ROTATE_HOOK: 'local' or 'module:function'."""
+    if not spec:
+        return None
+    if spec == 'local':
+        return local_rotate
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+class PasswordRotator:
+    """Gives envs a new password as they come back from a lease.
+
+    With a hook set, the store holds released and expired envs out of the
+    pool. The rotator calls the hook off the request path on a few worker
+    threads and then hands each env back with its new password. A failed
+    rotation keeps the env held and is retried, because handing it out
+    with the old password would let the last lease holder back in. Both
+    backends keep the hold across restarts, and held envs are picked up
+    again at start.
+    """
+
+    def __init__(self, store, hook, workers=ROTATE_WORKERS):
+        self.store = store
+        self.hook = hook
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.queued = set()  # Waiting or being rotated, so no env is rotated twice at once
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        for url in self.store.rotating_urls():
+            self.submit(url)
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, url):
+        with self.lock:
+            if url in self.queued:
+                return
+            self.queued.add(url)
+        self.queue.put(url)
+
+    def observe(self, record):
+        if record['event'] in ('ENV_RELEASED', 'ENV_EXPIRED'):
+            self.submit(record['url'])
+
+    def rotate(self, url):
+        env = self.store.rotating_env(url)
+        if env is None:
+            return  # Never held, or removed since
+        started = time.perf_counter()
+        password = self.hook({
+            'url': url,
+            'username': env['username'],
+            'password': vault.unseal(url, env['password']),
+            'python_version': env['python_version'],
+            'resources': env['resources']
+        })
+        if self.store.rotated(url, password) is not None:
+            log_event('ENV_ROTATED', url=url, changed=password is not None, latency_ms=elapsed_ms(started))
+            wait_queue.dispatch()
+
+    def run(self):
+        while True:
+            url = self.queue.get()
+            try:
+                self.rotate(url)
+                retry = False
+            except Exception as e:
+                log_event('ROTATE_ERROR', url=url, error=str(e))
+                retry = True
+            with self.lock:
+                self.queued.discard(url)
+            if retry:
+                timer = threading.Timer(ROTATE_RETRY_INTERVAL, self.submit, (url,))
+                timer.daemon = True
+                timer.start()
+
+rotator = PasswordRotator(pool, load_rotate_hook(ROTATE_HOOK))
+
+# Health checks
+def probe_address(url):
+    """(scheme, host, port) to probe for url, or None if it has no usable address."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port or {'http': 80, 'https': 443}.get(parts.scheme)
+    except ValueError:
+        return None
+    if not parts.hostname or not port:
+        return None
+    return parts.scheme, parts.hostname, port
+
+def probe_ssl_context():
+    # Probes only check liveness, and env hosts often use self-signed certs
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+class ProbeConnections:
+    """Idle keep-alive connections reused between probes of the same host."""
+
+    def __init__(self, limit=HEALTH_IDLE_CONNECTIONS):
+        self.limit = limit
+        self.idle = OrderedDict()
+        self.ssl_context = probe_ssl_context()
+
+    async def open(self, key):
+        host, port, tls = key
+        return await asyncio.open_connection(host, port, ssl=self.ssl_context if tls else None)
+
+    def take(self, key):
+        conn = self.idle.pop(key, None)
+        if conn is not None and conn[1].is_closing():
+            return None
+        return conn
+
+    def put(self, key, conn):
+        old = self.idle.pop(key, None)
+        if old is not None:
+            old[1].close()
+        self.idle[key] = conn
+        while len(self.idle) > self.limit:
+            _, (_, writer) = self.idle.popitem(last=False)
+            writer.close()
+
+class HealthProber:
+    """Background prober for available envs.
+
+    Runs its own asyncio loop on a thread. http(s) urls get a HEAD request
+    over a pooled keep-alive connection, anything else with a host and port
+    gets a TCP connect. Healthy envs are probed less often the longer they
+    stay healthy; HEALTH_FAILURES failures in a row quarantine an env until
+    it answers again. Probe latency is handed to the store so claims can
+    prefer the fastest hosts. The probe schedule is only touched on the
+    loop's thread; results reach the store through the executor, and the
+    store's own locking keeps them from racing claims.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.state = {}  # url -> {'due', 'interval', 'failures'}
+        self.heap = []
+        self.connections = None
+
+    def schedule(self, url, delay):
+        state = self.state[url]
+        state['due'] = time.monotonic() + delay
+        heapq.heappush(self.heap, (state['due'], url))
+
+    def refresh(self, targets):
+        targets = {url for url in targets if probe_address(url)}
+        for url in list(self.state):
+            if url not in targets:
+                del self.state[url]  # Claimed; its heap entry is skipped when due
+        for url in targets:
+            if url not in self.state:
+                self.state[url] = {'due': 0, 'interval': HEALTH_INTERVAL, 'failures': 0}
+                self.schedule(url, 0)
+
+    async def http_request(self, key, conn, path, host):
+        reader, writer = conn
+        try:
+            writer.write(f'HEAD {path} HTTP/1.1\r\nHost: {host}\r\n'
+                         f'User-Agent: alpine-pool-prober\r\n\r\n'.encode('latin-1'))
+            await writer.drain()
+            version, status = (await reader.readline()).split()[:2]
+            keep_alive = version == b'HTTP/1.1'
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'connection' and b'close' in value.lower():
+                    keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+        
+        if keep_alive:
+            self.connections.put(key, conn)
+        else:
+            writer.close()
+        if int(status) >= 500:
+            raise ValueError(f'HTTP {int(status)}')
+
+    async def probe(self, url):
+        scheme, host, port = probe_address(url)
+        if scheme not in ('http', 'https'):
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        
+        parts = urlsplit(url)
+        key = (host, port, scheme == 'https')
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        host_header = parts.netloc.rpartition('@')[2]
+        conn = self.connections.take(key)
+        if conn is not None:
+            try:
+                return await self.http_request(key, conn, path, host_header)
+            except (OSError, ValueError):
+                pass  # The server dropped the idle connection, retry on a fresh one
+        conn = await self.connections.open(key)
+        await self.http_request(key, conn, path, host_header)
+
+    async def check(self, url):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.probe(url), HEALTH_TIMEOUT)
+            error = None
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        latency_ms = elapsed_ms(started)
+        if METRICS_ENABLED:
+            metrics.observe('pool_probe_duration_seconds', latency_ms / 1000,
+                            result='error' if error else 'ok')
+        
+        state = self.state.get(url)
+        if state is None:
+            return  # Claimed while the probe ran
+        # The probe state is only touched on this loop; the executor only sees the store
+        if error is None:
+            state['failures'] = 0
+            state['interval'] = min(state['interval'] * 2, HEALTH_MAX_INTERVAL)
+        else:
+            state['failures'] += 1
+            state['interval'] = HEALTH_RETRY_INTERVAL
+        await asyncio.get_running_loop().run_in_executor(None, self.apply, url, error, latency_ms,
+                                                         state['failures'])
+        if url in self.state:
+            self.schedule(url, state['interval'])
+
+    def apply(self, url, error, latency_ms, failures):
+        """Hand one probe result to the store; runs on an executor thread."""
+        if error is None:
+            self.store.set_latency(url, latency_ms)
+            if self.store.restore(url):
+                log_event('ENV_RESTORED', url=url, latency_ms=latency_ms)
+                wait_queue.dispatch()
+        elif failures >= HEALTH_FAILURES and self.store.quarantine(url):
+            log_event('ENV_QUARANTINED', url=url, error=error, failures=failures)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.connections = ProbeConnections()
+        tasks = set()
+        next_scan = 0
+        while True:
+            try:
+                now = time.monotonic()
+                if now >= next_scan:
+                    self.refresh(await loop.run_in_executor(None, self.store.probe_targets))
+                    next_scan = now + HEALTH_SCAN_INTERVAL
+                
+                while self.heap and self.heap[0][0] <= now and len(tasks) < HEALTH_CONCURRENCY:
+                    due, url = heapq.heappop(self.heap)
+                    state = self.state.get(url)
+                    if state is None or state['due'] != due:
+                        continue
+                    task = asyncio.ensure_future(self.check(url))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                
+                delay = max(0.01, min(1.0, next_scan - now, (self.heap[0][0] - now) if self.heap else 1.0))
+                if tasks:
+                    await asyncio.wait(set(tasks), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(delay)
+            except Exception as e:
+                log_event('HEALTH_ERROR', error=str(e))
+                await asyncio.sleep(HEALTH_RETRY_INTERVAL)
+
+prober = HealthProber(pool)
+
+def health_worker():
+    asyncio.run(prober.run())
+
+health_thread = threading.Thread(target=health_worker, daemon=True)
+
+# Metrics hooks
+def pool_gauges():
+    available_count, in_use_count = pool.counts()
+    yield 'pool_envs', {'state': 'available'}, available_count
+    yield 'pool_envs', {'state': 'in_use'}, in_use_count
+    yield 'pool_envs', {'state': 'quarantined'}, len(pool.quarantined_urls())
+    yield 'pool_envs', {'state': 'rotating'}, len(pool.rotating_urls())
+    yield 'pool_vault_cache_entries', {}, len(vault.cache)
+    yield 'pool_vault_cache_lookups_total', {'result': 'hit'}, vault.hits
+    yield 'pool_vault_cache_lookups_total', {'result': 'miss'}, vault.misses
+    yield 'pool_waiting_clients', {}, len(wait_queue)
+    for priority_class, depth in wait_queue.depths().items():
+        yield 'pool_queue_depth', {'priority_class': priority_class}, depth
+    for priority_class, leases in wait_queue.lease_counts().items():
+        yield 'pool_class_leases', {'priority_class': priority_class}, leases
+    yield 'pool_pending_reservations', {}, len(reservations)
+    yield 'pool_idempotency_keys', {}, len(idempotency)
+    yield 'pool_inflight_requests', {}, admission.active
+    yield 'pool_rate_limit_buckets', {}, len(limiter)
+    for webhook in webhooks:
+        yield 'pool_webhook_lag_events', {'webhook': webhook.url}, bus.last_id - webhook.after
+    for bucket in forecast.forecast():
+        yield 'pool_pressure', {'python_version': bucket['python_version']}, bucket['pressure']
+    yield 'pool_event_log_dropped_total', {}, event_log.dropped
+    for bucket in pool.bucket_counts():
+        yield 'pool_available_envs', {
+            'python_version': bucket['python_version'],
+            'resources': bucket['resources']
+        }, bucket['available_count']
+
+if METRICS_ENABLED:
+    metrics.add_collector(pool_gauges)
     
-    if expired_found:
-        save_in_use_envs(in_use)
-        save_available_envs(available)
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                            method=request.method, status=str(response.status_code))
+        return response
+
+# Rate limiting
+class RateLimiter:
+    """Token buckets per (client, endpoint), budgets from RATE_LIMITS.
+
+    Buckets live in an LRU table capped at RATE_LIMIT_MAX_CLIENTS. A bucket
+    that has sat idle long enough is full again, so dropping the least
+    recently used ones loses nothing that matters.
+    """
+
+    def __init__(self, limits=RATE_LIMITS, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.limits = limits
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # (client, endpoint) -> [tokens, updated]
+
+    def take(self, client, endpoint, cost=1, multiplier=1):
+        """Spend cost tokens. Returns 0 if allowed, else seconds until it would be."""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return 0
+        rate, burst = limit[0] * multiplier, limit[1] * multiplier
+        if cost > burst:
+            return math.inf
+        now = time.monotonic()
+        with self.lock:
+            key = (client, endpoint)
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self.buckets)
+
+class Admission:
+    """Caps the requests being served at once; the rest are shed."""
+
+    def __init__(self, limit=MAX_CONCURRENT_REQUESTS):
+        self.limit = limit
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+limiter = RateLimiter()
+admission = Admission()
+
+if TRUST_PROXY:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+
+def client_identity(remote_addr, api_key):
+    """Rate limit key and budget multiplier; unknown API keys count as their IP."""
+    if api_key in API_KEYS or api_key in TENANTS:
+        return f'key:{api_key}', API_KEY_RATE_MULTIPLIER
+    return f'ip:{remote_addr}', 1
+
+def rate_limited(endpoint, wait, reason):
+    """429 payload and headers for a shed request."""
+    if METRICS_ENABLED:
+        metrics.inc('pool_rate_limited_total', endpoint=endpoint, reason=reason)
+    if wait == math.inf:
+        return {'success': False, 'error': 'Request is larger than the rate limit allows'}, {}
+    retry_after = max(1, math.ceil(wait))
+    return {
+        'success': False,
+        'error': 'Too many requests' if reason == 'rate' else 'Server is busy',
+        'retry_after': retry_after
+    }, {'Retry-After': str(retry_after)}
+
+if RATE_LIMITING:
+    @app.before_request
+    def limit_request():
+        if request.method == 'OPTIONS' or request.url_rule is None:
+            return None
+        if is_forwarded():
+            return None
+        
+        endpoint = request.url_rule.rule
+        client, multiplier = client_identity(request.remote_addr, request.headers.get('X-API-Key', ''))
+        cost = 1
+        if endpoint == '/api/claim/bulk':
+            try:
+                cost = max(1, int((request.get_json(silent=True) or {}).get('count', 1)))
+            except (AttributeError, TypeError, ValueError):
+                cost = 1
+        wait = limiter.take(client, endpoint, cost, multiplier)
+        if wait:
+            payload, headers = rate_limited(endpoint, wait, 'rate')
+            return jsonify(payload), 429, headers
+        
+        # Long-polls mostly sleep, so they do not count towards admission
+        waiting = endpoint in ('/api/claim/stream', '/api/events') or \
+            (endpoint == '/api/claim' and request.args.get('wait', '0') not in ('', '0'))
+        if endpoint.startswith('/api/') and not waiting:
+            if not admission.enter():
+                payload, headers = rate_limited(endpoint, 1, 'concurrency')
+                return jsonify(payload), 429, headers
+            g.admitted = True
+        return None
+    
+    @app.teardown_request
+    def leave_admission(exc):
+        if g.pop('admitted', False):
+            admission.leave()
+
+# Request helpers
+def parse_env(data):
+    """Build a new pool env from request data, or return None if incomplete."""
+    if not isinstance(data, dict):
+        return None
+    
+    url = str(data.get('url', '')).strip()
+    username = str(data.get('username', '')).strip()
+    password = str(data.get('password', '')).strip()
+    python_version = str(data.get('python_version', '3.11')).strip()
+    resources = str(data.get('resources', '2vCPU 4GB RAM')).strip()
+    
+    if not all([url, username, password]):
+        return None
+    
+    return Env(url, username, password, python_version, resources, int(time.time()))
+
+def parse_bulk_items():
+    """Read a batch from a JSON array or an NDJSON body."""
+    if 'ndjson' in (request.content_type or ''):
+        items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get('items')
+    
+    if not isinstance(items, list):
+        raise ValueError('Expected a JSON array or NDJSON body')
+    if len(items) > MAX_BULK_ITEMS:
+        raise ValueError(f'At most {MAX_BULK_ITEMS} items per batch')
+    return items
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 3)
+
+def request_tenant():
+    return tenant_of(request.remote_addr, request.headers.get('X-API-Key', ''), is_forwarded())
+
+def lease_limited(tenant, count=1):
+    """429 payload if tenant's lease cap leaves no room for count more, else None."""
+    room = wait_queue.lease_room(tenant)
+    if room >= count:
+        return None
+    return {
+        'success': False,
+        'error': 'Lease limit reached',
+        'max_leases': tenant.max_leases,
+        'active_leases': tenant.max_leases - room,
+        'message': 'Release an environment before claiming another'
+    }
+
+def claimed_env_json(env):
+    return {
+        'url': env['url'],
+        'username': env['username'],
+        'password': vault.unseal(env['url'], env['password']),
+        'python_version': env['python_version'],
+        'resources': env['resources'],
+        'user_id': env['user_id'],
+        'claimed_at': env['claimed_at'],
+        'expires_at': env['expires_at']
+    }
+
+# Idempotency
+class IdempotencyCache:
+    """Responses kept per client and Idempotency-Key so a retried request replays them.
+
+    Only successful responses are kept; a failed request left nothing
+    behind, so its retry runs again. A retry that arrives while the first
+    request is still running waits for it instead of running twice.
+    Claimed envs are kept without their password, which a replay reads
+    back from the lease (see claimed_envs).
+    """
+
+    MISMATCH = object()
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> [expires, fingerprint, event, (status, body, leased)]
+
+    def evict(self, now):
+        drop = []
+        for key, entry in self.entries.items():
+            if entry[0] > now and len(self.entries) - len(drop) <= self.max_keys:
+                break
+            if entry[3] is not None:  # Requests still running are passed over, not waited for
+                drop.append(key)
+        for key in drop:
+            del self.entries[key]
+
+    def begin(self, key, fingerprint):
+        """Return the (status, body, leased) to replay, MISMATCH, or None once the caller owns key."""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.evict(now)
+                entry = self.entries.get(key)
+                if entry is None:
+                    self.entries[key] = [now + self.ttl, fingerprint, threading.Event(), None]
+                    return None
+                if entry[1] != fingerprint:
+                    return self.MISMATCH
+                if entry[3] is not None:
+                    return entry[3]
+                event = entry[2]
+            event.wait(MAX_WAIT_SECONDS + WAIT_GRACE)
+
+    def finish(self, key, status=None, body=None, leased=False):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            if status is not None and 200 <= status < 300:
+                entry[0] = time.time() + self.ttl
+                entry[3] = (status, body, leased)
+                self.entries.move_to_end(key)
+            else:
+                del self.entries[key]
+            entry[2].set()
+
+    def __len__(self):
+        return len(self.entries)
+
+idempotency = IdempotencyCache()
+
+def claimed_envs(payload):
+    """The claimed envs in a response payload, as built by claimed_env_json."""
+    if not isinstance(payload, dict):
+        return []
+    envs = [payload.get('env')] + list(payload.get('envs') or [])
+    return [env for env in envs if isinstance(env, dict) and 'user_id' in env and 'url' in env]
+
+def replay_body(response):
+    """Body to keep for replays and whether passwords were taken out of it."""
+    payload = response.get_json(silent=True)
+    leased = False
+    for env in claimed_envs(payload):
+        leased = env.pop('password', None) is not None or leased
+    if not leased:
+        return response.get_data(), False
+    return json.dumps(payload).encode('utf-8'), True
+
+def refill_passwords(body):
+    """Put each env's password back from its lease; None if one is no longer held here."""
+    payload = json.loads(body)
+    for env in claimed_envs(payload):
+        lease = pool.lease(env['user_id'])
+        if lease is None or lease['url'] != env['url']:
+            return None  # Released, expired, or a claim taken from another shard
+        env['password'] = vault.unseal(lease['url'], lease['password'])
+    return json.dumps(payload).encode('utf-8')
+
+def idempotent(fn):
+    """Replay the first successful response for a repeated Idempotency-Key header."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return fn(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({
+                'success': False,
+                'error': 'Idempotency-Key is too long'
+            }), 400
+        
+        # Scoped to the caller, so nobody can replay another client's claim
+        identity = client_identity(request.remote_addr, request.headers.get('X-API-Key', ''))[0]
+        cache_key = (identity, request.path, key)
+        fingerprint = (request.query_string, request.get_data())
+        cached = idempotency.begin(cache_key, fingerprint)
+        if cached is IdempotencyCache.MISMATCH:
+            return jsonify({
+                'success': False,
+                'error': 'Idempotency-Key was already used with different parameters'
+            }), 422
+        if cached is not None:
+            status, body, leased = cached
+            if leased:
+                body = refill_passwords(body)
+                if body is None:
+                    return jsonify({
+                        'success': False,
+                        'error': 'The lease claimed with this Idempotency-Key is no longer held'
+                    }), 409
+            return Response(body, status=status, mimetype='application/json',
+                            headers={'Idempotent-Replayed': 'true'})
+        
+        try:
+            response = app.make_response(fn(*args, **kwargs))
+        except BaseException:
+            idempotency.finish(cache_key)
+            raise
+        if response.is_streamed:
+            idempotency.finish(cache_key)
+        else:
+            idempotency.finish(cache_key, response.status_code, *replay_body(response))
+        return response
+    return wrapper
+
+# Shard forwarding
+FORWARDED_HEADER = 'X-Pool-Forwarded'  # Set on node-to-node calls so they are served locally
+
+peer_capacity = {}  # Last available count each peer reported
+peer_capacity_lock = threading.Lock()
+
+def is_forwarded():
+    # Only peers may ask to be served locally; anyone else is routed as usual
+    return peer_forwarded(request.remote_addr, request.headers.get(FORWARDED_HEADER))
+
+def is_remote(node):
+    """True if this request should be handed to node instead of served here."""
+    return ring is not None and node != POOL_NODE and not is_forwarded()
+
+def forward(node, method, path, body=None):
+    """Call another node's API. Returns (status, payload), or (None, None) if it is unreachable."""
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(node + path, data=data, method=method, headers={
+        'Content-Type': 'application/json',
+        FORWARDED_HEADER: POOL_NODE
+    })
+    try:
+        with urllib.request.urlopen(req, timeout=SHARD_TIMEOUT) as response:
+            status, payload = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, payload = e.code, e.read()
+    except (OSError, ValueError) as e:
+        log_event('SHARD_ERROR', node=node, path=path, error=str(e))
+        with peer_capacity_lock:
+            peer_capacity[node] = 0
+        return None, None
     
-    return expired_found
+    if METRICS_ENABLED:
+        metrics.inc('pool_shard_forwards_total', path=path.split('?')[0], status=str(status))
+    try:
+        payload = json.loads(payload)
+    except ValueError:
+        payload = {}
+    for key in ('remaining', 'available_count'):
+        if isinstance(payload.get(key), int):
+            with peer_capacity_lock:
+                peer_capacity[node] = payload[key]
+    return status, payload
 
-# Auto-cleanup thread
-def cleanup_worker():
-    while True:
-        try:
-            cleanup_expired()
-            time.sleep(300)  # Check every 5 minutes
-        except:
-            time.sleep(60)
+def steal_order():
+    """Peers to steal from, fullest first by their last reported count."""
+    with peer_capacity_lock:
+        capacity = dict(peer_capacity)
+    return sorted(PEERS, key=lambda node: -capacity.get(node, float('inf')))
 
-cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-cleanup_thread.start()
+def steal_claim(python_version, resources):
+    query = urlencode({key: value for key, value in
+                       (('python_version', python_version), ('resources', resources)) if value})
+    for node in steal_order():
+        status, payload = forward(node, 'GET', '/api/claim?' + query)
+        if status == 200 and payload.get('success'):
+            log_event('SHARD_STEAL', node=node, url=payload['env']['url'], user_id=payload['env']['user_id'])
+            return payload
+    return None
+
+def shard_unavailable(node):
+    return jsonify({
+        'success': False,
+        'error': f'Pool node {node} is unavailable'
+    }), 503
 
 # API Routes
 @app.route('/api/add', methods=['POST'])
 def add_env():
+    started = time.perf_counter()
     try:
         if request.is_json:
             data = request.get_json()
         else:
             data = request.form
         
-        url = data.get('url', '').strip()
-        username = data.get('username', '').strip()
-        password = data.get('password', '').strip()
-        python_version = data.get('python_version', '3.11').strip()
-        resources = data.get('resources', '2vCPU 4GB RAM').strip()
+        new_env = parse_env(data)
         
-        if not all([url, username, password]):
+        if new_env is None:
             return jsonify({
                 'success': False,
                 'error': 'Missing url, username, or password'
             }), 400
         
-        cleanup_expired()
-        available = get_available_envs()
-        
-        # Check if URL already exists
-        for env in available:
-            if env['url'] == url:
-                return jsonify({
-                    'success': False,
-                    'error': 'Environment with this URL already exists'
-                }), 409
-        
-        new_env = {
-            'url': url,
-            'username': username,
-            'password': password,
-            'python_version': python_version,
-            'resources': resources,
-            'added_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
+        url = new_env['url']
+        python_version = new_env['python_version']
         
-        available.append(new_env)
+        owner = owner_of(url)
+        if is_remote(owner):
+            status, payload = forward(owner, 'POST', '/api/add', new_env.to_dict())
+            if status is None:
+                return shard_unavailable(owner)
+            return jsonify(payload), status
         
-        if save_available_envs(available):
-            log_event(f"ENV ADDED: {url} - Python {python_version}")
-            return jsonify({
-                'success': True,
-                'message': 'Python environment added to pool',
-                'env': new_env,
-                'total_available': len(available)
-            })
-        else:
+        if not pool.add(new_env):
             return jsonify({
                 'success': False,
-                'error': 'Failed to save environment'
-            }), 500
+                'error': 'Environment with this URL already exists'
+            }), 409
+        
+        log_event('ENV_ADDED', url=url, python_version=python_version,
+                  latency_ms=elapsed_ms(started))
+        wait_queue.dispatch()
+        return jsonify({
+            'success': True,
+            'message': 'Python environment added to pool',
+            'env': {key: value for key, value in new_env.to_dict().items() if key != 'password'},
+            'total_available': pool.counts()[0]
+        })
             
     except Exception as e:
-        log_event(f"ADD ERROR: {str(e)}")
+        log_event('ADD_ERROR', error=str(e))
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
 @app.route('/api/claim', methods=['GET'])
+@idempotent
 def claim_env():
+    started = time.perf_counter()
+    try:
+        python_version = request.args.get('python_version', '').strip() or None
+        resources = request.args.get('resources', '').strip() or None
+        try:
+            wait = min(float(request.args.get('wait', 0)), MAX_WAIT_SECONDS)
+        except ValueError:
+            wait = 0
+        
+        tenant = request_tenant()
+        limited = lease_limited(tenant)
+        if limited:
+            return jsonify(limited), 429
+        
+        if wait > 0:
+            if ring and not is_forwarded() and not request.args.get('ticket') \
+                    and not pool.available_count(python_version, resources):
+                # Nothing here: take one from another shard before queueing
+                payload = steal_claim(python_version, resources)
+                if payload:
+                    return jsonify(payload)
+            
+            # Long-poll: join (or rejoin with ticket) the wait queue
+            env, waiter = wait_queue.wait(python_version, resources, wait,
+                                          request.args.get('ticket', '').strip() or None, tenant)
+            if env is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'No Python environments available',
+                    'available_count': 0,
+                    'message': 'Waiting in queue for a Python environment',
+                    'ticket': waiter.ticket,
+                    'priority_class': tenant.priority_class,
+                    'queue_position': wait_queue.position(waiter)
+                }), 404
+        else:
+            env = wait_queue.claim(generate_user_id(), python_version, resources, tenant)
+            
+            if env is None and ring and not is_forwarded():
+                payload = steal_claim(python_version, resources)
+                if payload:
+                    return jsonify(payload)
+            
+            if env is None:
+                if METRICS_ENABLED:
+                    metrics.inc('pool_empty_rejections_total')
+                log_event('CLAIM_REJECTED', python_version=python_version, resources=resources)
+                return jsonify({
+                    'success': False,
+                    'error': 'No Python environments available',
+                    'available_count': 0,
+                    'message': 'All environments are currently in use'
+                }), 404
+            
+            log_event('ENV_CLAIMED', url=env['url'], user_id=env['user_id'],
+                      python_version=env['python_version'], priority_class=tenant.priority_class,
+                      latency_ms=elapsed_ms(started))
+        
+        return jsonify({
+            'success': True,
+            'env': claimed_env_json(env),
+            'remaining': pool.counts()[0],
+            'message': 'Python environment claimed successfully!'
+        })
+            
+    except Exception as e:
+        log_event('CLAIM_ERROR', error=str(e))
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/claim/stream', methods=['GET'])
+def claim_env_stream():
+    python_version = request.args.get('python_version', '').strip() or None
+    resources = request.args.get('resources', '').strip() or None
+    # EventSource sends the last event id back when it reconnects
+    ticket = request.headers.get('Last-Event-ID', '').strip() or None
+    tenant = request_tenant()
+    limited = lease_limited(tenant)
+    if limited:
+        return jsonify(limited), 429
+    
+    def stream():
+        waiter = None
+        env = None
+        delivered = False
+        try:
+            while True:
+                env, waiter = wait_queue.wait(python_version, resources, SSE_HEARTBEAT,
+                                              waiter.ticket if waiter else ticket, tenant)
+                if env is not None:
+                    yield f"event: claimed\ndata: {json.dumps(claimed_env_json(env))}\n\n"
+                    delivered = True  # Resumed only once the server has written the event
+                    return
+                yield (f"id: {waiter.ticket}\nevent: waiting\n"
+                       f"data: {json.dumps({'queue_position': wait_queue.position(waiter)})}\n\n")
+        finally:
+            if env is not None and not delivered:
+                wait_queue.give_back(env, 'client_left')
+            elif waiter is not None and env is None:
+                wait_queue.cancel(waiter.ticket)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/reserve', methods=['GET'])
+@idempotent
+def reserve_env():
     try:
-        cleanup_expired()
-        available = get_available_envs()
+        python_version = request.args.get('python_version', '').strip() or None
+        resources = request.args.get('resources', '').strip() or None
+        try:
+            ttl = min(max(float(request.args.get('ttl', RESERVATION_SECONDS)), 1), RESERVATION_MAX_SECONDS)
+        except ValueError:
+            ttl = RESERVATION_SECONDS
+        
+        tenant = request_tenant()
+        limited = lease_limited(tenant)
+        if limited:
+            return jsonify(limited), 429
         
-        if not available:
+        reservation_id, env = reservations.reserve(python_version, resources, ttl, tenant)
+        
+        if env is None:
+            if METRICS_ENABLED:
+                metrics.inc('pool_empty_rejections_total', reserve='true')
+            log_event('CLAIM_REJECTED', python_version=python_version, resources=resources, reserve=True)
             return jsonify({
                 'success': False,
                 'error': 'No Python environments available',
@@ -249,47 +3513,140 @@ def claim_env():
                 'message': 'All environments are currently in use'
             }), 404
         
-        env = available.pop(0)
-        user_id = generate_user_id()
+        log_event('ENV_RESERVED', url=env['url'], reservation_id=reservation_id,
+                  python_version=env['python_version'], ttl=ttl)
+        return jsonify({
+            'success': True,
+            'reservation_id': reservation_id,
+            'python_version': env['python_version'],
+            'resources': env['resources'],
+            'expires_in': ttl,
+            'message': 'Environment reserved, confirm it to get the credentials'
+        })
+            
+    except Exception as e:
+        log_event('RESERVE_ERROR', error=str(e))
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/confirm', methods=['GET'])
+@idempotent
+def confirm_env():
+    try:
+        reservation_id = request.args.get('reservation_id', '').strip()
+        
+        if not reservation_id:
+            return jsonify({
+                'success': False,
+                'error': 'Missing reservation_id parameter'
+            }), 400
+        
+        node = shard_of(reservation_id)
+        if is_remote(node):
+            status, payload = forward(node, 'GET', '/api/confirm?' + urlencode({'reservation_id': reservation_id}))
+            if status is None:
+                return shard_unavailable(node)
+            return jsonify(payload), status
+        
+        env = reservations.confirm(reservation_id)
         
-        in_use = get_in_use_envs()
-        env['user_id'] = user_id
-        env['claimed_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        in_use.append(env)
+        if env is None:
+            return jsonify({
+                'success': False,
+                'error': 'Reservation not found or expired'
+            }), 404
         
-        if save_available_envs(available) and save_in_use_envs(in_use):
-            log_event(f"ENV CLAIMED: {env['url']} by {user_id}")
+        log_event('RESERVATION_CONFIRMED', url=env['url'], user_id=env['user_id'],
+                  reservation_id=reservation_id)
+        return jsonify({
+            'success': True,
+            'env': claimed_env_json(env),
+            'message': 'Python environment claimed successfully!'
+        })
             
+    except Exception as e:
+        log_event('CONFIRM_ERROR', error=str(e))
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    types = {name.strip() for name in request.args.get('types', '').split(',') if name.strip()}
+    # Resume after the last event id the client saw; new subscribers start now
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', bus.last_id))
+    except ValueError:
+        after = bus.last_id
+    
+    def stream():
+        position = after
+        while True:
+            events, reset = bus.wait(position, SSE_HEARTBEAT)
+            if events:
+                position = events[-1]['id']
+            chunk = format_bus_events(events, reset, types)
+            yield chunk or ': heartbeat\n\n'
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/release', methods=['GET'])
+@idempotent
+def release_env():
+    started = time.perf_counter()
+    try:
+        user_id = request.args.get('user_id', '').strip()
+        
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'error': 'Missing user_id parameter'
+            }), 400
+        
+        node = shard_of(user_id)
+        if is_remote(node):
+            status, payload = forward(node, 'GET', '/api/release?' + urlencode({'user_id': user_id}))
+            if status is None:
+                return shard_unavailable(node)
+            return jsonify(payload), status
+        
+        released_env = pool.release(user_id)
+        
+        if released_env:
+            log_event('ENV_RELEASED', url=released_env['url'], user_id=user_id,
+                      python_version=released_env['python_version'], latency_ms=elapsed_ms(started))
+            wait_queue.dispatch()
             return jsonify({
                 'success': True,
-                'env': {
-                    'url': env['url'],
-                    'username': env['username'],
-                    'password': env['password'],
-                    'python_version': env['python_version'],
-                    'resources': env['resources'],
-                    'user_id': user_id,
-                    'claimed_at': env['claimed_at'],
-                    'expires_at': (datetime.now() + timedelta(hours=4)).strftime('%Y-%m-%d %H:%M:%S')
+                'message': 'Environment released back to pool',
+                'released_env': {
+                    'url': released_env['url'],
+                    'python_version': released_env['python_version']
                 },
-                'remaining': len(available),
-                'message': 'Python environment claimed successfully!'
+                'available_count': pool.counts()[0]
             })
         else:
             return jsonify({
                 'success': False,
-                'error': 'Failed to claim environment'
-            }), 500
+                'error': 'Environment not found or already released'
+            }), 404
             
     except Exception as e:
-        log_event(f"CLAIM ERROR: {str(e)}")
+        log_event('RELEASE_ERROR', error=str(e))
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
-@app.route('/api/release', methods=['GET'])
-def release_env():
+@app.route('/api/renew', methods=['GET'])
+@idempotent
+def renew_env():
     try:
         user_id = request.args.get('user_id', '').strip()
         
@@ -299,80 +3656,398 @@ def release_env():
                 'error': 'Missing user_id parameter'
             }), 400
         
-        in_use = get_in_use_envs()
-        available = get_available_envs()
-        released_env = None
+        try:
+            seconds = int(request.args.get('seconds', int(LEASE_DURATION.total_seconds())))
+        except ValueError:
+            seconds = 0
+        if not 1 <= seconds <= MAX_LEASE_DURATION.total_seconds():
+            return jsonify({
+                'success': False,
+                'error': f'seconds must be between 1 and {int(MAX_LEASE_DURATION.total_seconds())}'
+            }), 400
         
-        for env in in_use[:]:
-            if env['user_id'] == user_id:
-                released_env = env
-                in_use.remove(env)
-                
-                available.append({
-                    'url': env['url'],
-                    'username': env['username'],
-                    'password': env['password'],
-                    'python_version': env['python_version'],
-                    'resources': env['resources'],
-                    'added_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
-                break
+        node = shard_of(user_id)
+        if is_remote(node):
+            status, payload = forward(node, 'GET', '/api/renew?' + urlencode({'user_id': user_id, 'seconds': seconds}))
+            if status is None:
+                return shard_unavailable(node)
+            return jsonify(payload), status
         
-        if released_env:
-            if save_in_use_envs(in_use) and save_available_envs(available):
-                log_event(f"ENV RELEASED: {released_env['url']} by {user_id}")
-                return jsonify({
-                    'success': True,
-                    'message': 'Environment released back to pool',
-                    'released_env': {
-                        'url': released_env['url'],
-                        'python_version': released_env['python_version']
-                    },
-                    'available_count': len(available)
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': 'Failed to save pool data'
-                }), 500
-        else:
+        env = pool.renew(user_id, seconds)
+        
+        if env is None:
             return jsonify({
                 'success': False,
                 'error': 'Environment not found or already released'
             }), 404
+        
+        log_event('LEASE_RENEWED', url=env['url'], user_id=user_id, expires_at=env['expires_at'])
+        return jsonify({
+            'success': True,
+            'message': 'Lease renewed',
+            'user_id': user_id,
+            'expires_at': env['expires_at']
+        })
+            
+    except Exception as e:
+        log_event('RENEW_ERROR', error=str(e))
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/add/bulk', methods=['POST'])
+def add_env_bulk():
+    try:
+        try:
+            items = parse_bulk_items()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        envs = [parse_env(item) for item in items]
+        results = [None] * len(envs)
+        local = []
+        remote = {}
+        for index, env in enumerate(envs):
+            if env is None:
+                results[index] = {'index': index, 'success': False, 'error': 'Missing url, username, or password'}
+            elif is_remote(owner_of(env['url'])):
+                remote.setdefault(owner_of(env['url']), []).append(index)
+            else:
+                local.append(index)
+        
+        added = pool.add_many([envs[index] for index in local])
+        pool.flush()
+        for index, ok in zip(local, added):
+            env = envs[index]
+            if ok:
+                log_event('ENV_ADDED', url=env['url'], python_version=env['python_version'], bulk=True)
+                results[index] = {'index': index, 'url': env['url'], 'success': True}
+            else:
+                results[index] = {'index': index, 'url': env['url'], 'success': False,
+                                  'error': 'Environment with this URL already exists'}
+        
+        for node, indexes in remote.items():
+            status, payload = forward(node, 'POST', '/api/add/bulk', [envs[index].to_dict() for index in indexes])
+            node_results = payload.get('results', []) if status == 200 else []
+            for position, index in enumerate(indexes):
+                if position < len(node_results):
+                    results[index] = dict(node_results[position], index=index)
+                else:
+                    results[index] = {'index': index, 'url': envs[index]['url'], 'success': False,
+                                      'error': f'Pool node {node} is unavailable'}
+        
+        added_count = sum(1 for result in results if result['success'])
+        if local and added_count:
+            wait_queue.dispatch()
+        return jsonify({
+            'success': True,
+            'added': added_count,
+            'rejected': len(results) - added_count,
+            'results': results,
+            'total_available': pool.counts()[0]
+        })
+            
+    except Exception as e:
+        log_event('ADD_ERROR', error=str(e), bulk=True)
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/claim/bulk', methods=['POST'])
+@idempotent
+def claim_env_bulk():
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            count = int(data.get('count', 1))
+        except (TypeError, ValueError):
+            count = 0
+        
+        if not 1 <= count <= MAX_BULK_ITEMS:
+            return jsonify({
+                'success': False,
+                'error': f'count must be between 1 and {MAX_BULK_ITEMS}'
+            }), 400
+        
+        python_version = str(data.get('python_version') or '').strip() or None
+        resources = str(data.get('resources') or '').strip() or None
+        partial = bool(data.get('partial', False))
+        
+        tenant = request_tenant()
+        limited = lease_limited(tenant, 1 if partial else count)
+        if limited:
+            return jsonify(limited), 429
+        
+        sharded = ring is not None and not is_forwarded()
+        envs = wait_queue.claim_many([generate_user_id() for _ in range(count)],
+                                     python_version, resources, partial or sharded, tenant)
+        pool.flush()
+        
+        stolen = []
+        if sharded and len(envs) < count:
+            # Top up from other shards, then give everything back if the
+            # caller wanted all or nothing and the cluster came up short
+            for node in steal_order():
+                status, payload = forward(node, 'POST', '/api/claim/bulk', {
+                    'count': count - len(envs) - len(stolen),
+                    'python_version': python_version,
+                    'resources': resources,
+                    'partial': True
+                })
+                if status == 200:
+                    stolen.extend(payload.get('envs', []))
+                if len(envs) + len(stolen) >= count:
+                    break
+            
+            if not partial and len(envs) + len(stolen) < count:
+                pool.release_many([env['user_id'] for env in envs], rotate=False)
+                pool.flush()
+                for env in envs:
+                    wait_queue.forget(env['user_id'])
+                if envs:
+                    wait_queue.dispatch()
+                by_node = {}
+                for env in stolen:
+                    by_node.setdefault(shard_of(env['user_id']), []).append(env['user_id'])
+                for node, user_ids in by_node.items():
+                    forward(node, 'POST', '/api/release/bulk', user_ids)
+                envs = []
+                stolen = []
+        
+        if not envs and not stolen:
+            if METRICS_ENABLED:
+                metrics.inc('pool_empty_rejections_total', bulk='true')
+            log_event('CLAIM_REJECTED', python_version=python_version, resources=resources,
+                      count=count, bulk=True)
+            return jsonify({
+                'success': False,
+                'error': 'Not enough Python environments available',
+                'requested': count,
+                'available_count': pool.available_count(python_version, resources)
+            }), 404
+        
+        for env in envs:
+            log_event('ENV_CLAIMED', url=env['url'], user_id=env['user_id'],
+                      python_version=env['python_version'], priority_class=tenant.priority_class,
+                      bulk=True)
+        
+        return jsonify({
+            'success': True,
+            'requested': count,
+            'claimed': len(envs) + len(stolen),
+            'envs': [claimed_env_json(env) for env in envs] + stolen,
+            'remaining': pool.counts()[0]
+        })
+            
+    except Exception as e:
+        log_event('CLAIM_ERROR', error=str(e), bulk=True)
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/release/bulk', methods=['POST'])
+@idempotent
+def release_env_bulk():
+    try:
+        try:
+            items = parse_bulk_items()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        user_ids = [str(item.get('user_id', '') if isinstance(item, dict) else item).strip()
+                    for item in items]
+        results = [None] * len(user_ids)
+        local = []
+        remote = {}
+        for index, user_id in enumerate(user_ids):
+            if not user_id:
+                results[index] = {'index': index, 'success': False, 'error': 'Missing user_id'}
+            elif is_remote(shard_of(user_id)):
+                remote.setdefault(shard_of(user_id), []).append(index)
+            else:
+                local.append(index)
+        
+        released = pool.release_many([user_ids[index] for index in local])
+        pool.flush()
+        for index, env in zip(local, released):
+            user_id = user_ids[index]
+            if env:
+                log_event('ENV_RELEASED', url=env['url'], user_id=user_id,
+                          python_version=env['python_version'], bulk=True)
+                results[index] = {'index': index, 'user_id': user_id, 'url': env['url'], 'success': True}
+            else:
+                results[index] = {'index': index, 'user_id': user_id, 'success': False,
+                                  'error': 'Environment not found or already released'}
+        
+        for node, indexes in remote.items():
+            status, payload = forward(node, 'POST', '/api/release/bulk', [user_ids[index] for index in indexes])
+            node_results = payload.get('results', []) if status == 200 else []
+            for position, index in enumerate(indexes):
+                if position < len(node_results):
+                    results[index] = dict(node_results[position], index=index)
+                else:
+                    results[index] = {'index': index, 'user_id': user_ids[index], 'success': False,
+                                      'error': f'Pool node {node} is unavailable'}
+        
+        released_count = sum(1 for result in results if result['success'])
+        if local and released_count:
+            wait_queue.dispatch()
+        return jsonify({
+            'success': True,
+            'released': released_count,
+            'rejected': len(results) - released_count,
+            'results': results,
+            'available_count': pool.counts()[0]
+        })
             
     except Exception as e:
-        log_event(f"RELEASE ERROR: {str(e)}")
+        log_event('RELEASE_ERROR', error=str(e), bulk=True)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
+def build_status(summary, waiting_count, depths):
+    quarantined = pool.quarantined_urls()
+    rotating = pool.rotating_urls()
+    if summary:
+        available_count, in_use_count = pool.counts()
+    else:
+        available, in_use = pool.snapshot()
+        held = set(quarantined).union(rotating)
+        available = [env for env in available if env['url'] not in held]
+        available_count, in_use_count = len(available), len(in_use)
+    
+    pool_status = {
+        'available_count': available_count,
+        'in_use_count': in_use_count,
+        'quarantined_count': len(quarantined),
+        'rotating_count': len(rotating),
+        'total_count': available_count + in_use_count + len(quarantined) + len(rotating),
+        'available_by_bucket': pool.bucket_counts(),
+        'waiting_count': waiting_count,
+        'waiting_by_class': depths,
+        'generation': status_cache.generation,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    if ring:
+        pool_status['node'] = POOL_NODE
+    if not summary:
+        pool_status['available_urls'] = [env['url'] for env in available]
+        pool_status['in_use_urls'] = [env['url'] for env in in_use]
+        pool_status['quarantined_urls'] = quarantined
+        pool_status['rotating_urls'] = rotating
+    return app.json.dumps({'success': True, 'pool_status': pool_status})
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     try:
-        cleanup_expired()
-        available = get_available_envs()
-        in_use = get_in_use_envs()
+        since = request.args.get('since', '').strip()
+        list_name = request.args.get('list', '').strip()
+        
+        if since:
+            # Delta feed: only the changes after the client's generation
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'since must be a generation number'
+                }), 400
+            changes = pool.changes_since(since)
+            return jsonify({
+                'success': True,
+                'generation': pool.generation(),
+                'reset': changes is None,
+                'changes': [{'generation': generation, 'op': op, 'url': url}
+                            for generation, op, url in changes or []]
+            })
+        
+        if list_name:
+            # Cursor pagination over one URL list, sorted by url
+            if list_name not in ('available', 'in_use', 'quarantined'):
+                return jsonify({
+                    'success': False,
+                    'error': 'list must be available, in_use or quarantined'
+                }), 400
+            try:
+                limit = min(int(request.args.get('limit', STATUS_PAGE_SIZE)), STATUS_PAGE_SIZE * 10)
+            except ValueError:
+                limit = STATUS_PAGE_SIZE
+            cursor = request.args.get('cursor', '')
+            generation, urls = status_cache.sorted_urls(list_name)
+            start = bisect.bisect_right(urls, cursor) if cursor else 0
+            page = urls[start:start + max(limit, 1)]
+            return jsonify({
+                'success': True,
+                'generation': generation,
+                'list': list_name,
+                'urls': page,
+                'next_cursor': page[-1] if start + len(page) < len(urls) else None
+            })
+        
+        summary = request.args.get('summary', '').lower() in ('1', 'true', 'yes')
+        variant = 'summary' if summary else 'full'
+        waiting_count = len(wait_queue)
+        depths = wait_queue.depths()
+        queue_key = '-'.join(str(depth) for depth in depths.values())
+        generation, body = status_cache.body((variant, waiting_count, queue_key),
+                                             lambda: build_status(summary, waiting_count, depths))
+        
+        etag = f'{BOOT_ID}-{generation}-{waiting_count}-{queue_key}-{variant}'
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+        if etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype='application/json', headers=headers)
+    except Exception as e:
+        log_event('STATUS_ERROR', error=str(e))
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/forecast', methods=['GET'])
+def get_forecast():
+    try:
+        try:
+            horizon = max(float(request.args.get('horizon', FORECAST_HORIZON)), 1)
+        except ValueError:
+            horizon = FORECAST_HORIZON
         
         return jsonify({
             'success': True,
-            'pool_status': {
-                'available_count': len(available),
-                'in_use_count': len(in_use),
-                'total_count': len(available) + len(in_use),
-                'available_urls': [env['url'] for env in available],
-                'in_use_urls': [env['url'] for env in in_use],
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+            'horizon_seconds': horizon,
+            'buckets': forecast.forecast(horizon),
+            'pending_reservations': len(reservations),
+            'waiting_count': len(wait_queue),
+            'waiting_by_class': wait_queue.depths(),
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         })
     except Exception as e:
-        log_event(f"STATUS ERROR: {str(e)}")
+        log_event('FORECAST_ERROR', error=str(e))
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({
+            'success': False,
+            'error': 'Metrics are disabled'
+        }), 404
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/test', methods=['GET'])
 def test_api():
     return jsonify({
@@ -382,12 +4057,154 @@ def test_api():
         'version': '1.0'
     })
 
-# Frontend Route
+# Frontend
+def etag_matches(if_none_match, etags):
+    """True if an If-None-Match header names one of etags (weak comparison)."""
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) in etags:
+            return True
+    return False
+
+def pick_encoding(accept_encoding, available):
+    """Best content coding in available for an Accept-Encoding header."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for coding in ('br', 'gzip'):
+        if coding in available and accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return 'identity'
+
+class StaticAsset:
+    """A response body held in memory with precompressed variants.
+
+    Each variant gets its own strong ETag derived from the content, so a
+    revalidation against any of them answers 304 without touching the body.
+    """
+
+    def __init__(self, body, content_type, cache_control):
+        body = body.encode('utf-8')
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.variants = {'identity': body}
+        self.variants['gzip'] = gzip.compress(body, 9, mtime=0)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+        self.variants = {coding: data for coding, data in self.variants.items()
+                         if coding == 'identity' or len(data) < len(body)}
+        self.etags = {coding: f'"{self.digest[:32]}"' if coding == 'identity' else f'"{self.digest[:32]}-{coding}"'
+                      for coding in self.variants}
+
+    def respond(self, if_none_match='', accept_encoding=''):
+        """Status, headers and body for a GET carrying these request headers."""
+        coding = pick_encoding(accept_encoding, self.variants)
+        headers = {
+            'ETag': self.etags[coding],
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if etag_matches(if_none_match, self.etags.values()):
+            return 304, headers, b''
+        body = self.variants[coding]
+        headers['Content-Type'] = self.content_type
+        headers['Content-Length'] = str(len(body))
+        if coding != 'identity':
+            headers['Content-Encoding'] = coding
+        return 200, headers, body
+
+class Frontend:
+    """The landing page and its stylesheet, rendered once at startup."""
+
+    def __init__(self):
+        self.assets = {}
+
+    def build(self):
+        stylesheet = StaticAsset(STYLESHEET, 'text/css; charset=utf-8',
+                                 f'public, max-age={ASSET_MAX_AGE}, immutable')
+        stylesheet_path = f'/assets/app.{stylesheet.digest[:12]}.css'
+        with app.app_context():
+            page = render_template_string(HTML_TEMPLATE, stylesheet=stylesheet_path)
+        self.assets = {
+            '/': StaticAsset(page, 'text/html; charset=utf-8', f'public, max-age={PAGE_MAX_AGE}'),
+            stylesheet_path: stylesheet
+        }
+
+    def serve(self, path, if_none_match='', accept_encoding=''):
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+        return asset.respond(if_none_match, accept_encoding)
+
+frontend = Frontend()
+
+def frontend_response():
+    served = frontend.serve(request.path, request.headers.get('If-None-Match', ''),
+                            request.headers.get('Accept-Encoding', ''))
+    if served is None:
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    status, headers, body = served
+    response = Response(body, status=status, headers=headers)
+    response.direct_passthrough = True
+    return response
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return frontend_response()
+
+@app.route('/assets/<name>')
+def asset(name):
+    return frontend_response()
 
 # HTML Template
+STYLESHEET = '''
+* { margin: 0; padding: 0; box-sizing: border-box; }
+body { 
+    font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
+    background: linear-gradient(135deg, #0c0c0c 0%, #1a1a2e 50%, #16213e 100%);
+    color: #ffffff; line-height: 1.6; 
+}
+.container { max-width: 1200px; margin: 0 auto; padding: 0 20px; }
+header { padding: 2rem 0; text-align: center; background: rgba(255,255,255,0.05); backdrop-filter: blur(10px); border-bottom: 1px solid rgba(255,255,255,0.1); }
+.logo { font-size: 2.5rem; font-weight: 700; background: linear-gradient(135deg, #00d4ff, #0099cc); -webkit-background-clip: text; -webkit-text-fill-color: transparent; margin-bottom: 0.5rem; }
+.tagline { font-size: 1.2rem; color: #a0a0a0; font-weight: 300; }
+.hero { text-align: center; padding: 4rem 0; }
+.hero h1 { font-size: 3.5rem; font-weight: 700; margin-bottom: 1rem; background: linear-gradient(135deg, #ffffff, #a0a0a0); -webkit-background-clip: text; -webkit-text-fill-color: transparent; }
+.hero p { font-size: 1.3rem; color: #b0b0b0; max-width: 600px; margin: 0 auto 2rem; }
+.pricing-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(350px, 1fr)); gap: 2rem; padding: 2rem 0; }
+.pricing-card { background: rgba(255,255,255,0.08); border-radius: 20px; padding: 2.5rem; text-align: center; border: 1px solid rgba(255,255,255,0.1); transition: all 0.3s ease; }
+.pricing-card:hover { transform: translateY(-10px); background: rgba(255,255,255,0.12); border-color: rgba(0,212,255,0.3); }
+.plan-name { font-size: 1.8rem; font-weight: 600; margin-bottom: 1rem; }
+.plan-price { font-size: 3rem; font-weight: 700; margin-bottom: 1.5rem; background: linear-gradient(135deg, #00d4ff, #0099cc); -webkit-background-clip: text; -webkit-text-fill-color: transparent; }
+.specs { list-style: none; margin: 2rem 0; }
+.specs li { padding: 0.8rem 0; border-bottom: 1px solid rgba(255,255,255,0.1); display: flex; align-items: center; justify-content: center; gap: 0.5rem; }
+.icon { color: #00d4ff; font-style: normal; font-size: 1.3em; line-height: 1; display: inline-block; min-width: 1.3em; text-align: center; }
+.cta-button { display: inline-block; padding: 1rem 2rem; background: linear-gradient(135deg, #00d4ff, #0099cc); color: white; border: none; border-radius: 50px; font-weight: 600; font-size: 1.1rem; cursor: pointer; width: 100%; transition: all 0.3s ease; }
+.cta-button:hover { transform: scale(1.05); box-shadow: 0 10px 25px rgba(0,212,255,0.3); }
+.cta-button:disabled { background: #666; cursor: not-allowed; transform: none; box-shadow: none; }
+.status-badge { display: inline-block; padding: 0.5rem 1rem; border-radius: 20px; font-size: 0.9rem; font-weight: 600; margin-bottom: 1rem; background: rgba(0,255,0,0.2); color: #00ff00; border: 1px solid rgba(0,255,0,0.3); }
+.deploy-status { margin-top: 1rem; padding: 1rem; background: rgba(255,255,255,0.05); border-radius: 10px; border-left: 4px solid #00d4ff; }
+.deploy-log { background: rgba(0,0,0,0.5); padding: 1rem; border-radius: 5px; margin-top: 1rem; font-family: monospace; font-size: 0.9rem; max-height: 200px; overflow-y: auto; text-align: left; }
+.connection-details { background: rgba(0,212,255,0.1); border: 1px solid rgba(0,212,255,0.3); border-radius: 10px; padding: 1.5rem; margin-top: 1rem; text-align: left; }
+.connection-item { display: flex; justify-content: space-between; padding: 0.5rem 0; border-bottom: 1px solid rgba(255,255,255,0.1); }
+.copy-btn { background: rgba(255,255,255,0.1); border: none; color: white; padding: 0.25rem 0.75rem; border-radius: 5px; cursor: pointer; margin-left: 1rem; }
+footer { text-align: center; padding: 2rem 0; border-top: 1px solid rgba(255,255,255,0.1); color: #a0a0a0; margin-top: 4rem; }
+.pulse { animation: pulse 2s infinite; }
+@keyframes pulse { 0% { opacity: 1; } 50% { opacity: 0.5; } 100% { opacity: 1; } }
+@media (max-width: 768px) { .hero h1 { font-size: 2.5rem; } .pricing-grid { grid-template-columns: 1fr; } }
+'''
+
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -395,44 +4212,7 @@ HTML_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Alpine Cloud Python - Instant Python Environments</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap" rel="stylesheet">
-    <link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { 
-            font-family: 'Inter', sans-serif; 
-            background: linear-gradient(135deg, #0c0c0c 0%, #1a1a2e 50%, #16213e 100%);
-            color: #ffffff; line-height: 1.6; 
-        }
-        .container { max-width: 1200px; margin: 0 auto; padding: 0 20px; }
-        header { padding: 2rem 0; text-align: center; background: rgba(255,255,255,0.05); backdrop-filter: blur(10px); border-bottom: 1px solid rgba(255,255,255,0.1); }
-        .logo { font-size: 2.5rem; font-weight: 700; background: linear-gradient(135deg, #00d4ff, #0099cc); -webkit-background-clip: text; -webkit-text-fill-color: transparent; margin-bottom: 0.5rem; }
-        .tagline { font-size: 1.2rem; color: #a0a0a0; font-weight: 300; }
-        .hero { text-align: center; padding: 4rem 0; }
-        .hero h1 { font-size: 3.5rem; font-weight: 700; margin-bottom: 1rem; background: linear-gradient(135deg, #ffffff, #a0a0a0); -webkit-background-clip: text; -webkit-text-fill-color: transparent; }
-        .hero p { font-size: 1.3rem; color: #b0b0b0; max-width: 600px; margin: 0 auto 2rem; }
-        .pricing-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(350px, 1fr)); gap: 2rem; padding: 2rem 0; }
-        .pricing-card { background: rgba(255,255,255,0.08); border-radius: 20px; padding: 2.5rem; text-align: center; border: 1px solid rgba(255,255,255,0.1); transition: all 0.3s ease; }
-        .pricing-card:hover { transform: translateY(-10px); background: rgba(255,255,255,0.12); border-color: rgba(0,212,255,0.3); }
-        .plan-name { font-size: 1.8rem; font-weight: 600; margin-bottom: 1rem; }
-        .plan-price { font-size: 3rem; font-weight: 700; margin-bottom: 1.5rem; background: linear-gradient(135deg, #00d4ff, #0099cc); -webkit-background-clip: text; -webkit-text-fill-color: transparent; }
-        .specs { list-style: none; margin: 2rem 0; }
-        .specs li { padding: 0.8rem 0; border-bottom: 1px solid rgba(255,255,255,0.1); display: flex; align-items: center; justify-content: center; gap: 0.5rem; }
-        .material-icons { color: #00d4ff; }
-        .cta-button { display: inline-block; padding: 1rem 2rem; background: linear-gradient(135deg, #00d4ff, #0099cc); color: white; border: none; border-radius: 50px; font-weight: 600; font-size: 1.1rem; cursor: pointer; width: 100%; transition: all 0.3s ease; }
-        .cta-button:hover { transform: scale(1.05); box-shadow: 0 10px 25px rgba(0,212,255,0.3); }
-        .cta-button:disabled { background: #666; cursor: not-allowed; transform: none; box-shadow: none; }
-        .status-badge { display: inline-block; padding: 0.5rem 1rem; border-radius: 20px; font-size: 0.9rem; font-weight: 600; margin-bottom: 1rem; background: rgba(0,255,0,0.2); color: #00ff00; border: 1px solid rgba(0,255,0,0.3); }
-        .deploy-status { margin-top: 1rem; padding: 1rem; background: rgba(255,255,255,0.05); border-radius: 10px; border-left: 4px solid #00d4ff; }
-        .deploy-log { background: rgba(0,0,0,0.5); padding: 1rem; border-radius: 5px; margin-top: 1rem; font-family: monospace; font-size: 0.9rem; max-height: 200px; overflow-y: auto; text-align: left; }
-        .connection-details { background: rgba(0,212,255,0.1); border: 1px solid rgba(0,212,255,0.3); border-radius: 10px; padding: 1.5rem; margin-top: 1rem; text-align: left; }
-        .connection-item { display: flex; justify-content: space-between; padding: 0.5rem 0; border-bottom: 1px solid rgba(255,255,255,0.1); }
-        .copy-btn { background: rgba(255,255,255,0.1); border: none; color: white; padding: 0.25rem 0.75rem; border-radius: 5px; cursor: pointer; margin-left: 1rem; }
-        footer { text-align: center; padding: 2rem 0; border-top: 1px solid rgba(255,255,255,0.1); color: #a0a0a0; margin-top: 4rem; }
-        .pulse { animation: pulse 2s infinite; }
-        @keyframes pulse { 0% { opacity: 1; } 50% { opacity: 0.5; } 100% { opacity: 1; } }
-        @media (max-width: 768px) { .hero h1 { font-size: 2.5rem; } .pricing-grid { grid-template-columns: 1fr; } }
-    </style>
+    <link rel="stylesheet" href="{{ stylesheet }}">
 </head>
 <body>
     <header>
@@ -457,20 +4237,20 @@ HTML_TEMPLATE = '''
                     <div class="plan-name">Python Cloud IDE</div>
                     <div class="plan-price">$0<span style="font-size: 1rem; color: #a0a0a0;">/month</span></div>
                     <ul class="specs">
-                        <li><span class="material-icons">code</span> Python 3.11 Environment</li>
-                        <li><span class="material-icons">memory</span> 2 vCPU Cores</li>
-                        <li><span class="material-icons">sd_storage</span> 4 GB RAM</li>
-                        <li><span class="material-icons">storage</span> 10 GB Storage</li>
-                        <li><span class="material-icons">web_asset</span> Web-based IDE</li>
-                        <li><span class="material-icons">schedule</span> 4 Hour Sessions</li>
+                        <li><span class="icon">&#x2328;</span> Python 3.11 Environment</li>
+                        <li><span class="icon">&#x25A6;</span> 2 vCPU Cores</li>
+                        <li><span class="icon">&#x25A4;</span> 4 GB RAM</li>
+                        <li><span class="icon">&#x26C1;</span> 10 GB Storage</li>
+                        <li><span class="icon">&#x25A3;</span> Web-based IDE</li>
+                        <li><span class="icon">&#x23F1;</span> 4 Hour Sessions</li>
                     </ul>
                     <button class="cta-button" onclick="claimEnvironment()" id="claim-btn">
-                        <span class="material-icons" style="vertical-align: middle;">rocket_launch</span>
+                        <span class="icon" style="vertical-align: middle;">&#x279C;</span>
                         Launch Python IDE
                     </button>
                     <div id="deploy-status" class="deploy-status" style="display: none;">
                         <div style="display: flex; align-items: center; gap: 0.5rem;">
-                            <span class="material-icons">sync</span>
+                            <span class="icon">&#x21BB;</span>
                             <span id="status-text">Getting Python environment...</span>
                         </div>
                         <div id="deploy-log" class="deploy-log"></div>
@@ -490,7 +4270,7 @@ HTML_TEMPLATE = '''
     <script>
         const API_BASE = '/api';
         let currentUserId = null;
-        let checkInterval = null;
+        let waitSource = null;
 
         async function claimEnvironment() {
             const statusDiv = document.getElementById('deploy-status');
@@ -502,7 +4282,7 @@ HTML_TEMPLATE = '''
             statusDiv.style.display = 'block';
             logDiv.innerHTML = '🚀 Launching Python environment...\\n';
             button.disabled = true;
-            button.innerHTML = '<span class="material-icons">hourglass_empty</span> Connecting...';
+            button.innerHTML = '<span class="icon">&#x231B;</span> Connecting...';
             statusBadge.textContent = 'CONNECTING';
             statusBadge.classList.add('pulse');
             statusText.textContent = 'Connecting to Python environment...';
@@ -525,7 +4305,7 @@ HTML_TEMPLATE = '''
                     logDiv.innerHTML += `🐍 Python: ${data.env.python_version}\\n`;
                     logDiv.innerHTML += `⏰ Session active for 4 hours\\n`;
                     
-                    button.innerHTML = '<span class="material-icons">check</span> Environment Active';
+                    button.innerHTML = '<span class="icon">&#x2713;</span> Environment Active';
                     
                 } else {
                     logDiv.innerHTML += `⏳ ${data.message}\\n`;
@@ -535,47 +4315,47 @@ HTML_TEMPLATE = '''
             } catch (error) {
                 logDiv.innerHTML += `❌ Error: ${error.message}\\n`;
                 button.disabled = false;
-                button.innerHTML = '<span class="material-icons">rocket_launch</span> Launch Python IDE';
+                button.innerHTML = '<span class="icon">&#x279C;</span> Launch Python IDE';
                 statusBadge.textContent = 'READY';
                 statusBadge.classList.remove('pulse');
             }
         }
 
         function startWaitingForEnvironment(logDiv, button, statusBadge, statusText) {
-            let waitTime = 0;
+            // The server queues us and pushes the environment as soon as one frees up
+            waitSource = new EventSource(`${API_BASE}/claim/stream`);
             
-            checkInterval = setInterval(async () => {
-                waitTime += 5;
-                logDiv.innerHTML += `⏰ Waiting... ${waitTime}s\\n`;
-                
-                try {
-                    const response = await fetch(`${API_BASE}/claim`);
-                    const data = await response.json();
-                    
-                    if (data.success) {
-                        clearInterval(checkInterval);
-                        currentUserId = data.env.user_id;
-                        showEnvironmentDetails(data.env, logDiv);
-                        statusBadge.textContent = 'ACTIVE';
-                        statusBadge.classList.remove('pulse');
-                        statusText.textContent = 'Python environment ready!';
-                        
-                        logDiv.innerHTML += `🎉 Environment available!\\n`;
-                        button.innerHTML = '<span class="material-icons">check</span> Environment Active';
-                    }
-                } catch (error) {
-                    logDiv.innerHTML += `⚠️ Check failed: ${error.message}\\n`;
-                }
+            waitSource.addEventListener('waiting', (event) => {
+                const data = JSON.parse(event.data);
+                logDiv.innerHTML += `⏰ Waiting... position ${data.queue_position} in queue\\n`;
+                logDiv.scrollTop = logDiv.scrollHeight;
+            });
+            
+            waitSource.addEventListener('claimed', (event) => {
+                waitSource.close();
+                waitSource = null;
+                const env = JSON.parse(event.data);
+                currentUserId = env.user_id;
+                showEnvironmentDetails(env, logDiv);
+                statusBadge.textContent = 'ACTIVE';
+                statusBadge.classList.remove('pulse');
+                statusText.textContent = 'Python environment ready!';
                 
+                logDiv.innerHTML += `🎉 Environment available!\\n`;
+                button.innerHTML = '<span class="icon">&#x2713;</span> Environment Active';
                 logDiv.scrollTop = logDiv.scrollHeight;
-            }, 5000);
+            });
+            
+            waitSource.onerror = () => {
+                logDiv.innerHTML += `⚠️ Connection lost, reconnecting...\\n`;
+            };
         }
 
         function showEnvironmentDetails(env, logDiv) {
             const connectionDiv = document.getElementById('connection-details');
             connectionDiv.style.display = 'block';
             connectionDiv.innerHTML = `
-                <h4><span class="material-icons">terminal</span> Your Python Environment</h4>
+                <h4><span class="icon">&#x276F;</span> Your Python Environment</h4>
                 <div class="connection-item">
                     <strong>Access URL:</strong>
                     <span><a href="${env.url}" target="_blank" style="color: #00d4ff;">${env.url}</a> <button class="copy-btn" onclick="copyToClipboard('${env.url}')">Copy</button></span>
@@ -605,7 +4385,7 @@ HTML_TEMPLATE = '''
                     Click the URL above to access your Python IDE. Install any packages you need.
                 </div>
                 <button class="cta-button" onclick="releaseEnvironment()" style="margin-top: 1rem; background: linear-gradient(135deg, #ff6b6b, #ee5a52);">
-                    <span class="material-icons">logout</span>
+                    <span class="icon">&#x21E5;</span>
                     Release Environment
                 </button>
             `;
@@ -633,15 +4413,77 @@ HTML_TEMPLATE = '''
 
         // Cleanup on page leave
         window.addEventListener('beforeunload', () => {
-            if (checkInterval) clearInterval(checkInterval);
+            if (waitSource) waitSource.close();
         });
     </script>
 </body>
 </html>
 '''
 
+frontend.build()
+
+# Startup
+# Importing main only defines the app and its stores. The serving process
+# loads the pool and starts the workers through start(), so tools such as
+# migrate.py can open the store without threads writing to the data dir.
+started = False
+start_lock = threading.Lock()
+
+def open_pool():
+    """Create the data files, read the vault key and load the pool, without starting workers."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for file in [AVAILABLE_FILE, IN_USE_FILE]:
+        if not os.path.exists(file):
+            open(file, 'w').close()
+    event_log.start()
+    atexit.register(event_log.close)
+    
+    if AESGCM is None:
+        if VAULT_ENABLED:
+            log_event('VAULT_UNAVAILABLE', error='cryptography is not installed, passwords are stored in plaintext')
+    elif VAULT_ENABLED or os.path.exists(VAULT_KEY_FILE):
+        # With the vault off, an existing key still opens the passwords it sealed
+        vault.load(sealing=VAULT_ENABLED)
+    pool.load()
+
+def start():
+    """Load the pool and start the background workers, once per serving process."""
+    global started
+    with start_lock:
+        if started:
+            return
+        open_pool()
+        PEER_ADDRESSES.update(resolve_peers())
+        cleanup_thread.start()
+        if isinstance(pool, PoolStore):
+            persist_thread.start()
+            compact_thread.start()
+            atexit.register(pool.compact)
+            if RELOAD_ENABLED:
+                pool_watcher.start()
+                reload_thread.start()
+        if rotator.hook is not None:
+            event_listeners.append(rotator.observe)
+            rotator.start()
+        if HEALTH_CHECKS:
+            health_thread.start()
+        for webhook in webhooks:
+            webhook.thread.start()
+        started = True
+
+@app.before_request
+def start_on_first_request():
+    # WSGI servers import main:app without running the __main__ block
+    if not started:
+        start()
+
 if __name__ == '__main__':
+    start()
     print("🚀 Alpine Cloud Python Server Starting...")
-    print("📍 Access the site at: http://localhost:5000")
-    print("🔧 API available at: http://localhost:5000/api")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    print(f"📍 Access the site at: http://localhost:{PORT}")
+    print(f"🔧 API available at: http://localhost:{PORT}/api")
+    if ring:
+        print(f"🧩 Shard {POOL_NODE} of {len(POOL_NODES)} nodes")
+    # The reloader would run a second process with its own pool, compaction
+    # and atexit snapshot against the same data dir
+    app.run(host='0.0.0.0', port=PORT, debug=True, use_reloader=False)
@@ -0,0 +1,40 @@
+"""Move the pool between the pipe-delimited text files and SQLite.
+
+    python migrate.py import   # data/*.txt (+ journal) -> data/pool.db
+    python migrate.py export   # data/pool.db -> data/*.txt
+
+Run it while the server is stopped. POOL_DB overrides the database path.
+Sealed passwords are copied as they are, so both backends need the same
+vault key (data/vault.key, or POOL_VAULT_KEY).
+"""
+import os
+import sys
+
+os.environ['POOL_STORAGE'] = 'sqlite'
+
+import main
+
+
+def import_files():
+    files = main.PoolStore()
+    files.load()  # Replays the journal...
+    files.compact()  # ...and folds it into the text files
+    available, in_use = files.snapshot()
+    main.pool.import_envs(available, in_use)
+    print(f"Imported {len(available)} available and {len(in_use)} in-use environments into {main.DB_FILE}")
+
+
+def export_files():
+    available, in_use = main.pool.snapshot()
+    if not main.save_pool(available, in_use):
+        sys.exit('Export failed, see the pool log')
+    main.truncate_journal()
+    print(f"Exported {len(available)} available and {len(in_use)} in-use environments to {main.DATA_DIR}")
+
+
+if __name__ == '__main__':
+    commands = {'import': import_files, 'export': export_files}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit(__doc__)
+    main.open_pool()  # Data dir, vault key and database, but none of the server's workers
+    commands[sys.argv[1]]()
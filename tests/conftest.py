@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main reads its config at import, so point it at a scratch data dir first
+os.environ.setdefault('POOL_DATA_DIR', tempfile.mkdtemp(prefix='pool-tests-'))
+os.environ.setdefault('POOL_RELOAD', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+POOL_FILES = ('AVAILABLE_FILE', 'IN_USE_FILE', 'COMMIT_FILE', 'SNAPSHOT_FILE', 'JOURNAL_FILE')
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Point the file backend's pool files at an empty directory."""
+    monkeypatch.setattr(main, 'DATA_DIR', str(tmp_path))
+    for name in POOL_FILES:
+        monkeypatch.setattr(main, name, str(tmp_path / os.path.basename(getattr(main, name))))
+    return tmp_path
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def open_store(request, data_dir):
+    """Opens the store of one backend over the same data, as a restart would."""
+    def open_store(hold_released=False):
+        if request.param == 'file':
+            store = main.PoolStore()
+        else:
+            store = main.SqlitePoolStore(str(data_dir / 'pool.db'))
+        store.hold_released = hold_released
+        store.load()
+        return store
+    open_store.backend = request.param
+    return open_store
+
+
+@pytest.fixture
+def store(open_store):
+    """A fresh, empty store of each backend."""
+    return open_store()
+
+
+@pytest.fixture
+def client():
+    main.start()
+    return main.app.test_client()
+
+
+def make_env(url, python_version='3.11', resources='small', password='secret'):
+    return main.parse_env({'url': url, 'username': 'user', 'password': password,
+                           'python_version': python_version, 'resources': resources})
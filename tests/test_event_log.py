@@ -0,0 +1,39 @@
+import json
+import os
+import time
+
+import main
+
+
+def write_record(path, epoch):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'ts': main.format_time(epoch), 'event': 'OLD'}) + '\n')
+
+
+def rotated(tmp_path):
+    return [name for name in os.listdir(tmp_path) if name != 'events.jsonl']
+
+
+def test_log_kept_across_restart_is_aged_by_its_first_record(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    write_record(path, time.time() - main.LOG_ROTATE_SECONDS - 60)
+    write_record(path, time.time())  # Appended just now, so the mtime is fresh
+
+    log = main.EventLog(path)
+    log.write([{'event': 'FIRST'}])
+    log.write([{'event': 'SECOND'}])
+    log.close()
+    assert len(rotated(tmp_path)) == 1
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line)['event'] for line in f] == ['SECOND']
+
+
+def test_recent_log_is_not_rotated_on_restart(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    write_record(path, time.time() - 60)
+
+    log = main.EventLog(path)
+    log.write([{'event': 'FIRST'}])
+    log.write([{'event': 'SECOND'}])
+    log.close()
+    assert rotated(tmp_path) == []
@@ -0,0 +1,89 @@
+import hashlib
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def receiver():
+    """Local webhook endpoint; set .status to change its answer."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            server.requests.append((dict(self.headers), body))
+            self.send_response(server.status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.status = 200
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/hook'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+EVENTS = [{'id': 1, 'event': 'ENV_ADDED', 'url': 'https://env-1.example.com'}]
+
+
+def test_webhook_delivers_signed_batch(receiver):
+    worker = main.WebhookWorker(receiver.url, secret='s3cret')
+    assert worker.deliver(EVENTS)
+    (headers, body), = receiver.requests
+    assert json.loads(body) == {'events': EVENTS}
+    expected = hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+    assert headers['X-Pool-Signature'] == f'sha256={expected}'
+
+
+def test_webhook_without_secret_is_unsigned(receiver):
+    assert main.WebhookWorker(receiver.url, secret='').deliver(EVENTS)
+    (headers, _), = receiver.requests
+    assert 'X-Pool-Signature' not in headers
+
+
+def test_webhook_failures_are_reported(receiver):
+    receiver.status = 500
+    assert not main.WebhookWorker(receiver.url).deliver(EVENTS)
+    url = receiver.url
+    receiver.shutdown()
+    receiver.server_close()
+    assert not main.WebhookWorker(url).deliver(EVENTS)
+
+
+def test_bus_hides_user_ids_and_skips_other_events():
+    bus = main.EventBus()
+    bus.publish({'event': 'ENV_CLAIMED', 'url': 'https://env-1.example.com', 'user_id': 'user_abc'})
+    bus.publish({'event': 'CLAIM_ERROR', 'error': 'boom'})
+    events, reset = bus.since(0)
+    assert not reset
+    assert [event['event'] for event in events] == ['ENV_CLAIMED']
+    assert 'user_id' not in events[0]
+    assert events[0]['lease_id'] == hashlib.sha256(b'user_abc').hexdigest()[:16]
+
+
+def test_bus_reader_that_fell_behind_is_told_to_reset():
+    bus = main.EventBus(size=2)
+    for index in range(4):
+        bus.publish({'event': 'ENV_ADDED', 'url': f'https://env-{index}.example.com'})
+    events, reset = bus.since(0)
+    assert reset
+    assert [event['id'] for event in events] == [3, 4]
+    assert bus.since(4) == ([], False)
+
+
+def test_pool_changes_reach_the_bus(client):
+    after = main.bus.last_id
+    url = 'https://bus-added.example.com'
+    assert client.post('/api/add', json={'url': url, 'username': 'user', 'password': 'secret'}).status_code == 200
+    events, _ = main.bus.since(after)
+    assert any(event['event'] == 'ENV_ADDED' and event['url'] == url for event in events)
@@ -0,0 +1,60 @@
+import itertools
+
+import pytest
+
+import main
+from conftest import make_env
+
+urls = (f'https://fair-{index}.example.com' for index in itertools.count())
+
+
+@pytest.fixture
+def queue():
+    return main.WaitQueue(main.PoolStore())
+
+
+def serve(queue, waiters, count):
+    """Free count envs one at a time; returns the tenant names in grant order."""
+    order = []
+    for _ in range(count):
+        assert queue.store.add(make_env(next(urls)))
+        queue.dispatch()
+        for waiter in waiters:
+            if waiter.env is not None and waiter not in order:
+                order.append(waiter)
+    return [waiter.tenant.name for waiter in order]
+
+
+def test_weight_beats_arrival_order(queue):
+    early = queue.join(None, None, tenant=main.Tenant('anon', 'default'))[1]
+    late = queue.join(None, None, tenant=main.Tenant('ci', 'internal'))[1]
+    assert serve(queue, [early, late], 1) == ['ci']
+
+
+def test_classes_share_by_weight(queue):
+    default, internal = main.Tenant('anon', 'default'), main.Tenant('ci', 'internal')
+    waiters = [queue.join(None, None, tenant=default)[1] for _ in range(20)]
+    waiters += [queue.join(None, None, tenant=internal)[1] for _ in range(20)]
+    order = serve(queue, waiters, 9)
+    assert order.count('ci') == 8 and order.count('anon') == 1
+    assert order[0] == 'ci'
+
+
+def test_tenants_of_a_class_share_by_weight(queue):
+    big, small = main.Tenant('big', 'paid', weight=3), main.Tenant('small', 'paid', weight=1)
+    waiters = [queue.join(None, None, tenant=small)[1] for _ in range(10)]
+    waiters += [queue.join(None, None, tenant=big)[1] for _ in range(10)]
+    order = serve(queue, waiters, 8)
+    assert order.count('big') == 6 and order.count('small') == 2
+
+
+def test_tenant_at_lease_cap_is_skipped_until_it_releases(queue):
+    capped, other = main.Tenant('capped', 'internal', max_leases=1), main.Tenant('anon', 'default')
+    waiters = [queue.join(None, None, tenant=capped)[1] for _ in range(2)]
+    waiters.append(queue.join(None, None, tenant=other)[1])
+    assert serve(queue, waiters, 2) == ['capped', 'anon']
+
+    queue.forget(waiters[0].env['user_id'])
+    assert queue.store.add(make_env(next(urls)))
+    queue.dispatch()
+    assert waiters[1].env is not None
@@ -0,0 +1,77 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+import main
+from conftest import make_env
+
+
+def listen(port=0):
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen()
+    return server
+
+
+@pytest.fixture
+def listener():
+    """A local TCP port that accepts connections."""
+    server = listen()
+    yield server
+    server.close()
+
+
+def url_of(server):
+    return f'tcp://127.0.0.1:{server.getsockname()[1]}'
+
+
+def run_checks(prober, url, times):
+    """Probe url times over, as the prober's own loop would; returns the threads results were applied on."""
+    applied = []
+    apply = prober.apply
+
+    def recording(*args):
+        applied.append(threading.current_thread())
+        apply(*args)
+
+    async def checks():
+        prober.connections = main.ProbeConnections()
+        prober.refresh([url])
+        for _ in range(times):
+            await prober.check(url)
+
+    prober.apply = recording
+    asyncio.run(checks())
+    return applied
+
+
+def test_failing_env_is_quarantined_then_restored(store, listener):
+    url = url_of(listener)
+    port = listener.getsockname()[1]
+    listener.close()
+    assert store.add(make_env(url))
+    prober = main.HealthProber(store)
+    run_checks(prober, url, main.HEALTH_FAILURES - 1)
+    assert store.quarantined_urls() == []
+    run_checks(prober, url, 1)
+    assert store.quarantined_urls() == [url]
+    assert prober.state[url]['interval'] == main.HEALTH_RETRY_INTERVAL
+    assert store.claim('user_health') is None
+
+    with listen(port):
+        run_checks(prober, url, 1)
+    assert store.quarantined_urls() == []
+    assert prober.state[url]['failures'] == 0
+    assert store.claim('user_health')['url'] == url
+
+
+def test_healthy_env_backs_off_on_the_loop(store, listener):
+    url = url_of(listener)
+    assert store.add(make_env(url))
+    prober = main.HealthProber(store)
+    applied = run_checks(prober, url, 2)
+    assert (prober.state[url]['failures'], prober.state[url]['interval']) == (0, main.HEALTH_INTERVAL * 4)
+    assert applied and threading.current_thread() not in applied  # Store updates run off the loop
@@ -0,0 +1,61 @@
+import main
+
+
+def test_eviction_passes_over_requests_still_running():
+    cache = main.IdempotencyCache(ttl=600, max_keys=2)
+    assert cache.begin('slow', 'f') is None  # Never finishes
+    for index in range(5):
+        key = f'key-{index}'
+        assert cache.begin(key, 'f') is None
+        cache.finish(key, 200, b'{}')
+    assert len(cache) <= 3
+    assert 'slow' in cache.entries
+
+
+def add(client, url, python_version):
+    response = client.post('/api/add', json={'url': url, 'username': 'user', 'password': f'pw-{url}',
+                                             'python_version': python_version})
+    assert response.status_code == 200
+
+
+def claim(client, key, python_version, addr='127.0.0.1'):
+    return client.get('/api/claim', query_string={'python_version': python_version},
+                      headers={'Idempotency-Key': key}, environ_base={'REMOTE_ADDR': addr})
+
+
+def test_retried_claim_replays_the_same_lease_with_its_password(client):
+    url = 'https://idem-replay.example.com'
+    add(client, url, '3.90')
+    first = claim(client, 'claim-replay', '3.90')
+    assert first.status_code == 200
+    retry = claim(client, 'claim-replay', '3.90')
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['env'] == first.get_json()['env']
+    assert retry.get_json()['env']['password'] == f'pw-{url}'
+    cached = [entry[3] for key, entry in main.idempotency.entries.items() if key[2] == 'claim-replay']
+    assert b'pw-' not in cached[0][1]  # Kept without the password
+
+
+def test_replay_after_release_is_a_conflict(client):
+    add(client, 'https://idem-released.example.com', '3.91')
+    first = claim(client, 'claim-released', '3.91')
+    user_id = first.get_json()['env']['user_id']
+    assert client.get('/api/release', query_string={'user_id': user_id}).status_code == 200
+    assert claim(client, 'claim-released', '3.91').status_code == 409
+
+
+def test_keys_are_scoped_to_the_caller(client):
+    add(client, 'https://idem-a.example.com', '3.92')
+    add(client, 'https://idem-b.example.com', '3.92')
+    mine = claim(client, 'claim-shared', '3.92', addr='10.0.0.1')
+    theirs = claim(client, 'claim-shared', '3.92', addr='10.0.0.2')
+    assert theirs.status_code == 200
+    assert 'Idempotent-Replayed' not in theirs.headers
+    assert theirs.get_json()['env']['url'] != mine.get_json()['env']['url']
+
+
+def test_key_reused_with_other_parameters_is_rejected(client):
+    add(client, 'https://idem-mismatch.example.com', '3.93')
+    assert claim(client, 'claim-mismatch', '3.93').status_code == 200
+    assert claim(client, 'claim-mismatch', '3.94').status_code == 422
@@ -0,0 +1,68 @@
+import os
+
+import main
+from conftest import make_env
+
+
+def reopen():
+    store = main.PoolStore()
+    store.load()
+    return store
+
+
+def journal_lines():
+    with open(main.JOURNAL_FILE, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def test_mutations_are_group_committed(data_dir):
+    store = reopen()
+    for index in range(3):
+        assert store.add(make_env(f'https://journal-{index}.example.com'))
+    store.claim('user_journal')
+    assert not os.path.exists(main.JOURNAL_FILE)  # Nothing written until the flush
+
+    assert store.flush()
+    assert [line.split(' | ')[:2] for line in journal_lines()] == [
+        ['1', 'ADD'], ['2', 'ADD'], ['3', 'ADD'], ['4', 'CLAIM']]
+    assert store.flush()  # Nothing pending, nothing appended
+    assert len(journal_lines()) == 4
+
+
+def test_restart_replays_journal_on_snapshot(data_dir):
+    store = reopen()
+    first, second = 'https://journal-a.example.com', 'https://journal-b.example.com'
+    assert store.add(make_env(first))
+    assert store.compact()
+    assert store.add(make_env(second))
+    assert store.claim('user_journal')['url'] == first
+    store.renew('user_journal', 600)
+    assert store.flush()
+
+    restarted = reopen()
+    assert restarted.counts() == (1, 1)
+    assert restarted.generation() == store.generation()
+    assert restarted.in_use['user_journal'].expires_at == store.in_use['user_journal'].expires_at
+    assert restarted.claim('user_other')['url'] == second
+
+
+def test_compaction_folds_journal_into_snapshot(data_dir):
+    store = reopen()
+    assert store.add(make_env('https://journal-c.example.com'))
+    assert store.flush()
+    assert store.compact()
+    assert journal_lines() == []
+    assert main.get_snapshot() == (store.generation(), set())
+    assert reopen().counts() == (1, 0)
+
+
+def test_torn_final_append_is_ignored(data_dir):
+    store = reopen()
+    assert store.add(make_env('https://journal-d.example.com'))
+    assert store.flush()
+    with open(main.JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        f.write('2 | CLAIM | https://journal-d.example.com | user_torn')  # No newline: crashed mid-write
+
+    restarted = reopen()
+    assert restarted.counts() == (1, 0)
+    assert restarted.generation() == 1
@@ -0,0 +1,46 @@
+import pytest
+
+import main
+from conftest import make_env
+
+
+@pytest.fixture(autouse=True)
+def window(monkeypatch):
+    monkeypatch.setattr(main, 'CLAIM_PREFER_WINDOW', 3)
+
+
+def fill(store, count, **kwargs):
+    urls = [f'https://latency-{index}.example.com' for index in range(count)]
+    for url in urls:
+        assert store.add(make_env(url, **kwargs))
+    return urls
+
+
+def test_claims_oldest_before_any_probe(store):
+    urls = fill(store, 5)
+    assert store.claim('user_1')['url'] == urls[0]
+
+
+def test_claims_fastest_inside_window(store):
+    urls = fill(store, 6)
+    store.set_latency(urls[1], 20.0)
+    store.set_latency(urls[2], 10.0)
+    store.set_latency(urls[5], 1.0)  # Faster, but outside the window
+    assert store.claim('user_1')['url'] == urls[2]
+    assert store.claim('user_2')['url'] == urls[1]
+
+
+def test_unprobed_envs_go_after_probed_ones(store):
+    urls = fill(store, 3)
+    store.set_latency(urls[2], 500.0)
+    assert store.claim('user_1')['url'] == urls[2]
+
+
+def test_filtered_claim_prefers_fastest_match(store):
+    small = fill(store, 2, python_version='3.12')
+    other = [f'https://latency-large-{index}.example.com' for index in range(2)]
+    for url in other:
+        assert store.add(make_env(url, python_version='3.12', resources='large'))
+    store.set_latency(small[1], 30.0)
+    store.set_latency(other[0], 1.0)
+    assert store.claim('user_1', '3.12', 'small')['url'] == small[1]
@@ -0,0 +1,32 @@
+import pytest
+
+import main
+from conftest import make_env
+
+
+def claim_deadline(store, url='https://lease-1.example.com'):
+    """Claim an env as user_lease; returns its deadline as claimed."""
+    assert store.add(make_env(url))
+    return store.claim('user_lease')['expires_at']
+
+
+def test_renew_extends_the_lease(store):
+    expires_at = claim_deadline(store)
+    renewed = store.renew('user_lease', main.MAX_LEASE_DURATION.total_seconds())
+    assert main.parse_time(renewed['expires_at']) > main.parse_time(expires_at)
+
+
+def test_renew_never_shortens_the_lease(store):
+    expires_at = claim_deadline(store)
+    assert store.renew('user_lease', 60)['expires_at'] == expires_at
+
+
+def test_renew_of_unknown_lease_is_none(store):
+    assert store.renew('user_missing', 60) is None
+
+
+@pytest.mark.parametrize('seconds', ['0', '0.5', '-5', 'abc', str(int(main.MAX_LEASE_DURATION.total_seconds()) + 1)])
+def test_renew_rejects_seconds_outside_range(client, seconds):
+    response = client.get(f'/api/renew?user_id=user_x&seconds={seconds}')
+    assert response.status_code == 400
+    assert 'between 1 and' in response.get_json()['error']
@@ -0,0 +1,17 @@
+import main
+
+
+def test_collected_totals_are_typed_as_counters():
+    metrics = main.Metrics()
+    metrics.add_collector(lambda: [('pool_envs', {'state': 'available'}, 3),
+                                   ('pool_vault_cache_lookups_total', {'result': 'hit'}, 7)])
+    lines = metrics.render().splitlines()
+    assert '# TYPE pool_envs gauge' in lines
+    assert '# TYPE pool_vault_cache_lookups_total counter' in lines
+    assert 'pool_vault_cache_lookups_total{result="hit"} 7' in lines
+
+
+def test_pool_totals_are_exported_as_counters():
+    names = {name for name, _, _ in main.pool_gauges()}
+    assert {'pool_vault_cache_lookups_total', 'pool_event_log_dropped_total'} <= names
+    assert not {'pool_vault_cache_lookups', 'pool_event_log_dropped'} & names
@@ -0,0 +1,70 @@
+import os
+import threading
+
+import main
+from conftest import make_env
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_committed_write_is_rolled_forward(data_dir):
+    write(main.AVAILABLE_FILE, 'old available')
+    write(main.IN_USE_FILE, 'old in use')
+    # Crash after the commit marker was published but before the renames
+    write(main.AVAILABLE_FILE + '.tmp', 'new available')
+    write(main.IN_USE_FILE + '.tmp', 'new in use')
+    write(main.COMMIT_FILE, '\n'.join([main.AVAILABLE_FILE, main.IN_USE_FILE]))
+
+    main.recover_pool_files()
+    assert read(main.AVAILABLE_FILE) == 'new available'
+    assert read(main.IN_USE_FILE) == 'new in use'
+    assert sorted(path.name for path in data_dir.iterdir()) == sorted(
+        [os.path.basename(main.AVAILABLE_FILE), os.path.basename(main.IN_USE_FILE)])
+
+
+def test_uncommitted_write_is_discarded(data_dir):
+    write(main.AVAILABLE_FILE, 'old available')
+    write(main.AVAILABLE_FILE + '.tmp', 'half written')
+
+    main.recover_pool_files()
+    assert read(main.AVAILABLE_FILE) == 'old available'
+    assert not os.path.exists(main.AVAILABLE_FILE + '.tmp')
+
+
+def test_saved_pool_loads_back(data_dir):
+    envs = [make_env(f'https://saved-{index}.example.com') for index in range(3)]
+    assert main.save_pool(envs, [])
+    store = main.PoolStore()
+    store.load()
+    assert store.counts() == (3, 0)
+    assert not os.path.exists(main.COMMIT_FILE)
+
+
+def test_concurrent_claims_never_share_an_env(store):
+    urls = [f'https://race-{index}.example.com' for index in range(20)]
+    for url in urls:
+        assert store.add(make_env(url))
+    claimed = []
+    start = threading.Barrier(8)
+
+    def claimer(index):
+        start.wait()
+        for attempt in range(5):
+            env = store.claim(f'user_race_{index}_{attempt}')
+            if env is not None:
+                claimed.append(env['url'])
+
+    threads = [threading.Thread(target=claimer, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(urls)
@@ -0,0 +1,67 @@
+import math
+import time
+
+import pytest
+
+import main
+
+
+def test_bucket_allows_burst_then_refills():
+    limiter = main.RateLimiter({'/api/claim': (50, 2)})
+    assert limiter.take('ip:1', '/api/claim') == 0
+    assert limiter.take('ip:1', '/api/claim') == 0
+    wait = limiter.take('ip:1', '/api/claim')
+    assert 0 < wait <= 1 / 50
+    time.sleep(wait + 0.02)
+    assert limiter.take('ip:1', '/api/claim') == 0
+
+
+def test_refused_take_spends_nothing():
+    limiter = main.RateLimiter({'/api/claim': (1, 1)})
+    assert limiter.take('ip:1', '/api/claim') == 0
+    first = limiter.take('ip:1', '/api/claim')
+    second = limiter.take('ip:1', '/api/claim')
+    assert 0 < second <= first <= 1
+
+
+def test_buckets_are_per_client_and_endpoint():
+    limiter = main.RateLimiter({'/api/claim': (1, 1), '/api/add': (1, 1)})
+    assert limiter.take('ip:1', '/api/claim') == 0
+    assert limiter.take('ip:2', '/api/claim') == 0
+    assert limiter.take('ip:1', '/api/add') == 0
+    assert limiter.take('ip:1', '/api/claim') > 0
+
+
+def test_multiplier_scales_burst_and_cost_past_burst_never_fits():
+    limiter = main.RateLimiter({'/api/claim/bulk': (1, 5)})
+    assert limiter.take('key:a', '/api/claim/bulk', 50, multiplier=10) == 0
+    assert limiter.take('ip:1', '/api/claim/bulk', 6) == math.inf
+
+
+def test_endpoints_without_a_budget_are_not_limited():
+    limiter = main.RateLimiter({'/api/claim': (1, 1)})
+    assert all(limiter.take('ip:1', '/api/test') == 0 for _ in range(10))
+    assert len(limiter) == 0
+
+
+def test_least_recently_used_buckets_are_dropped():
+    limiter = main.RateLimiter({'/api/claim': (1, 1)}, max_clients=2)
+    for client in ('ip:1', 'ip:2', 'ip:3'):
+        limiter.take(client, '/api/claim')
+    assert len(limiter) == 2
+    assert limiter.take('ip:1', '/api/claim') == 0  # Dropped, so full again
+
+
+@pytest.mark.skipif(not main.RATE_LIMITING, reason='rate limiting is disabled')
+def test_limited_request_gets_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(main, 'limiter', main.RateLimiter({'/api/test': (0.25, 2)}))
+    assert client.get('/api/test').status_code == 200
+    assert client.get('/api/test').status_code == 200
+
+    response = client.get('/api/test')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '4'
+    assert response.get_json() == {'success': False, 'error': 'Too many requests', 'retry_after': 4}
+
+    # Another client has its own bucket
+    assert client.get('/api/test', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
@@ -0,0 +1,86 @@
+import pytest
+
+import main
+from conftest import make_env
+
+
+@pytest.fixture
+def watcher(client):
+    if not isinstance(main.pool, main.PoolStore):
+        pytest.skip('hot reload is for the file backend')
+    main.pool_watcher.start()
+    assert main.pool.compact()
+    return main.pool_watcher
+
+
+def settle(watcher):
+    """Poll until the watcher has acted on the current files."""
+    watcher.poll()
+    return watcher.poll()
+
+
+def test_rejected_edit_does_not_stall_compaction(watcher):
+    url = 'https://reload-rejected.example.com'
+    assert main.pool.add(make_env(url))
+    assert main.pool.compact()
+    with open(main.AVAILABLE_FILE, 'a', encoding='utf-8') as f:
+        f.write('not a pool line\n')
+
+    assert not settle(watcher)
+    assert main.pool.compact()
+    with open(main.AVAILABLE_FILE, encoding='utf-8') as f:
+        text = f.read()
+    assert 'not a pool line' not in text
+    assert url in text
+
+
+@pytest.fixture
+def live():
+    store = main.PoolStore()
+    for index in range(3):
+        assert store.add(make_env(f'https://edit-{index}.example.com'))
+    return store
+
+
+def test_edits_apply_releases_before_updates(live):
+    held = live.claim('user_edit')
+    edited = make_env(held.url, password='changed')
+    changes, skipped = live.apply_edits([], [edited], ['user_edit'], {})
+    assert skipped == []
+    assert [(op, reason) for op, _, reason in changes] == [('release', None), ('add', 'updated')]
+    assert main.vault.unseal(held.url, live.available[held.url].password) == 'changed'
+    assert live.counts() == (3, 0)
+
+
+def test_edits_renew_and_remove(live):
+    held = live.claim('user_edit')
+    deadline = held.expires_at + 600
+    changes, skipped = live.apply_edits(['https://edit-1.example.com'], [], [], {'user_edit': deadline})
+    assert [op for op, _, _ in changes] == ['renew', 'remove']
+    assert skipped == []
+    assert live.in_use['user_edit'].expires_at == deadline
+    assert 'https://edit-1.example.com' not in live.urls
+
+
+def test_edits_that_no_longer_fit_are_skipped(live):
+    held = live.claim('user_edit')
+    unchanged = live.available['https://edit-1.example.com']
+    changes, skipped = live.apply_edits([held.url], [make_env(held.url), unchanged],
+                                        ['user_gone'], {'user_gone': 0})
+    assert changes == []
+    assert sorted(skipped) == [('add', held.url, 'in_use'), ('release', 'user_gone', 'not_in_use'),
+                               ('remove', held.url, 'in_use'), ('renew', 'user_gone', 'not_in_use')]
+    assert live.in_use['user_edit'] is held
+
+
+def test_hand_removed_line_leaves_the_live_pool(watcher):
+    url = 'https://reload-removed.example.com'
+    assert main.pool.add(make_env(url))
+    assert main.pool.compact()
+    with open(main.AVAILABLE_FILE, encoding='utf-8') as f:
+        lines = [line for line in f.read().split('\n') if not line.startswith(url + ' | ')]
+    with open(main.AVAILABLE_FILE, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+    assert settle(watcher)
+    assert url not in main.pool.urls
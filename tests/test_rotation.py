@@ -0,0 +1,61 @@
+import pytest
+
+import main
+from conftest import make_env
+
+URL = 'https://rotate-1.example.com'
+
+
+def release_held(store):
+    assert store.add(make_env(URL, password='old-password'))
+    assert store.claim('user_rotate')['url'] == URL
+    store.release('user_rotate')
+    assert store.rotating_urls() == [URL]
+
+
+def persist(store, compact):
+    if hasattr(store, 'flush'):
+        assert store.compact() if compact else store.flush()
+
+
+def password(store, url):
+    env = store.claim('user_after')
+    assert env['url'] == url
+    return main.vault.unseal(url, env['password'])
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_released_env_stays_held_across_restart(open_store, compact):
+    store = open_store(hold_released=True)
+    release_held(store)
+    persist(store, compact)
+
+    restarted = open_store(hold_released=True)
+    assert restarted.rotating_urls() == [URL]
+    assert restarted.claim('user_after') is None
+
+
+def test_rotation_resumes_after_restart(open_store):
+    store = open_store(hold_released=True)
+    release_held(store)
+    persist(store, compact=False)
+
+    restarted = open_store(hold_released=True)
+    rotator = main.PasswordRotator(restarted, lambda env: 'new-password')
+    rotator.rotate(URL)
+    assert restarted.rotating_urls() == []
+    persist(restarted, compact=False)
+
+    again = open_store(hold_released=True)
+    assert again.rotating_urls() == []
+    assert password(again, URL) == 'new-password'
+
+
+def test_hold_is_dropped_once_no_hook_is_set(open_store):
+    store = open_store(hold_released=True)
+    release_held(store)
+    persist(store, compact=True)
+
+    restarted = open_store(hold_released=False)
+    if open_store.backend == 'file':
+        assert password(restarted, URL) == 'old-password'
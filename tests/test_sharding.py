@@ -0,0 +1,97 @@
+import pytest
+
+import main
+
+NODES = ['http://pool-a:5000', 'http://pool-b:5000', 'http://pool-c:5000']
+URLS = [f'https://env-{index}.example.com' for index in range(3000)]
+
+
+def test_ring_owner_does_not_depend_on_node_order():
+    ring = main.HashRing(NODES)
+    shuffled = main.HashRing(list(reversed(NODES)))
+    assert all(ring.owner(url) == shuffled.owner(url) for url in URLS)
+
+
+def test_ring_spreads_keys_over_every_node():
+    ring = main.HashRing(NODES)
+    owned = {node: 0 for node in NODES}
+    for url in URLS:
+        owned[ring.owner(url)] += 1
+    for count in owned.values():
+        assert len(URLS) * 0.2 < count < len(URLS) * 0.47
+
+
+def test_ring_only_moves_keys_of_a_removed_node():
+    full = main.HashRing(NODES)
+    smaller = main.HashRing(NODES[:2])
+    for url in URLS:
+        if full.owner(url) != NODES[2]:
+            assert smaller.owner(url) == full.owner(url)
+
+
+@pytest.fixture
+def two_nodes(monkeypatch):
+    local, peer = NODES[:2]
+    monkeypatch.setattr(main, 'ring', main.HashRing([local, peer]))
+    monkeypatch.setattr(main, 'POOL_NODE', local)
+    monkeypatch.setattr(main, 'PEERS', [peer])
+    monkeypatch.setattr(main, 'PEER_ADDRESSES', {'127.0.0.1'})  # The test client's address
+    calls = []
+
+    def forward(node, method, path, body=None):
+        calls.append((node, method, path))
+        return 404, {'success': False}
+
+    monkeypatch.setattr(main, 'forward', forward)
+    return local, peer, calls
+
+
+def peer_owned_url(peer):
+    return next(url for url in URLS if main.owner_of(url) == peer)
+
+
+def test_add_is_forwarded_to_the_owner(client, two_nodes):
+    _, peer, calls = two_nodes
+    url = peer_owned_url(peer)
+    response = client.post('/api/add', json={'url': url, 'username': 'user', 'password': 'secret'})
+    assert response.status_code == 404
+    assert calls == [(peer, 'POST', '/api/add')]
+    assert url not in main.pool.urls
+
+
+def test_forwarded_add_is_served_locally(client, two_nodes):
+    _, peer, calls = two_nodes
+    url = peer_owned_url(peer)
+    response = client.post('/api/add', json={'url': url, 'username': 'user', 'password': 'secret'},
+                           headers={main.FORWARDED_HEADER: peer})
+    assert response.status_code == 200
+    assert calls == []
+    assert url in main.pool.urls
+
+
+def test_forwarded_claim_does_not_steal_again(client, two_nodes):
+    _, peer, calls = two_nodes
+    response = client.get('/api/claim?python_version=2.7')
+    assert response.status_code == 404
+    assert calls == [(peer, 'GET', '/api/claim?python_version=2.7')]
+
+    calls.clear()
+    response = client.get('/api/claim?python_version=2.7', headers={main.FORWARDED_HEADER: peer})
+    assert response.status_code == 404
+    assert calls == []
+
+
+def test_forwarded_header_from_a_client_is_ignored(client, two_nodes):
+    _, peer, calls = two_nodes
+    url = next(url for url in reversed(URLS) if main.owner_of(url) == peer)
+    response = client.post('/api/add', json={'url': url, 'username': 'user', 'password': 'secret'},
+                           headers={main.FORWARDED_HEADER: peer}, environ_base={'REMOTE_ADDR': '10.9.9.9'})
+    assert response.status_code == 404
+    assert calls == [(peer, 'POST', '/api/add')]
+    assert url not in main.pool.urls
+
+
+def test_only_peers_get_the_peer_tenant(two_nodes):
+    assert main.tenant_of('127.0.0.1', '', main.peer_forwarded('127.0.0.1', 'x')).name == 'peer:127.0.0.1'
+    assert main.tenant_of('10.9.9.9', '', main.peer_forwarded('10.9.9.9', 'x')).name == 'ip:10.9.9.9'
+    assert not main.peer_forwarded('127.0.0.1', '')
@@ -0,0 +1,66 @@
+import itertools
+import threading
+import time
+
+import main
+from conftest import make_env
+
+LEASE = int(main.LEASE_DURATION.total_seconds())
+
+
+def test_claim_is_shared_across_processes(data_dir):
+    # Two stores on one database stand in for two server processes
+    first = main.SqlitePoolStore(str(data_dir / 'pool.db'))
+    first.load()
+    second = main.SqlitePoolStore(str(data_dir / 'pool.db'))
+    second.load()
+    urls = [f'https://sqlite-{index}.example.com' for index in range(10)]
+    for url in urls:
+        assert first.add(make_env(url))
+
+    claimed = []
+
+    def claimer(store, name):
+        # Each thread gets its own connection, as a worker would
+        for attempt in itertools.count():
+            env = store.claim(f'user_{name}_{attempt}')
+            if env is None:
+                return
+            claimed.append(env['url'])
+
+    threads = [threading.Thread(target=claimer, args=(store, name))
+               for name, store in [('a', first), ('b', second), ('c', first), ('d', second)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(urls)
+    assert second.counts() == (0, 10)
+
+
+def test_claim_returns_the_leased_row(data_dir):
+    store = main.SqlitePoolStore(str(data_dir / 'pool.db'))
+    store.load()
+    assert store.add(make_env('https://sqlite-row.example.com', python_version='3.12'))
+    assert store.claim('user_none', '3.11') is None
+    env = store.claim('user_row', '3.12')
+    assert env['url'] == 'https://sqlite-row.example.com'
+    assert env['user_id'] == 'user_row'
+    assert store.lease('user_row')['expires_at'] == env['expires_at']
+
+
+def test_expire_releases_only_due_leases(store):
+    for index in range(3):
+        assert store.add(make_env(f'https://expire-{index}.example.com'))
+    now = time.time()
+    for index in range(3):
+        assert store.claim(f'user_expire_{index}')
+    store.renew('user_expire_1', 2 * LEASE)
+    store.release('user_expire_2')
+
+    assert store.expire(now) == []
+    expired = store.expire(now + LEASE + 5)
+    assert [env['user_id'] for env in expired] == ['user_expire_0']
+    assert store.counts() == (2, 1)
+    assert store.lease('user_expire_1') is not None
+    assert store.expire(now + LEASE + 5) == []
@@ -0,0 +1,61 @@
+import pytest
+
+import main
+from conftest import make_env
+
+URL = 'https://vault-1.example.com'
+
+
+@pytest.fixture
+def vault(tmp_path):
+    vault = main.Vault(key_file=str(tmp_path / 'vault.key'))
+    vault.load()
+    return vault
+
+
+def test_sealed_password_opens_for_its_url(vault):
+    sealed = vault.seal(URL, 'hunter2')
+    assert vault.sealed(sealed) and 'hunter2' not in sealed
+    assert vault.unseal(URL, sealed) == 'hunter2'
+    assert vault.seal(URL, sealed) == sealed  # Already sealed
+
+
+def test_sealed_password_does_not_open_for_another_url(vault):
+    sealed = vault.seal(URL, 'hunter2')
+    with pytest.raises(main.VaultError):
+        vault.unseal('https://vault-2.example.com', sealed)
+
+
+def test_key_is_kept_for_the_next_start(vault, tmp_path):
+    sealed = vault.seal(URL, 'hunter2')
+    restarted = main.Vault(key_file=vault.key_file)
+    restarted.load()
+    assert restarted.unseal(URL, sealed) == 'hunter2'
+    other = main.Vault(key_file=str(tmp_path / 'other.key'))
+    other.load()
+    with pytest.raises(main.VaultError):
+        other.unseal(URL, sealed)
+
+
+def test_plaintext_passes_through(vault):
+    assert vault.unseal(URL, 'from-before-the-vault') == 'from-before-the-vault'
+    vault.load(sealing=False)
+    assert vault.seal(URL, 'hunter2') == 'hunter2'
+
+
+def test_opened_passwords_are_cached(vault):
+    sealed = vault.seal(URL, 'hunter2')
+    for _ in range(3):
+        assert vault.unseal(URL, sealed) == 'hunter2'
+    assert (vault.hits, vault.misses) == (2, 1)
+
+
+def test_pool_files_hold_no_plaintext(vault, data_dir, monkeypatch):
+    monkeypatch.setattr(main, 'vault', vault)
+    store = main.PoolStore()
+    store.load()
+    assert store.add(make_env(URL, password='hunter2'))
+    assert store.flush() and store.compact()
+    for path in data_dir.iterdir():
+        assert 'hunter2' not in path.read_text(encoding='utf-8')
+    assert vault.unseal(URL, store.claim('user_vault')['password']) == 'hunter2'
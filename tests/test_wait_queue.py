@@ -0,0 +1,88 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+import main
+from conftest import make_env
+
+urls = (f'https://wait-{index}.example.com' for index in itertools.count())
+
+
+@pytest.fixture
+def queue(store):
+    return main.WaitQueue(store)
+
+
+def waiting(queue, timeout=5):
+    """Long-poll from another thread; returns the thread and its result."""
+    result = {}
+
+    def run():
+        result['env'], result['waiter'] = queue.wait(None, None, timeout)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while not len(queue):
+        time.sleep(0.01)
+    return thread, result
+
+
+def test_release_hands_env_to_long_poller(queue):
+    assert queue.store.add(make_env(next(urls)))
+    holder = queue.claim('user_holder')
+    thread, result = waiting(queue)
+
+    queue.store.release(holder['user_id'])
+    queue.dispatch()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert result['env']['url'] == holder['url']
+    assert queue.store.counts() == (0, 1)
+
+
+def test_waiters_are_served_in_arrival_order(queue):
+    first = queue.join(None, None)[1]
+    second = queue.join(None, None)[1]
+    assert queue.position(second) == 2
+    assert queue.store.add(make_env(next(urls)))
+    queue.dispatch()
+    assert first.env is not None and second.env is None
+    assert queue.position(second) == 1
+    assert queue.claim('user_cut_in') is None  # Freed envs go to waiters before plain claims
+
+
+def test_timed_out_waiter_keeps_its_place_with_its_ticket(queue):
+    env, waiter = queue.wait(None, None, 0.01)
+    assert env is None and waiter.detached_at is not None
+    assert queue.store.add(make_env(next(urls)))
+    queue.dispatch()
+    env, _ = queue.wait(None, None, 0.01, ticket=waiter.ticket)
+    assert env is not None
+    assert len(queue) == 0
+
+
+def test_env_handed_to_a_waiter_that_left_goes_back(queue):
+    waiter = queue.join(None, None)[1]
+    url = next(urls)
+    assert queue.store.add(make_env(url))
+    queue.dispatch()
+    assert waiter.env is not None
+    queue.cancel(waiter.ticket)
+    assert queue.store.counts() == (1, 0)
+    assert queue.claim('user_next')['url'] == url
+
+
+def test_long_poll_over_http(client):
+    args = {'python_version': '3.99', 'wait': 0.05}
+    response = client.get('/api/claim', query_string=args)
+    assert response.status_code == 404
+    ticket = response.get_json()['ticket']
+
+    url = next(urls)
+    assert client.post('/api/add', json={'url': url, 'username': 'user', 'password': 'secret',
+                                         'python_version': '3.99'}).status_code == 200
+    response = client.get('/api/claim', query_string=dict(args, ticket=ticket, wait=1))
+    assert response.status_code == 200
+    assert response.get_json()['env']['url'] == url